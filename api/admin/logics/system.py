@@ -7,118 +7,171 @@
 from datetime import datetime
 
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy import select
+from sqlalchemy import select, update, delete
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
-import models.user
 from api.admin.schemas import system_schemas
-from config import settings
-from core.curd import get_filter_where, order_by
+from core import tree
+from core.curd import get_filter_where, order_by, get_count, keyset_paginate, keyset_next_cursor
+from core.count import get_total
+from core.database import use_primary
 from core.exception import CustomException
-from models.user import User, Role, Menu, Department
+from core.resources import register_warmup
+from core.serializer import compile_serializer
+from models.user import User, Role, Menu, Department, user_roles, role_menus, department_closure
+from services import auth, data_scope, export, menu_cache, password
 from utils import helpers
 
 
-def create_user(db, form_data):
-    exists = db.query(User).filter_by(telephone=form_data.telephone).count()
+async def create_user(db: AsyncSession, form_data):
+    exists = await get_count(db, select(User).where(User.telephone == form_data.telephone))
     if exists:
         raise CustomException("Phone number already exists")
 
     if not form_data.password:
-        if settings.DEFAULT_PASSWORD == "0":
-            form_data.password = form_data.telephone[5:12]
-        else:
-            form_data.password = settings.DEFAULT_PASSWORD
+        form_data.password = password.default_password(form_data.telephone)
 
-    form_data.password = User.get_password_hash(form_data.password)
+    form_data.password = await password.hash_password(form_data.password)
     try:
         user = User(**form_data.model_dump(exclude={'role_ids', "dept_ids"}))
 
         if form_data.role_ids:
-            roles = db.query(Role).filter(Role.id.in_(form_data.role_ids)).all()
+            roles = await db.scalars(select(Role).where(Role.id.in_(form_data.role_ids)))
             for role in roles:
                 user.roles.add(role)
         if form_data.dept_ids:
-            departments = db.query(Department).filter(Department.id.in_(form_data.dept_ids)).all()
+            departments = await db.scalars(select(Department).where(Department.id.in_(form_data.dept_ids)))
             for dept in departments:
                 user.departments.add(dept)
 
         db.add(user)
-        db.commit()
+        await db.commit()
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         raise CustomException(str(e))
 
 
-def put_user(db, u, data_id, form_data):
-    user = db.query(User).filter_by(id=data_id).first()
+async def put_user(db: AsyncSession, u, data_id, form_data):
+    sql = select(User).where(User.id == data_id).options(selectinload(User.roles), selectinload(User.departments))
+    user = await db.scalar(sql)
     if not user:
         raise CustomException("User does not exist")
 
-    exists = db.query(User).filter(User.id != data_id, User.telephone == form_data.telephone).count()
+    exists = await get_count(db, select(User).where(User.id != data_id, User.telephone == form_data.telephone))
     if exists:
         raise CustomException("This phone number is already used by another user")
     if not form_data.password:
-        if settings.DEFAULT_PASSWORD == "0":
-            form_data.password = form_data.telephone[5:12]
-        else:
-            form_data.password = settings.DEFAULT_PASSWORD
+        form_data.password = password.default_password(form_data.telephone)
 
-    form_data.password = User.get_password_hash(form_data.password)
+    form_data.password = await password.hash_password(form_data.password)
     try:
         data = form_data.model_dump(exclude={'role_ids', 'dept_ids'})
 
         for key, value in data.items():
             if key in User.get_column_attrs():
                 setattr(user, key, value)  # 使用setattr动态设置属性
+        user.auth_version = (user.auth_version or 0) + 1
 
         user.roles.clear()
         user.departments.clear()
         if form_data.role_ids:
-            roles = db.query(Role).filter(Role.id.in_(form_data.role_ids)).all()
+            roles = await db.scalars(select(Role).where(Role.id.in_(form_data.role_ids)))
             for role in roles:
                 user.roles.add(role)
 
         if form_data.dept_ids:
-            departments = db.query(Department).filter(Department.id.in_(form_data.dept_ids)).all()
+            departments = await db.scalars(select(Department).where(Department.id.in_(form_data.dept_ids)))
             for dept in departments:
                 user.departments.add(dept)
-        db.commit()
+        await db.commit()
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         raise CustomException(str(e))
+    await auth.clear_user_auth_cache_async([data_id])
+    # The password is always rewritten, sessions started with the old one end here
+    await auth.revoke_refresh_tokens([data_id])
 
 
-def get_user_list(db, u, params):
-    query = db.query(User)
+def _user_query(u, params):
+    sql = select(User)
     conditions = get_filter_where(User, **params.to_where())
+    scope = data_scope.user_scope(u)
+    if scope is not None:
+        conditions.append(scope)
     if conditions:
-        query = query.filter(*conditions)
+        sql = sql.where(*conditions)
+    return sql
 
-    query = order_by(query, User, params.dict())
-    total = query.count()
-    query = query.options(joinedload(User.roles))
-    records = query.offset(params.offset).limit(params.limit).all()
+
+_user_row = compile_serializer(system_schemas.UserResponse)
+
+
+async def get_user_list(db: AsyncSession, u, params):
+    sql = _user_query(u, params)
+    total, count_strategy = await get_total(db, sql, User, params.v_count)
+    sql = sql.options(selectinload(User.roles))
+    page = params.dict()
+    next_cursor = None
+    if params.v_cursor is None:
+        sql = order_by(sql, User, page).offset(params.offset).limit(params.limit)
+        records = (await db.scalars(sql)).all()
+    else:
+        records = (await db.scalars(keyset_paginate(sql, User, page))).all()
+        records, next_cursor = keyset_next_cursor(records, User, page)
     result = []
     for item in records:
-        r = system_schemas.UserResponse.model_validate(item).model_dump()
+        r = _user_row(item)
         r['created_at'] = helpers.date2str(item.created_at)
         r['roles'] = [{"id": role.id, "name": role.name, "key": role.role_key} for role in item.roles]
         result.append(r)
 
-    return total, result
+    return total, result, next_cursor, count_strategy
+
+
+USER_EXPORT_FIELDS = ["id", "telephone", "name", "nickname", "gender", "disabled", "is_staff", "role_ids", "dept_ids",
+                      "roles", "created_at"]
+
 
+def _user_export_row(item: User) -> dict:
+    roles = sorted(item.roles, key=lambda role: role.id)
+    return {"id": item.id, "telephone": item.telephone, "name": item.name, "nickname": item.nickname,
+            "gender": item.gender, "disabled": item.disabled, "is_staff": item.is_staff,
+            "role_ids": "|".join(str(role.id) for role in roles),
+            "dept_ids": "|".join(str(dept_id) for dept_id in sorted(dept.id for dept in item.departments)),
+            "roles": "|".join(role.name for role in roles), "created_at": helpers.date2str(item.created_at)}
 
-def get_role_list(db, u, params):
-    query = db.query(Role)
+
+def export_users(u, params, fmt: str):
+    """
+    Stream every user matching the list filters in the bulk import format, the import skips id, roles and
+    created_at
+    """
+    sql = _user_query(u, params).options(selectinload(User.roles), selectinload(User.departments))
+    return export.export_response(sql, User, params.dict(), USER_EXPORT_FIELDS, _user_export_row, fmt, "users")
+
+
+def _role_query(params):
+    sql = select(Role)
     conditions = get_filter_where(Role, **params.to_where())
     if conditions:
-        query = query.filter(*conditions)
-
-    query = order_by(query, Role, params.dict())
-    total = query.count()
-    records = query.offset(params.offset).limit(params.limit).all()
+        sql = sql.where(*conditions)
+    return sql
+
+
+async def get_role_list(db: AsyncSession, u, params):
+    sql = _role_query(params)
+    total, count_strategy = await get_total(db, sql, Role, params.v_count)
+    sql = sql.options(selectinload(Role.menus))
+    page = params.dict()
+    next_cursor = None
+    if params.v_cursor is None:
+        sql = order_by(sql, Role, page).offset(params.offset).limit(params.limit)
+        records = (await db.scalars(sql)).all()
+    else:
+        records = (await db.scalars(keyset_paginate(sql, Role, page))).all()
+        records, next_cursor = keyset_next_cursor(records, Role, page)
     result = []
     for item in records:
         tmp = {"id": item.id, "role_key": item.role_key, "name": item.name, "disabled": item.disabled,
@@ -128,11 +181,31 @@ def get_role_list(db, u, params):
                'updated_at': helpers.date2str(item.updated_at)}
         result.append(tmp)
 
-    return total, result
+    return total, result, next_cursor, count_strategy
+
+
+ROLE_EXPORT_FIELDS = ["id", "role_key", "name", "disabled", "order", "desc", "is_admin", "menu_ids", "created_at",
+                      "updated_at"]
+
+
+def _role_export_row(item: Role) -> dict:
+    menu_ids = sorted(menu.id for menu in item.menus if menu.parent_id is not None)
+    return {"id": item.id, "role_key": item.role_key, "name": item.name, "disabled": item.disabled,
+            "order": item.order, "desc": item.desc, "is_admin": item.is_admin,
+            "menu_ids": "|".join(str(menu_id) for menu_id in menu_ids),
+            "created_at": helpers.date2str(item.created_at), "updated_at": helpers.date2str(item.updated_at)}
+
+
+def export_roles(params, fmt: str):
+    """
+    Stream every role matching the list filters
+    """
+    sql = _role_query(params).options(selectinload(Role.menus))
+    return export.export_response(sql, Role, params.dict(), ROLE_EXPORT_FIELDS, _role_export_row, fmt, "roles")
 
 
-def create_role(db, u, form_data):
-    exists = db.query(Role).filter_by(role_key=form_data.role_key).count()
+async def create_role(db: AsyncSession, u, form_data):
+    exists = await get_count(db, select(Role).where(Role.role_key == form_data.role_key))
     if exists:
         raise CustomException(f"Role {form_data.role_key} already exists")
 
@@ -141,31 +214,33 @@ def create_role(db, u, form_data):
         role.menus.clear()
         role.departments.clear()
         if form_data.menu_ids:
-            menus = db.query(Menu).filter(Menu.id.in_(form_data.menu_ids)).all()
+            menus = await db.scalars(select(Menu).where(Menu.id.in_(form_data.menu_ids)))
             for menu in menus:
                 role.menus.add(menu)
 
         if form_data.dept_ids:
-            departments = db.query(Department).filter(Department.id.in_(form_data.dept_ids)).all()
+            departments = await db.scalars(select(Department).where(Department.id.in_(form_data.dept_ids)))
             for dept in departments:
                 role.departments.add(dept)
 
         db.add(role)
-        db.commit()
+        await db.commit()
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         raise CustomException(str(e))
 
 
-def put_role(db, u, data_id, form_data):
-    role = db.query(Role).filter_by(id=data_id).first()
+async def put_role(db: AsyncSession, u, data_id, form_data):
+    sql = select(Role).where(Role.id == data_id).options(selectinload(Role.menus), selectinload(Role.departments))
+    role = await db.scalar(sql)
     if not role:
         raise CustomException("Role does not exist")
 
-    exists = db.query(Role).filter(Role.id != data_id, Role.role_key == form_data.role_key).count()
+    exists = await get_count(db, select(Role).where(Role.id != data_id, Role.role_key == form_data.role_key))
     if exists:
         raise CustomException(f"Role {form_data.role_key} already exists")
 
+    user_ids = await get_role_user_ids(db, data_id)
     try:
         data = form_data.model_dump(exclude={'menu_ids', 'dept_ids'})
         for key, value in data.items():
@@ -174,36 +249,54 @@ def put_role(db, u, data_id, form_data):
         role.menus.clear()
         role.departments.clear()
         if form_data.menu_ids:
-            menus = db.query(Menu).filter(Menu.id.in_(form_data.menu_ids)).all()
+            menus = await db.scalars(select(Menu).where(Menu.id.in_(form_data.menu_ids)))
             for menu in menus:
                 role.menus.add(menu)
 
         if form_data.dept_ids:
-            departments = db.query(Department).filter(Department.id.in_(form_data.dept_ids)).all()
+            departments = await db.scalars(select(Department).where(Department.id.in_(form_data.dept_ids)))
             for dept in departments:
                 role.departments.add(dept)
 
-        db.commit()
+        await auth.bump_user_versions(db, user_ids)
+        await db.commit()
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         raise CustomException(str(e))
+    await menu_cache.invalidate(menu_cache.role_tag(data_id))
+    await auth.clear_user_auth_cache_async(user_ids)
+
+
+async def get_role_user_ids(db: AsyncSession, role_id) -> list[int]:
+    """
+    Get ids of the users holding a role
+    :param db: database session
+    :param role_id: role id
+    :return: user ids
+    """
+    return list((await db.scalars(select(user_roles.c.user_id).where(user_roles.c.role_id == role_id))).all())
 
 
-def delete_role(db, u, data_id):
-    role = db.query(Role).options(joinedload(Role.menus)).get(data_id)
+async def delete_role(db: AsyncSession, u, data_id):
+    sql = select(Role).where(Role.id == data_id).options(selectinload(Role.menus), selectinload(Role.departments))
+    role = await db.scalar(sql)
     if role is None:
         raise CustomException("Role does not exist")
+    user_ids = await get_role_user_ids(db, data_id)
     try:
         role.departments.clear()
         role.menus.clear()
-        db.delete(role)
-        db.commit()
+        await db.delete(role)
+        await auth.bump_user_versions(db, user_ids)
+        await db.commit()
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         raise CustomException(str(e))
+    await menu_cache.invalidate(menu_cache.role_tag(data_id))
+    await auth.clear_user_auth_cache_async(user_ids)
 
 
-def get_menu_list(db, u, mode: int):
+async def get_menu_list(db: AsyncSession, u, mode: int):
     """
     1: Get menu tree list
     2: Get menu tree list for role menu permission assignment
@@ -211,77 +304,139 @@ def get_menu_list(db, u, mode: int):
     :param mode: operation mode
     :return: menu tree
     """
-    if mode == 3:
-        sql = select(Menu).where(Menu.disabled == 0, Menu.deleted_at.is_(None))
-    else:
-        sql = select(Menu).where(Menu.deleted_at.is_(None))
-    queryset = db.scalars(sql)
-    datas = list(queryset.all())
-    roots = filter(lambda i: not i.parent_id, datas)
-    if mode == 1:
-        menus = generate_menu_tree_list(datas, roots)
-    elif mode == 2:
-        menus = generate_menu_tree_options(datas, roots)
-    else:
+    if mode not in (1, 2):
+        raise CustomException("get menu list error")
+    return await menu_cache.get_or_load(
+        menu_cache.list_key(mode),
+        [menu_cache.MENUS_TAG],
+        lambda: _load_menu_list(db, mode)
+    )
+
+
+async def _load_menu_list(db: AsyncSession, mode: int) -> list:
+    # Cached trees are read from the primary, a lagging replica would cache the menus before a write
+    use_primary(db)
+    queryset = await db.scalars(select(Menu).where(Menu.deleted_at.is_(None)))
+    return tree.build_tree(queryset.all(), menu_tree_node if mode == 1 else menu_option_node)
+
+
+async def get_menu_children(db: AsyncSession, u, data_id: int, mode: int, params):
+    """
+    Direct children of a menu with their child counts
+    :param db: database session
+    :param data_id: menu id, 0 for top-level menus
+    :param mode: 1: menu list fields, 2: options
+    :param params: paging
+    :return: total, menus
+    """
+    return await _lazy_children(db, Menu, data_id, _active, _menu_node(mode), params)
+
+
+async def get_menu_subtree(db: AsyncSession, u, data_id: int, mode: int, depth: int):
+    """
+    Menu subtree limited to a number of levels
+    :param db: database session
+    :param data_id: menu id, 0 for every top-level menu
+    :param mode: 1: menu list fields, 2: options
+    :param depth: levels below the menu
+    :return: menu tree
+    """
+    cte = tree.subtree_cte(Menu, data_id or None, depth if data_id else depth - 1)
+    return await _lazy_subtree(db, Menu, select(cte.c.id), data_id, _active, _menu_node(mode))
+
+
+async def get_menu_path(db: AsyncSession, u, data_id: int, mode: int):
+    """
+    Menus from the top level down to a menu
+    :param db: database session
+    :param data_id: menu id
+    :param mode: 1: menu list fields, 2: options
+    :return: menus, root first
+    """
+    cte = tree.path_cte(Menu, data_id)
+    return await _lazy_path(db, Menu, select(cte.c.id), data_id, _menu_node(mode))
+
+
+def _menu_node(mode: int):
+    if mode not in (1, 2):
         raise CustomException("get menu list error")
-    return Menu.menus_order(menus)
+    return menu_tree_node if mode == 1 else menu_option_node
 
 
-def get_user_menu_tree(db, user: User):
+async def get_user_menu_tree(db: AsyncSession, user: auth.Principal):
     """
     Get user menu tree
     :param db: database session
-    :param user: user object
+    :param user: current user principal
     :return: menu tree for the user
     """
-    if any([i.is_admin for i in user.roles]):
+    return await menu_cache.get_or_load(
+        menu_cache.router_key(user.is_admin, user.role_ids),
+        menu_cache.router_tags(user.is_admin, user.role_ids),
+        lambda: _load_router_tree(db, user.is_admin, user.role_ids)
+    )
+
+
+async def _load_router_tree(db: AsyncSession, is_admin: bool, role_ids: list[int]) -> list:
+    use_primary(db)
+    if is_admin:
         sql = select(Menu).where(Menu.disabled == 0, Menu.menu_type.in_([0, 1]), Menu.deleted_at.is_(None))
-        queryset = db.scalars(sql)
-        datas = list(queryset.all())
     else:
-        options = [joinedload(User.roles).subqueryload(Role.menus)]
-        user = db.query(User).options(options).get(user.id)
-        datas = set()
-        for role in user.roles:
-            for menu in role.menus:
-                # Non-disabled and visible menus
-                if not menu.disabled:
-                    datas.add(menu)
-    roots = filter(lambda i: not i.parent_id, datas)
-    menus = generate_router_tree(datas, roots)
-    return Menu.menus_order(menus, 'index')
-
-
-def create_menu(db, u, form_data):
+        # Non-disabled and visible menus of the user roles
+        sql = select(Menu).join(role_menus, role_menus.c.menu_id == Menu.id).where(
+            role_menus.c.role_id.in_(role_ids),
+            Menu.disabled == 0
+        ).distinct()
+    queryset = await db.scalars(sql)
+    return tree.build_tree(queryset.all(), _router_node)
+
+
+async def _warm_menus(db: AsyncSession) -> None:
+    await get_menu_list(db, None, 1)
+    await get_menu_list(db, None, 2)
+    await menu_cache.get_or_load(
+        menu_cache.router_key(True, []),
+        menu_cache.router_tags(True, []),
+        lambda: _load_router_tree(db, True, [])
+    )
+
+
+register_warmup("menus", _warm_menus)
+
+
+async def create_menu(db: AsyncSession, u, form_data):
     if form_data.parent_id == 0:
         form_data.parent_id = None
 
-    exists = db.query(Menu).filter(Menu.path == form_data.path).count()
+    exists = await get_count(db, select(Menu).where(Menu.path == form_data.path))
     if exists:
         raise CustomException("路由地址不能重复")
 
     menu = Menu(**form_data.model_dump())
     db.add(menu)
-    db.commit()
+    await db.commit()
+    await menu_cache.invalidate(menu_cache.MENUS_TAG)
 
 
-def delete_menu(db, u, data_id):
-    menu = db.query(Menu).get(data_id)
+async def delete_menu(db: AsyncSession, u, data_id):
+    menu = await db.get(Menu, data_id)
     if not menu:
         raise CustomException("菜单不存在")
-    exists = db.query(Menu).filter(Menu.parent_id == menu.id).count()
+    exists = await get_count(db, select(Menu).where(Menu.parent_id == data_id))
     if exists:
         raise CustomException("存在子菜单，不能删除")
-    db.delete(menu)
-    db.commit()
+    await db.delete(menu)
+    await db.commit()
+    await menu_cache.invalidate(menu_cache.MENUS_TAG)
+    await auth.clear_user_auth_cache_async()
 
 
-def put_menu(db, u, data_id, form_data):
-    menu = db.query(Menu).filter_by(id=data_id).first()
+async def put_menu(db: AsyncSession, u, data_id, form_data):
+    menu = await db.get(Menu, data_id)
     if not menu:
         raise CustomException("该菜单不存在")
 
-    exists = db.query(Menu).filter(Menu.path == form_data.path, Menu.id != data_id).count()
+    exists = await get_count(db, select(Menu).where(Menu.path == form_data.path, Menu.id != data_id))
     if exists:
         raise CustomException("路由地址不能重复")
 
@@ -292,10 +447,12 @@ def put_menu(db, u, data_id, form_data):
     for key, value in data.items():
         if key in Menu.get_column_attrs():
             setattr(menu, key, value)
-    db.commit()
+    await db.commit()
+    await menu_cache.invalidate(menu_cache.MENUS_TAG)
+    await auth.clear_user_auth_cache_async()
 
 
-async def get_department_list(db, u, mode):
+async def get_department_list(db: AsyncSession, u, mode):
     """
     Get department list information
     :param db: database session
@@ -309,18 +466,66 @@ async def get_department_list(db, u, mode):
         sql = select(Department).where(Department.deleted_at.is_(None))
 
     queryset = await db.scalars(sql)
-    datas = list(queryset.all())
-    roots = filter(lambda i: not i.parent_id, datas)
     if mode == 1:
-        departments = generate_department_tree_list(datas, roots)
+        return tree.build_tree(queryset.all(), department_tree_node)
     elif mode == 2 or mode == 3:
-        departments = generate_department_tree_options(datas, roots)
+        return tree.build_tree(queryset.all(), department_option_node)
+    raise CustomException("get department list error")
+
+
+async def get_department_children(db: AsyncSession, u, data_id: int, mode: int, params):
+    """
+    Direct children of a department with their child counts
+    :param db: database session
+    :param data_id: department id, 0 for top-level departments
+    :param mode: 1: list fields, 2: options, 3: options of enabled departments
+    :param params: paging
+    :return: total, departments
+    """
+    return await _lazy_children(db, Department, data_id, _department_filter(mode), _department_node(mode), params)
+
+
+async def get_department_subtree(db: AsyncSession, u, data_id: int, mode: int, depth: int):
+    """
+    Department subtree limited to a number of levels, read through the closure table
+    :param db: database session
+    :param data_id: department id, 0 for every top-level department
+    :param mode: 1: list fields, 2: options, 3: options of enabled departments
+    :param depth: levels below the department
+    :return: department tree
+    """
+    if data_id:
+        ids = department_closure.descendants(data_id, max_depth=depth)
     else:
+        roots = select(Department.id).where(Department.parent_id.is_(None))
+        ids = department_closure.descendants(roots, max_depth=depth - 1)
+    return await _lazy_subtree(db, Department, ids, data_id, _department_filter(mode), _department_node(mode))
+
+
+async def get_department_path(db: AsyncSession, u, data_id: int, mode: int):
+    """
+    Departments from the top level down to a department, read through the closure table
+    :param db: database session
+    :param data_id: department id
+    :param mode: 1: list fields, 2 and 3: options
+    :return: departments, root first
+    """
+    return await _lazy_path(db, Department, department_closure.ancestors(data_id), data_id, _department_node(mode))
+
+
+def _department_filter(mode: int):
+    if mode == 3:
+        return lambda table: [table.deleted_at.is_(None), table.disabled == 0]
+    return _active
+
+
+def _department_node(mode: int):
+    if mode not in (1, 2, 3):
         raise CustomException("get department list error")
-    return Department.dept_order(departments)
+    return department_tree_node if mode == 1 else department_option_node
 
 
-def create_department(db, u, form_data):
+async def create_department(db: AsyncSession, u, form_data):
     """
     Create department information
     :param form_data: department data
@@ -333,25 +538,27 @@ def create_department(db, u, form_data):
 
     dp = Department(**form_data.model_dump())
     db.add(dp)
-    db.commit()
+    await db.commit()
 
 
-def put_department(db, u, data_id, form_data):
-    dp = db.query(Department).get(data_id)
+async def put_department(db: AsyncSession, u, data_id, form_data):
+    dp = await db.get(Department, data_id)
     if not dp:
         raise CustomException("Department does not exist, cannot edit")
 
     if form_data.parent_id == 0:
         form_data.parent_id = None
+    if form_data.parent_id and await department_closure.is_descendant(db, form_data.parent_id, data_id):
+        raise CustomException("A department cannot be moved under itself or its children")
 
     obj_dict = jsonable_encoder(form_data)
     for key, value in obj_dict.items():
         setattr(dp, key, value)
 
-    db.commit()
+    await db.commit()
 
 
-def delete_department(db, ids, v_soft):
+async def delete_department(db: AsyncSession, ids, v_soft):
     """
     Delete department
     :param db: database session
@@ -360,98 +567,82 @@ def delete_department(db, ids, v_soft):
     :return: None
     """
     if v_soft:
-        db.query(Department).filter(Department.id.in_(ids)).update({"deleted_at": datetime.now()})
+        sql = update(Department).where(Department.id.in_(ids)).values(deleted_at=datetime.now())
     else:
-        db.query(Department).filter(Department.id.in_(ids)).delete()
-    db.commit()
+        await db.execute(department_closure.delete_nodes(ids))
+        sql = delete(Department).where(Department.id.in_(ids))
+    await db.execute(sql.execution_options(synchronize_session=False))
+    await db.commit()
+
+
+_router_row = compile_serializer(system_schemas.RouterOut, exclude={"name", "meta", "index", "children"})
+
+
+def _router_node(item: Menu, children: list) -> dict:
+    data = _router_row(item)
+    data["name"] = item.name
+    data["meta"] = {
+        "title": item.title,
+        "icon": item.icon,
+        "keepAlive": item.no_cache,
+        "hideInMenu": item.hidden,
+        "affixTab": item.affix,
+        "order": item.order
+    }
+    data["index"] = item.order
+    data["children"] = children
+    return data
 
 
-def generate_department_tree_list(departments: list[models.user.Department], nodes: filter) -> list:
-    """
-    Generate department tree list
-    :param departments: all department list
-    :param nodes: node department list
-    :return: department tree list
-    """
-    data = []
-    for root in nodes:
-        router = system_schemas.DeptTreeListOut.model_validate(root)
-        sons = filter(lambda i: i.parent_id == root.id, departments)
-        router.children = generate_department_tree_list(departments, sons)
-        data.append(router.model_dump())
-    return data
+menu_tree_node = tree.schema_serializer(system_schemas.MenuTreeResponse)
+menu_option_node = tree.options_serializer("title")
+department_tree_node = tree.schema_serializer(system_schemas.DeptTreeListOut)
+department_option_node = tree.options_serializer("name")
 
 
-def generate_department_tree_options(departments: list[models.user.Department], nodes: filter) -> list:
-    """
-    Generate department tree options
-    :param departments: all department list
-    :param nodes: node department list
-    :return: department tree options
-    """
-    data = []
-    for root in nodes:
-        router = {"value": root.id, "label": root.name, "order": root.order}
-        sons = filter(lambda i: i.parent_id == root.id, departments)
-        router["children"] = generate_department_tree_options(departments, sons)
-        data.append(router)
-    return data
+def _active(table) -> list:
+    return [table.deleted_at.is_(None)]
 
 
-def generate_router_tree(menus: list[Menu], nodes: filter):
-    """
-    generate router tr
-    :param menus: menus list
-    :param nodes: node menu list
-    :return:
-    """
+def _counted(serialize: tree.Serializer, counts: dict[int, int]) -> tree.Serializer:
+    def node(item, children: list) -> dict:
+        data = serialize(item, children)
+        data["child_count"] = counts[item.id]
+        return data
 
-    data = []
-    for root in nodes:
-        router = system_schemas.RouterOut.model_validate(root)
-        router.name = root.name
-        router.index = root.order
-        router.meta = system_schemas.Meta(
-            title=root.title,
-            icon=root.icon,
-            hideInMenu=root.hidden,
-            affixTab=root.affix,
-            order=root.order,
-            keepAlive=root.no_cache
-        )
-        sons = filter(lambda i: i.parent_id == root.id, menus)
-        router.children = generate_router_tree(menus, sons)
-        data.append(router.model_dump())
-    return data
+    return node
 
 
-def generate_menu_tree_list(menus: list, nodes: filter) -> list:
-    """
-    Generate menu tree list
-    :param menus: all menu list
-    :param nodes: node menu list
-    :return: menu tree list
-    """
-    data = []
-    for root in nodes:
-        router = system_schemas.MenuTreeResponse.from_orm(root)
-        sons = filter(lambda i: i.parent_id == root.id, menus)
-        router.children = generate_menu_tree_list(menus, sons)
-        data.append(router.model_dump())
-    return data
+async def _lazy_children(db: AsyncSession, model, data_id: int, where, serialize: tree.Serializer, params):
+    sql = tree.children_statement(model, data_id or None, where)
+    total = await get_count(db, sql.with_only_columns(model.id))
+    sql = sql.order_by(model.order, model.id).offset(params.offset).limit(params.limit)
+    rows = (await db.execute(sql)).all()
+    node = _counted(serialize, {item.id: count for item, count in rows})
+    return total, [node(item, []) for item, _ in rows]
 
 
-def generate_menu_tree_options(menus: list, nodes: filter):
-    """
-    Generate menu tree options
-    :param menus: all menu list
-    :param nodes: node menu list
-    :return: menu tree options
-    """
-    data = []
-    for root in nodes:
-        router = {"value": root.id, "label": root.title, "order": root.order}
-        sons = filter(lambda i: i.parent_id == root.id, menus)
-        router["children"] = generate_menu_tree_options(menus, sons)
-        data.append(router)
-    return data
+async def _lazy_subtree(db: AsyncSession, model, ids, data_id: int, where, serialize: tree.Serializer) -> list:
+    sql = select(model, tree.child_count(model, where)).where(model.id.in_(ids), *where(model))
+    rows = (await db.execute(sql)).all()
+    items = [item for item, _ in rows]
+    root = None
+    if data_id:
+        top = next((item for item in items if item.id == data_id), None)
+        if top is None:
+            raise CustomException(f"{model.__name__} does not exist")
+        root = top.parent_id
+    return tree.build_tree(items, _counted(serialize, {item.id: count for item, count in rows}), root=root)
+
+
+async def _lazy_path(db: AsyncSession, model, ids, data_id: int, serialize: tree.Serializer) -> list:
+    items = {item.id: item for item in await db.scalars(select(model).where(model.id.in_(ids)))}
+    if data_id not in items:
+        raise CustomException(f"{model.__name__} does not exist")
+    path = []
+    node_id = data_id
+    while node_id in items and len(path) < tree.MAX_DEPTH:
+        path.append(serialize(items[node_id], []))
+        node_id = items[node_id].parent_id
+    return path[::-1]
+
@@ -25,6 +25,7 @@ class UserParams(QueryParams):
             self,
             name: Union[str, None] = Query(None, description="User name"),
             telephone: Union[str, None] = Query(None, description="Phone number"),
+            telephone_suffix: Union[str, None] = Query(None, description="Phone number ending, ignored when telephone is given"),
             disabled: Union[bool, None] = Query(None, description="Whether disabled"),
             is_staff: Union[bool, None] = Query(None, description="Whether staff"),
             params: Paging = Depends()
@@ -32,6 +33,8 @@ class UserParams(QueryParams):
         super().__init__(params)
         self.name = ("like", name)
         self.telephone = ("like", telephone)
+        if telephone_suffix and not telephone:
+            self.telephone = ("endswith", telephone_suffix)
         self.disabled = disabled
         self.is_staff = is_staff
 
@@ -78,7 +78,12 @@ class MenuTreeResponse(Menu):
 class Role(BaseModel):
     role_key: str = Field(..., description="Role key")
     name: str = Field(..., description="Role name")
-    data_range: int = Field(default=0, description="Role data scope (reserved)")
+    data_range: int = Field(
+        default=4,
+        ge=1,
+        le=5,
+        description="Data scope: 1=all, 2=custom departments, 3=own department, 4=own department and children, 5=self"
+    )
     disabled: bool = Field(default=False, description="Whether disabled")
     order: int = Field(default=0, description="Sort order")
     desc: str = Field(default='',description="Description")
@@ -25,6 +25,10 @@ class RegisterUser(BaseModel):
     confirm_password: str = Field(..., description="confirm password")
 
 
+class RefreshToken(BaseModel):
+    refresh_token: str = Field(..., description="refresh token issued on login")
+
+
 class Token(BaseModel):
     access_token: str = Field(..., description='login Token')
     token_type: str = Field(..., description="jwt token_type")
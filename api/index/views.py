@@ -14,14 +14,15 @@ from starlette.requests import Request
 from api.index.schemas import request_schemas
 from core.database import get_db, get_cache, get_async_db
 from core.response import SuccessResponse
+from core.routing import AutoAsyncRoute
 from services import auth
 
-indexAPI = APIRouter()
+indexAPI = APIRouter(route_class=AutoAsyncRoute)
 
 
 @indexAPI.post("/login", response_model=request_schemas.Token, name="doc login check", include_in_schema=False)
-async def api_login(data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    token = auth.check_user_login(db, data)
+async def api_login(request: Request, data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    token = await auth.check_user_login(db, request, data)
     return {"access_token": token, "token_type": "bearer"}
 
 
@@ -30,9 +31,14 @@ async def user_login(request: Request, form_data: request_schemas.LoginUser, db:
     return await auth.check_telephone_login(db, request, form_data)
 
 
+@indexAPI.post("/user/refresh", summary="refresh access token")
+async def user_refresh(request: Request, form_data: request_schemas.RefreshToken, db: Session = Depends(get_db)):
+    return SuccessResponse(await auth.refresh_access_token(db, request, form_data.refresh_token), "Token refreshed")
+
+
 @indexAPI.post("/user/register", summary="user register")
 async def user_register(
         form_data: request_schemas.RegisterUser,
         db: Session = Depends(get_db)
 ):
-    return SuccessResponse(auth.check_user_register(db, form_data), "user register success!")
\ No newline at end of file
+    return SuccessResponse(await auth.check_user_register(db, form_data), "user register success!")
\ No newline at end of file
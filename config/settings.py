@@ -51,8 +51,11 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440
 """Expiration time of refresh_token, used for refreshing tokens, two days"""
 REFRESH_TOKEN_EXPIRE_MINUTES = 1440 * 2
-"""Cache time of access_token, used for refreshing tokens, 30 minutes"""
-ACCESS_TOKEN_CACHE_MINUTES = 1440
+"""
+Renewal window of access_token, 30 minutes
+When less time is left, the jwt refresh middleware returns a new token in the access-token header
+"""
+ACCESS_TOKEN_CACHE_MINUTES = 30
 
 """
 Mount the temporary file directory and add route access; this route will not appear in the API documentation
@@ -92,15 +95,137 @@ DEFAULT_AVATAR = STATIC_URL + "/default/avatar.png"
 DEFAULT_PASSWORD = "123456"
 # Maximum number of incorrect password or verification code attempts during login by default
 DEFAULT_AUTH_ERROR_MAX_NUMBER = 5
+# Maximum number of failed logins from one client ip, shared by every telephone tried from it, 0 disables the ip lock
+LOGIN_IP_ERROR_MAX_NUMBER = 20
+# Header the reverse proxy puts the client ip in, e.g. "X-Forwarded-For" or "X-Real-IP", None uses the socket peer.
+# Behind a proxy the peer is the proxy itself and every client shares one ip counter, set the header or disable
+# the ip lock. Only set it when every request passes the proxy, clients can send the header themselves.
+# The last address of the header is used, it is the one the proxy added.
+LOGIN_CLIENT_IP_HEADER = None
+# Sliding window in seconds in which failed logins are counted
+LOGIN_ERROR_WINDOW_SECONDS = 60 * 15
+# First lock time in seconds, doubled on every further lockout up to LOGIN_LOCK_MAX_SECONDS
+LOGIN_LOCK_SECONDS = 60 * 5
+LOGIN_LOCK_MAX_SECONDS = 60 * 60 * 24
+# Seconds a lockout is remembered for the doubling
+LOGIN_LOCK_LEVEL_EXPIRE = 60 * 60 * 24
 # Whether to enable saving local logs for each request
 REQUEST_LOG_RECORD = False
 
+"""
+Permission cache
+PERMISSION_CACHE_EXPIRE: Seconds a compiled user permission set is kept in redis
+PERMISSION_CACHE_LOCAL_SIZE: Maximum number of users kept by the in-process fallback
+PERMISSION_CACHE_LOCAL_EXPIRE: Seconds an entry lives in the in-process fallback, used when redis is disabled or unreachable
+"""
+PERMISSION_CACHE_EXPIRE = 60 * 60
+PERMISSION_CACHE_LOCAL_SIZE = 10000
+PERMISSION_CACHE_LOCAL_EXPIRE = 60
+
+"""
+Principal cache, the compact identity get_current_user resolves from the token
+PRINCIPAL_CACHE_EXPIRE: Seconds a principal is kept in redis
+PRINCIPAL_CACHE_LOCAL_SIZE: Maximum number of principals kept in the per-worker LRU
+PRINCIPAL_CACHE_LOCAL_EXPIRE: Seconds a principal lives in the per-worker LRU, invalidations also arrive over redis pub/sub
+"""
+PRINCIPAL_CACHE_EXPIRE = 60 * 60
+PRINCIPAL_CACHE_LOCAL_SIZE = 10000
+PRINCIPAL_CACHE_LOCAL_EXPIRE = 60
+
+"""
+Function result cache, core.cache.cached, CACHE_EXPIRE is the default time to live
+CACHE_STALE_SECONDS: Seconds an expired entry is still served while one caller recomputes it
+CACHE_LOCK_SECONDS: Seconds the recompute lock is held at most, callers waiting for a missing entry give up after it
+CACHE_LOCAL_SIZE: Maximum number of entries kept by the per-worker fallback
+CACHE_LOCAL_EXPIRE: Longest time to live in the per-worker fallback, used when redis is disabled or unreachable
+"""
+CACHE_STALE_SECONDS = 60
+CACHE_LOCK_SECONDS = 10
+CACHE_LOCAL_SIZE = 10000
+CACHE_LOCAL_EXPIRE = 60
+
+"""
+Rendered menu trees, menu and role writes invalidate them earlier
+MENU_CACHE_EXPIRE: Seconds a tree is kept
+"""
+MENU_CACHE_EXPIRE = 60 * 60
+
+"""
+Password hashing pool, bcrypt runs here instead of on the event loop
+PASSWORD_HASH_WORKERS: Number of hashing processes per uvicorn worker, 0 uses threads instead of processes
+PASSWORD_HASH_MAX_CONCURRENCY: Maximum hashing jobs in flight, extra callers wait in the queue
+"""
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_MAX_CONCURRENCY = 8
+
+"""
+Read replica routing, replicas are configured next to the database urls
+DATABASE_REPLICA_EJECT_SECONDS: Seconds a replica whose connection failed is left out of the rotation
+"""
+DATABASE_REPLICA_EJECT_SECONDS = 30
+
+"""
+Async database connection pool of each uvicorn worker, size it from /api/admin/system/metrics/pools
+DATABASE_POOL_SIZE: Connections kept open
+DATABASE_MAX_OVERFLOW: Extra connections opened when the pool is exhausted
+DATABASE_POOL_TIMEOUT: Seconds a checkout waits for a connection before failing
+"""
+DATABASE_POOL_SIZE = 5
+DATABASE_MAX_OVERFLOW = 5
+DATABASE_POOL_TIMEOUT = 30
+# Connections opened per pool at startup, capped at DATABASE_POOL_SIZE, 0 opens them on demand
+DATABASE_POOL_WARMUP = 2
+
+"""
+SQL statement tracking per request
+QUERY_TRACK_ENABLE: Count statements and database time of every request, the totals go to the request log
+QUERY_REPEAT_THRESHOLD: A statement executed this many times in one request is logged as a possible N+1
+"""
+QUERY_TRACK_ENABLE = True
+QUERY_REPEAT_THRESHOLD = 5
+
+"""
+Slow query log, statements over the threshold are logged with parameters, duration and route
+SLOW_QUERY_THRESHOLD_MS: Duration in milliseconds from which a statement is slow
+SLOW_QUERY_EXPLAIN: Capture the plan of slow SELECT statements with EXPLAIN in a background thread
+SLOW_QUERY_LOG_INTERVAL: Seconds between two log entries of the same statement fingerprint
+"""
+SLOW_QUERY_ENABLE = True
+SLOW_QUERY_THRESHOLD_MS = 500
+SLOW_QUERY_EXPLAIN = True
+SLOW_QUERY_LOG_INTERVAL = 300
+
+"""
+List totals, the strategy is chosen per request with the v_count query parameter
+COUNT_CACHE_EXPIRE: Seconds a cached total is kept, writes to the table invalidate it earlier
+"""
+COUNT_CACHE_EXPIRE = 300
+
+"""
+Bulk user import
+USER_IMPORT_BATCH_SIZE: Rows validated, hashed and inserted per transaction
+"""
+USER_IMPORT_BATCH_SIZE = 500
+
+"""
+List export
+EXPORT_BATCH_SIZE: Rows fetched per keyset page and written to the response at a time
+"""
+EXPORT_BATCH_SIZE = 500
+
+"""
+Database schema migrations, applied with `python main.py upgrade`
+SCHEMA_CHECK_STRICT: Refuse to start when the database schema is older than the code, otherwise only log an error
+"""
+SCHEMA_CHECK_STRICT = True
+
 """
 middleware configuration
 """
 MIDDLEWARES = [
     "core.middleware.http_request_cors_middleware",
     "core.middleware.register_request_log_middleware" if REQUEST_LOG_RECORD else None,
+    "core.middleware.register_query_tracker_middleware" if QUERY_TRACK_ENABLE else None,
     "core.middleware.register_jwt_refresh_middleware"
 ]
 
@@ -108,5 +233,10 @@ MIDDLEWARES = [
 global event configuration
 """
 EVENTS = [
+    "core.migration.check_schema_version",
     "core.event.connect_redis" if CACHE_DB_ENABLE else None,
+    "core.resources.database_pools",
+    "services.auth.auth_invalidation_listener" if CACHE_DB_ENABLE else None,
+    "services.password.password_hasher",
+    "core.resources.warm_caches",
 ]
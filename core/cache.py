@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/8
+# @File           : cache.py
+# @desc           : in-process cache, redis handles and the function result cache
+"""
+cached / get_or_set keep function results in redis as JSON:
+
+- keys are built from the function and its bound arguments, ignore drops arguments such as the db session
+- every entry carries a soft expiry, after it the entry is served stale for CACHE_STALE_SECONDS while
+  a single caller, holding a redis lock, recomputes it
+- on a miss one caller computes the value, the others wait for it, concurrent callers in the same
+  worker share one redis round trip
+- tags group entries, invalidate_tags drops every entry recorded under them
+
+A value computed just before an invalidation can still be stored after it, the time to live bounds
+how long it lives. When redis is disabled or unreachable results are kept per worker for at most
+CACHE_LOCAL_EXPIRE seconds.
+
+Results are stored as JSON in redis and in the local fallback alike, None is a cached result like any
+other, and every caller gets its own copy that it may modify.
+"""
+import asyncio
+import functools
+import hashlib
+import inspect
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Optional, Callable, Awaitable, Iterable
+
+import orjson
+from fastapi import FastAPI
+from pydantic import BaseModel
+from redis import Redis
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError, WatchError
+
+from config import settings
+from core import metrics
+from core.log import logger
+
+
+class LocalCache:
+    """
+    Thread-safe in-process LRU cache with per-entry expiry
+
+    Used where redis is disabled or unreachable, entries are private to one worker.
+    """
+
+    def __init__(self, maxsize: int = 1024, expire: int = 60):
+        self.maxsize = maxsize
+        self.expire = expire
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value: Any, expire: int = None) -> None:
+        deadline = time.monotonic() + (expire or self.expire)
+        with self._lock:
+            self._data[key] = (deadline, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def get_redis(app: FastAPI) -> Optional[aioredis.Redis]:
+    """
+    Get the redis handle mounted by core.event.connect_redis
+    :param app: application object
+    :return: async redis client, None when redis is disabled
+    """
+    if not settings.CACHE_DB_ENABLE:
+        return None
+    return getattr(app.state, "redis", None)
+
+
+_async_redis: Optional[aioredis.Redis] = None
+
+
+def set_current_redis(rd: Optional[aioredis.Redis]) -> None:
+    """
+    Record the redis handle mounted by core.event.connect_redis
+    :param rd: async redis client, None once it is closed
+    :return: None
+    """
+    global _async_redis
+    _async_redis = rd
+
+
+def get_current_redis() -> Optional[aioredis.Redis]:
+    """
+    Get the async redis handle for code running on the event loop without access to the app,
+    such as database event listeners
+    :return: async redis client, None when redis is disabled or not connected
+    """
+    if not settings.CACHE_DB_ENABLE:
+        return None
+    return _async_redis
+
+
+_sync_redis: Optional[Redis] = None
+
+
+def get_sync_redis() -> Optional[Redis]:
+    """
+    Blocking redis client for sync code paths, such as threadpool endpoints and scripts
+    :return: redis client, None when redis is disabled
+    """
+    global _sync_redis
+    if not settings.CACHE_DB_ENABLE:
+        return None
+    if _sync_redis is None:
+        _sync_redis = Redis.from_url(settings.CACHE_DB_URL, decode_responses=True)
+    return _sync_redis
+
+
+CACHE_PREFIX = "cache:"
+CACHE_TAG_PREFIX = "cache:tag:"
+CACHE_LOCK_PREFIX = "cache:lock:"
+
+local_result_cache = LocalCache(maxsize=settings.CACHE_LOCAL_SIZE, expire=settings.CACHE_LOCAL_EXPIRE)
+_local_tags: dict[str, set[str]] = {}
+_local_tags_lock = threading.Lock()
+_inflight: dict[str, asyncio.Future] = {}
+_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "lock_waits": 0, "invalidations": 0}
+
+metrics.register_collector("cache", lambda: dict(_stats))
+
+
+def _key_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"{type(value).__name__} cannot be part of a cache key, ignore the argument or pass key=")
+
+
+def make_key(func: Callable, arguments: dict) -> str:
+    """
+    Deterministic key of a call, the same arguments always give the same key
+    :param func: cached function
+    :param arguments: bound arguments by name
+    :return: cache key
+    """
+    raw = orjson.dumps(arguments, default=_key_default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return f"{CACHE_PREFIX}{func.__module__}.{func.__qualname__}:{hashlib.md5(raw).hexdigest()}"
+
+
+def _entry(value: Any, ttl: int) -> bytes:
+    return orjson.dumps({"v": value, "exp": time.time() + ttl})
+
+
+def _lock_key(key: str) -> str:
+    return f"{CACHE_LOCK_PREFIX}{key}"
+
+
+def _local_get(key: str) -> tuple[bool, Any]:
+    raw = local_result_cache.get(key)
+    if raw is None:
+        return False, None
+    _stats["hits"] += 1
+    return True, orjson.loads(raw)
+
+
+def _local_set(key: str, value: Any, ttl: int, tags: Iterable[str]) -> None:
+    # Serialized like the redis entries, a None result is b"null" and hits read a fresh copy
+    local_result_cache.set(key, orjson.dumps(value), expire=min(ttl, settings.CACHE_LOCAL_EXPIRE))
+    with _local_tags_lock:
+        for tag in tags:
+            _local_tags.setdefault(tag, set()).add(key)
+
+
+def _local_invalidate(tags: Iterable[str]) -> None:
+    with _local_tags_lock:
+        keys = set().union(*(_local_tags.pop(tag, set()) for tag in tags))
+    local_result_cache.delete(*keys)
+
+
+async def _store(rd: aioredis.Redis, key: str, value: Any, ttl: int, tags: Iterable[str]) -> None:
+    expire = ttl + settings.CACHE_STALE_SECONDS
+    try:
+        pipe = rd.pipeline(transaction=False)
+        pipe.set(key, _entry(value, ttl), ex=expire)
+        for tag in tags:
+            pipe.sadd(f"{CACHE_TAG_PREFIX}{tag}", key)
+            pipe.expire(f"{CACHE_TAG_PREFIX}{tag}", expire)
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Cache write failed: {e}")
+
+
+async def _release(rd: aioredis.Redis, key: str, token: str) -> None:
+    # Only the holder deletes the lock, a lock that expired and was taken by another caller is left alone
+    try:
+        async with rd.pipeline(transaction=True) as pipe:
+            await pipe.watch(_lock_key(key))
+            if await pipe.get(_lock_key(key)) == token:
+                pipe.multi()
+                pipe.delete(_lock_key(key))
+                await pipe.execute()
+    except (RedisError, WatchError) as e:
+        logger.warning(f"Cache lock release failed: {e}")
+
+
+async def _compute(rd: aioredis.Redis, key: str, loader: Callable[[], Awaitable], ttl: int, tags: list[str]):
+    value = await loader()
+    await _store(rd, key, value, ttl, tags)
+    return value
+
+
+async def _redis_get_or_set(rd: aioredis.Redis, key: str, loader: Callable[[], Awaitable], ttl: int,
+                            tags: list[str]) -> Any:
+    raw = await rd.get(key)
+    if raw is not None:
+        entry = orjson.loads(raw)
+        if entry["exp"] > time.time():
+            _stats["hits"] += 1
+            return entry["v"]
+    token = uuid.uuid4().hex
+    locked = await rd.set(_lock_key(key), token, nx=True, ex=settings.CACHE_LOCK_SECONDS)
+    if locked:
+        _stats["misses"] += 1
+        try:
+            return await _compute(rd, key, loader, ttl, tags)
+        finally:
+            await _release(rd, key, token)
+    if raw is not None:
+        # Another caller is refreshing the entry
+        _stats["stale_hits"] += 1
+        return orjson.loads(raw)["v"]
+
+    _stats["lock_waits"] += 1
+    deadline = time.monotonic() + settings.CACHE_LOCK_SECONDS
+    delay = 0.02
+    while time.monotonic() < deadline:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.2)
+        raw = await rd.get(key)
+        if raw is not None:
+            return orjson.loads(raw)["v"]
+    # The lock holder is too slow or gone
+    _stats["misses"] += 1
+    return await _compute(rd, key, loader, ttl, tags)
+
+
+async def get_or_set(key: str, loader: Callable[[], Awaitable], ttl: Optional[int] = None,
+                     tags: Iterable[str] = ()) -> Any:
+    """
+    Read a cached value, compute and store it on a miss, only one caller computes it at a time
+    :param key: cache key
+    :param loader: async function computing the value, the result must be JSON serializable
+    :param ttl: seconds the value is fresh, CACHE_EXPIRE by default
+    :param tags: tags the value is recorded under
+    :return: value
+    """
+    ttl = ttl or settings.CACHE_EXPIRE
+    tags = list(tags)
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        # The value is shared with the caller that computed it, hand out a copy
+        return orjson.loads(orjson.dumps(await asyncio.shield(inflight)))
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        value = await _get_or_set(key, loader, ttl, tags)
+    except BaseException as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved when no other caller is waiting
+        future.exception()
+        raise
+    else:
+        future.set_result(value)
+        return value
+    finally:
+        _inflight.pop(key, None)
+
+
+async def _get_or_set(key: str, loader: Callable[[], Awaitable], ttl: int, tags: list[str]) -> Any:
+    rd = get_current_redis()
+    if rd is not None:
+        try:
+            return await _redis_get_or_set(rd, key, loader, ttl, tags)
+        except RedisError as e:
+            logger.warning(f"Cache unavailable, fall back to local cache: {e}")
+    found, value = _local_get(key)
+    if found:
+        return value
+    _stats["misses"] += 1
+    value = await loader()
+    _local_set(key, value, ttl, tags)
+    return value
+
+
+def get_or_set_sync(key: str, loader: Callable[[], Any], ttl: Optional[int] = None, tags: Iterable[str] = ()) -> Any:
+    """
+    get_or_set for sync code, such as threadpool endpoints and scripts
+    """
+    ttl = ttl or settings.CACHE_EXPIRE
+    tags = list(tags)
+    rd = get_sync_redis()
+    if rd is not None:
+        try:
+            return _redis_get_or_set_sync(rd, key, loader, ttl, tags)
+        except RedisError as e:
+            logger.warning(f"Cache unavailable, fall back to local cache: {e}")
+    found, value = _local_get(key)
+    if found:
+        return value
+    _stats["misses"] += 1
+    value = loader()
+    _local_set(key, value, ttl, tags)
+    return value
+
+
+def _redis_get_or_set_sync(rd: Redis, key: str, loader: Callable[[], Any], ttl: int, tags: list[str]) -> Any:
+    raw = rd.get(key)
+    if raw is not None:
+        entry = orjson.loads(raw)
+        if entry["exp"] > time.time():
+            _stats["hits"] += 1
+            return entry["v"]
+    token = uuid.uuid4().hex
+    if rd.set(_lock_key(key), token, nx=True, ex=settings.CACHE_LOCK_SECONDS):
+        _stats["misses"] += 1
+        try:
+            return _compute_sync(rd, key, loader, ttl, tags)
+        finally:
+            _release_sync(rd, key, token)
+    if raw is not None:
+        _stats["stale_hits"] += 1
+        return orjson.loads(raw)["v"]
+
+    _stats["lock_waits"] += 1
+    deadline = time.monotonic() + settings.CACHE_LOCK_SECONDS
+    delay = 0.02
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+        raw = rd.get(key)
+        if raw is not None:
+            return orjson.loads(raw)["v"]
+    _stats["misses"] += 1
+    return _compute_sync(rd, key, loader, ttl, tags)
+
+
+def _compute_sync(rd: Redis, key: str, loader: Callable[[], Any], ttl: int, tags: list[str]) -> Any:
+    value = loader()
+    expire = ttl + settings.CACHE_STALE_SECONDS
+    try:
+        pipe = rd.pipeline(transaction=False)
+        pipe.set(key, _entry(value, ttl), ex=expire)
+        for tag in tags:
+            pipe.sadd(f"{CACHE_TAG_PREFIX}{tag}", key)
+            pipe.expire(f"{CACHE_TAG_PREFIX}{tag}", expire)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Cache write failed: {e}")
+    return value
+
+
+def _release_sync(rd: Redis, key: str, token: str) -> None:
+    try:
+        with rd.pipeline(transaction=True) as pipe:
+            pipe.watch(_lock_key(key))
+            if pipe.get(_lock_key(key)) == token:
+                pipe.multi()
+                pipe.delete(_lock_key(key))
+                pipe.execute()
+    except (RedisError, WatchError) as e:
+        logger.warning(f"Cache lock release failed: {e}")
+
+
+async def invalidate_tags(*tags: str) -> None:
+    """
+    Drop every entry recorded under the tags, call it after the write is committed
+    :param tags: tags
+    :return: None
+    """
+    _stats["invalidations"] += 1
+    _local_invalidate(tags)
+    rd = get_current_redis()
+    if rd is None:
+        return
+    tag_keys = [f"{CACHE_TAG_PREFIX}{tag}" for tag in tags]
+    try:
+        pipe = rd.pipeline(transaction=False)
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+        keys = set().union(*await pipe.execute())
+        await rd.delete(*keys, *tag_keys)
+    except RedisError as e:
+        logger.error(f"Cache invalidation failed: {e}")
+
+
+def cached(ttl: Optional[int] = None, tags: Iterable[str] = (), ignore: Iterable[str] = (),
+           key: Optional[Callable[..., str]] = None):
+    """
+    Cache the results of a sync or async function
+
+    @cached(ttl=600, tags=("dicts", "dict:{tp}"), ignore=("db",))
+    async def get_dict_details(db, tp): ...
+
+    Callers can pass cache_ttl= to override the time to live of one call.
+    :param ttl: seconds a result is fresh, CACHE_EXPIRE by default
+    :param tags: tags of the results, formatted with the arguments by name
+    :param ignore: arguments left out of the key, such as database sessions
+    :param key: builds the key from the arguments by name instead of hashing them
+    :return: decorator
+    """
+    tags = tuple(tags)
+    ignore = set(ignore)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def resolve(args: tuple, kwargs: dict) -> tuple[str, list[str]]:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            if key is not None:
+                cache_key = f"{CACHE_PREFIX}{key(**arguments)}"
+            else:
+                cache_key = make_key(func, {name: value for name, value in arguments.items() if name not in ignore})
+            return cache_key, [tag.format(**arguments) for tag in tags]
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, cache_ttl: Optional[int] = None, **kwargs):
+                cache_key, cache_tags = resolve(args, kwargs)
+                return await get_or_set(cache_key, lambda: func(*args, **kwargs), cache_ttl or ttl, cache_tags)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, cache_ttl: Optional[int] = None, **kwargs):
+                cache_key, cache_tags = resolve(args, kwargs)
+                return get_or_set_sync(cache_key, lambda: func(*args, **kwargs), cache_ttl or ttl, cache_tags)
+
+        wrapper.cache_key = lambda *args, **kwargs: resolve(args, kwargs)[0]
+        return wrapper
+
+    return decorator
+
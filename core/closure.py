@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/24
+# @File           : closure.py
+# @desc           : 树形数据的闭包表
+"""
+parent_id 只能逐层向上或向下查找，查某个节点下的全部节点需要按层递归。
+
+闭包表为每一对 祖先 -> 后代 保存一行 (ancestor_id, descendant_id, depth)，节点自身也有一行，depth 为 0。
+查某个节点的全部后代、全部祖先都只需要一次按主键前缀或 descendant_id 索引的查询，与树的深度无关。
+
+闭包表在 ORM 插入、修改 parent_id、删除时通过 mapper 事件维护；
+绕过 ORM 的批量删除需要先执行 delete_nodes 返回的语句，历史数据用 rebuild 或 rows_from_parents 重建。
+移动节点时调用方需要先用 is_descendant 确认新的父节点不在节点的子树中。
+"""
+from typing import Iterable, Optional
+
+from sqlalchemy import event, select, insert, delete, or_, inspect, literal, Delete, Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def rows_from_parents(pairs: Iterable[tuple[int, Optional[int]]]) -> list[dict]:
+    """
+    由 (id, parent_id) 计算全部闭包表记录，父节点不存在或成环的节点只保留到能追溯到的祖先
+    :param pairs: 全部节点的主键与父节点
+    :return: 闭包表记录
+    """
+    parents = dict(pairs)
+    rows = []
+    for node in parents:
+        ancestor, depth, seen = node, 0, set()
+        while ancestor is not None and ancestor in parents and ancestor not in seen:
+            seen.add(ancestor)
+            rows.append({"ancestor_id": ancestor, "descendant_id": node, "depth": depth})
+            ancestor, depth = parents[ancestor], depth + 1
+    return rows
+
+
+class ClosureTable:
+    """
+    模型的闭包表
+    """
+
+    def __init__(self, model, closure_model, parent: str = "parent_id"):
+        """
+        :param model: 树形模型
+        :param closure_model: 闭包表模型，包含 ancestor_id / descendant_id / depth 三列
+        :param parent: 父节点字段
+        """
+        self.model = model
+        self.closure_model = closure_model
+        self.parent = parent
+
+    def descendants(self, ancestor_ids, include_self: bool = True, max_depth: Optional[int] = None) -> Select:
+        """
+        后代节点主键的子查询
+        :param ancestor_ids: 祖先节点主键，单个值、列表或子查询
+        :param include_self: 是否包含祖先节点本身
+        :param max_depth: 最大层数，1 为直接子节点
+        :return: select(descendant_id)
+        """
+        closure = self.closure_model
+        if isinstance(ancestor_ids, (list, tuple, set, Select)):
+            sql = select(closure.descendant_id).where(closure.ancestor_id.in_(ancestor_ids))
+        else:
+            sql = select(closure.descendant_id).where(closure.ancestor_id == ancestor_ids)
+        if not include_self:
+            sql = sql.where(closure.depth > 0)
+        if max_depth is not None:
+            sql = sql.where(closure.depth <= max_depth)
+        return sql
+
+    def ancestors(self, descendant_id: int, include_self: bool = True) -> Select:
+        """
+        祖先节点主键的子查询，按从近到远排序
+        """
+        closure = self.closure_model
+        sql = select(closure.ancestor_id).where(closure.descendant_id == descendant_id)
+        if not include_self:
+            sql = sql.where(closure.depth > 0)
+        return sql.order_by(closure.depth)
+
+    async def is_descendant(self, db: AsyncSession, node_id: int, ancestor_id: int) -> bool:
+        """
+        node_id 是否为 ancestor_id 本身或它的后代
+        """
+        closure = self.closure_model
+        return await db.scalar(select(literal(True)).where(
+            closure.ancestor_id == ancestor_id,
+            closure.descendant_id == node_id
+        )) is not None
+
+    def delete_nodes(self, ids: list[int]) -> Delete:
+        """
+        删除节点相关的闭包表记录，用于绕过 ORM 的批量删除
+        """
+        closure = self.closure_model
+        return delete(closure).where(or_(closure.descendant_id.in_(ids), closure.ancestor_id.in_(ids)))
+
+    def _after_insert(self, mapper, connection, target) -> None:
+        closure = self.closure_model
+        connection.execute(insert(closure).values(ancestor_id=target.id, descendant_id=target.id, depth=0))
+        parent_id = getattr(target, self.parent)
+        if parent_id:
+            connection.execute(insert(closure).from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(closure.ancestor_id, literal(target.id), closure.depth + 1)
+                .where(closure.descendant_id == parent_id)
+            ))
+
+    def _after_update(self, mapper, connection, target) -> None:
+        if not inspect(target).attrs[self.parent].history.has_changes():
+            return
+        closure = self.closure_model
+        subtree = connection.execute(
+            select(closure.descendant_id, closure.depth).where(closure.ancestor_id == target.id)
+        ).all()
+        subtree_ids = [row.descendant_id for row in subtree]
+        # 断开子树与原祖先的关系，子树内部的记录不变
+        connection.execute(delete(closure).where(
+            closure.descendant_id.in_(subtree_ids),
+            closure.ancestor_id.notin_(subtree_ids)
+        ))
+        parent_id = getattr(target, self.parent)
+        if not parent_id:
+            return
+        ancestors = connection.execute(
+            select(closure.ancestor_id, closure.depth).where(closure.descendant_id == parent_id)
+        ).all()
+        rows = [{"ancestor_id": ancestor.ancestor_id, "descendant_id": node.descendant_id,
+                 "depth": ancestor.depth + node.depth + 1}
+                for ancestor in ancestors for node in subtree]
+        if rows:
+            connection.execute(insert(closure), rows)
+
+    def _after_delete(self, mapper, connection, target) -> None:
+        connection.execute(self.delete_nodes([target.id]))
+
+    async def rebuild(self, db: AsyncSession) -> int:
+        """
+        按 parent_id 重建闭包表
+        :param db: 数据库会话，调用方负责提交
+        :return: 闭包表记录数
+        """
+        pairs = (await db.execute(select(self.model.id, getattr(self.model, self.parent)))).all()
+        rows = rows_from_parents((row[0], row[1]) for row in pairs)
+        await db.execute(delete(self.closure_model))
+        if rows:
+            await db.execute(insert(self.closure_model), rows)
+        return len(rows)
+
+
+_closure_tables: list[ClosureTable] = []
+
+
+def register_closure_table(model, closure_model, parent: str = "parent_id") -> ClosureTable:
+    """
+    注册闭包表并在 ORM 写入时维护
+    :param model: 树形模型
+    :param closure_model: 闭包表模型
+    :param parent: 父节点字段
+    :return: 闭包表
+    """
+    table = ClosureTable(model, closure_model, parent)
+    _closure_tables.append(table)
+    event.listen(model, "after_insert", table._after_insert)
+    event.listen(model, "after_update", table._after_update)
+    event.listen(model, "after_delete", table._after_delete)
+    return table
+
+
+def closure_tables() -> list[ClosureTable]:
+    return list(_closure_tables)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/16
+# @File           : count.py
+# @desc           : 列表总数策略
+"""
+官方文档——连接事件：https://docs.sqlalchemy.org/en/20/core/events.html#sqlalchemy.events.ConnectionEvents
+
+列表总数有三种策略，由分页参数 v_count 指定：
+exact     每次执行 count
+cached    按 语句读取的所有表的版本号 + 规范化后的 count 语句与参数 缓存 COUNT_CACHE_EXPIRE 秒，
+          子查询和 JOIN 中的表也计入，例如数据权限引用的 user_departments、department_closure
+estimate  取执行计划中的估算行数，目前只支持 MySQL，其他数据库退回 exact
+
+引擎执行 INSERT/UPDATE/DELETE 时把表名记在连接上，事务提交、连接归还连接池之后把这些表的版本号加一，
+旧版本下缓存的总数不再命中。版本号在提交之后才更新，并发请求不会把提交前的总数缓存到新版本下。
+redis 可用时版本号和缓存放在 redis 中由所有 worker 共享，否则放在进程内，其他 worker 的写入要等缓存过期才可见。
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Optional
+
+from sqlalchemy import event, Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.elements import ClauseElement
+from sqlalchemy.sql.util import find_tables
+from redis.exceptions import RedisError
+
+from config import settings
+from core import cache
+from core.curd import get_count
+from core.log import logger
+
+COUNT_EXACT = "exact"
+COUNT_CACHED = "cached"
+COUNT_ESTIMATE = "estimate"
+
+VERSION_KEY = "count:version:{}"
+CACHE_KEY = "count:{}:{}:{}"
+
+_lock = threading.Lock()
+_local_versions: dict[str, int] = {}
+_local_cache = cache.LocalCache(maxsize=2048, expire=settings.COUNT_CACHE_EXPIRE)
+_pending: set[asyncio.Task] = set()
+
+
+class Explain(Executable, ClauseElement):
+    """
+    EXPLAIN 语句，参数按原语句绑定
+    """
+    inherit_cache = False
+    # 只读语句，RoutingSession 按查询路由到从库
+    is_select = True
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN " + compiler.process(element.statement, **kw)
+
+
+def _dml_table(context) -> Optional[str]:
+    if not (context.isinsert or context.isupdate or context.isdelete) or context.compiled is None:
+        return None
+    table = getattr(context.compiled.statement, "table", None)
+    return getattr(table, "name", None)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    table = _dml_table(context)
+    if table is not None:
+        conn.info.setdefault("count_dirty", set()).add(table)
+
+
+def _on_commit(conn):
+    dirty = conn.info.pop("count_dirty", None)
+    if dirty:
+        conn.info.setdefault("count_committed", set()).update(dirty)
+
+
+def _on_rollback(conn):
+    conn.info.pop("count_dirty", None)
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    committed = connection_record.info.pop("count_committed", None)
+    if committed:
+        bump_versions(committed)
+
+
+def watch_engine(engine: Engine) -> None:
+    """
+    写入后使缓存的总数失效
+    :param engine: 同步引擎，异步引擎传 async_engine.sync_engine
+    :return: None
+    """
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "commit", _on_commit)
+    event.listen(engine, "rollback", _on_rollback)
+    event.listen(engine, "checkin", _on_checkin)
+
+
+async def _bump_redis(rd, tables: list[str]) -> None:
+    try:
+        async with rd.pipeline(transaction=False) as pipe:
+            for table in tables:
+                pipe.incr(VERSION_KEY.format(table))
+            await pipe.execute()
+    except RedisError as e:
+        logger.error(f"Count cache invalidation failed for {tables}: {e}")
+
+
+def bump_versions(tables) -> None:
+    """
+    表的版本号加一，之前缓存的总数失效
+    在事件循环中通过异步 redis 后台更新，同步代码中直接更新
+    :param tables: 表名
+    :return: None
+    """
+    tables = sorted(tables)
+    with _lock:
+        for table in tables:
+            _local_versions[table] = _local_versions.get(table, 0) + 1
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    rd = cache.get_current_redis()
+    if loop is not None and rd is not None:
+        task = loop.create_task(_bump_redis(rd, tables))
+        _pending.add(task)
+        task.add_done_callback(_pending.discard)
+        return
+    rd = cache.get_sync_redis()
+    if rd is None:
+        return
+    try:
+        with rd.pipeline(transaction=False) as pipe:
+            for table in tables:
+                pipe.incr(VERSION_KEY.format(table))
+            pipe.execute()
+    except RedisError as e:
+        logger.error(f"Count cache invalidation failed for {tables}: {e}")
+
+
+async def drain(timeout: float = 5) -> None:
+    """
+    等待后台的版本号更新完成，应用关闭时调用
+    """
+    if _pending:
+        await asyncio.wait(list(_pending), timeout=timeout)
+
+
+def _statement_key(sql) -> str:
+    compiled = sql.compile()
+    params = json.dumps(compiled.params, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.md5(f"{compiled}\n{params}".encode()).hexdigest()
+
+
+def statement_tables(sql) -> list[str]:
+    """
+    语句读取的所有表，包括子查询和 JOIN 中的表
+    """
+    return sorted({table.name for table in find_tables(sql)})
+
+
+async def _cached_count(db, sql, tables: list[str]) -> int:
+    rd = cache.get_current_redis()
+    statement_key = _statement_key(sql)
+    if rd is None:
+        versions = [_local_versions.get(table, 0) for table in tables]
+        key = CACHE_KEY.format("+".join(tables), ".".join(map(str, versions)), statement_key)
+        total = _local_cache.get(key)
+        if total is None:
+            total = await get_count(db, sql)
+            _local_cache.set(key, total, settings.COUNT_CACHE_EXPIRE)
+        return total
+    versions = [version or "0" for version in await rd.mget([VERSION_KEY.format(table) for table in tables])]
+    key = CACHE_KEY.format("+".join(tables), ".".join(versions), statement_key)
+    total = await rd.get(key)
+    if total is not None:
+        return int(total)
+    total = await get_count(db, sql)
+    await rd.set(key, total, ex=settings.COUNT_CACHE_EXPIRE)
+    return total
+
+
+async def _estimate_count(db, sql) -> Optional[int]:
+    # 不用 get_bind()，它会把读写分离的会话固定到主库
+    if db.bind is None or db.bind.dialect.name != "mysql":
+        return None
+    try:
+        row = (await db.execute(Explain(sql.order_by(None)))).mappings().first()
+    except SQLAlchemyError as e:
+        logger.error(f"Count estimate failed: {e}")
+        return None
+    if row is None or row.get("rows") is None:
+        return None
+    return int(row["rows"] * float(row.get("filtered") or 100) / 100)
+
+
+async def get_total(db, sql, model, strategy: str = COUNT_EXACT) -> tuple[int, str]:
+    """
+    按策略获取列表总数
+    :param db: 异步数据库会话
+    :param sql: select 语句，写入其中任意一张表后 cached 策略的缓存失效
+    :param model: 列表的模型
+    :param strategy: exact / cached / estimate
+    :return: 总数，实际使用的策略
+    """
+    if strategy == COUNT_CACHED:
+        try:
+            tables = sorted(set(statement_tables(sql)) | {model.__table__.name})
+            return await _cached_count(db, sql, tables), COUNT_CACHED
+        except RedisError as e:
+            logger.error(f"Count cache unavailable: {e}")
+    elif strategy == COUNT_ESTIMATE:
+        total = await _estimate_count(db, sql)
+        if total is not None:
+            return total, COUNT_ESTIMATE
+    return await get_count(db, sql), COUNT_EXACT
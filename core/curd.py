@@ -4,10 +4,14 @@
 # @Create Time    : 2025/2/14
 # @File           : curd.py
 # @desc           : 基础的curd操作
-from datetime import datetime
+import base64
+import json
+from datetime import datetime, date
+from decimal import Decimal
 
-from sqlalchemy import func
+from sqlalchemy import func, select, or_, and_
 
+from core import search
 from core.exception import CustomException
 
 
@@ -51,6 +55,118 @@ def order_by(query, model, page):
     return query
 
 
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"dec": str(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+        if "dec" in value:
+            return Decimal(value["dec"])
+    return value
+
+
+def encode_cursor(field: str, order: str, value, primary_id) -> str:
+    """
+    生成游标，记录排序字段、方向以及最后一行的排序值和 id
+    """
+    data = {"f": field, "o": order, "v": _encode_value(value), "id": primary_id}
+    raw = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """
+    解析游标
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        data["v"] = _decode_value(data["v"])
+        return data
+    except (ValueError, TypeError, KeyError):
+        raise CustomException("游标无效")
+
+
+def _keyset_order(model, page):
+    field_name = page['v_order_field'] or 'id'
+    desc = page['v_order'] == 'desc'
+    return field_name, getattr(model, field_name), desc
+
+
+def keyset_paginate(query, model, page):
+    """
+    游标分页：按排序字段加 id 排序，用上一页最后一行的值做 seek 条件，多取一行判断是否还有下一页
+    :param query: select 语句
+    :param model: 模型
+    :param page: 分页参数 QueryParams.dict()
+    :return: 分页后的 select 语句
+    """
+    field_name, field, desc = _keyset_order(model, page)
+    pk = model.id
+    if page['v_cursor']:
+        cursor = decode_cursor(page['v_cursor'])
+        if cursor.get("f") != field_name or cursor.get("o") != ("desc" if desc else "asc"):
+            raise CustomException("排序条件已变化，请从第一页重新查询")
+        value, last_id = cursor["v"], cursor["id"]
+        if field_name == 'id':
+            query = query.where(pk < last_id if desc else pk > last_id)
+        elif value is None:
+            # MySQL 中 NULL 升序排在最前，降序排在最后
+            if desc:
+                query = query.where(field.is_(None), pk < last_id)
+            else:
+                query = query.where(or_(field.isnot(None), and_(field.is_(None), pk > last_id)))
+        elif desc:
+            conditions = [field < value, and_(field == value, pk < last_id)]
+            if getattr(field.expression, "nullable", True):
+                conditions.append(field.is_(None))
+            query = query.where(or_(*conditions))
+        else:
+            query = query.where(or_(field > value, and_(field == value, pk > last_id)))
+    if field_name == 'id':
+        orders = [pk.desc() if desc else pk.asc()]
+    else:
+        orders = [field.desc(), pk.desc()] if desc else [field.asc(), pk.asc()]
+    return query.order_by(*orders).limit(page['limit'] + 1)
+
+
+def keyset_next_cursor(records: list, model, page) -> tuple[list, str | None]:
+    """
+    截取当前页并生成下一页游标
+    :param records: keyset_paginate 查询结果
+    :param model: 模型
+    :param page: 分页参数 QueryParams.dict()
+    :return: 当前页数据，下一页游标，没有下一页时为 None
+    """
+    if len(records) <= page['limit']:
+        return records, None
+    records = records[:page['limit']]
+    field_name, _, desc = _keyset_order(model, page)
+    last = records[-1]
+    return records, encode_cursor(field_name, "desc" if desc else "asc", getattr(last, field_name), last.id)
+
+
+async def get_count(db, sql):
+    """
+    获取查询语句的总数
+    :param db: 异步数据库会话
+    :param sql: select 语句，排序条件会被去掉
+    :return: 总数
+    """
+    sql = select(func.count()).select_from(sql.order_by(None).subquery())
+    return await db.scalar(sql)
+
+
 def get_filter_where(model, **kwargs):
     """
         字典过滤
@@ -74,7 +190,10 @@ def get_filter_where(model, **kwargs):
                         # 根据日期查询， 关键函数是：func.time_format和func.date_format
                         conditions.append(func.date_format(attr, "%Y-%m-%d") == value[1])
                     elif value[0] == "like":
-                        conditions.append(attr.like(f"%{value[1]}%"))
+                        # 注册了 n-gram 索引的字段先用索引缩小范围
+                        conditions.extend(search.like_conditions(model, field, value[1]))
+                    elif value[0] == "endswith":
+                        conditions.append(search.endswith_condition(model, field, value[1]))
                     elif value[0] == "in":
                         conditions.append(attr.in_(value[1]))
                     elif value[0] == "between" and len(value[1]) == 2:
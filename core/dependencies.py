@@ -7,8 +7,9 @@
 
 
 import copy
+from typing import Literal
 
-from fastapi import Body
+from fastapi import Body, Query
 
 
 class QueryParams:
@@ -20,6 +21,8 @@ class QueryParams:
             self.offset = (self.page - 1) * self.limit
             self.v_order = params.v_order
             self.v_order_field = params.v_order_field
+            self.v_cursor = params.v_cursor
+            self.v_count = params.v_count
 
     def dict(self, exclude: list[str] = None) -> dict:
         result = copy.deepcopy(self.__dict__)
@@ -38,21 +41,32 @@ class QueryParams:
         del params["v_order"]
         del params["v_order_field"]
         del params["offset"]
+        params.pop("v_cursor", None)
+        params.pop("v_count", None)
         return params
 
 
 class Paging(QueryParams):
     """
     列表分页
+
+    默认按 page/limit 分页，传入 v_cursor 时使用游标分页：第一页传空字符串，之后传上一页返回的 next_cursor，
+    深翻页不再扫描并丢弃前面的行，此时忽略 page。
+    v_count 指定总数的获取方式：exact 精确计数，cached 缓存计数（写入后失效），estimate 执行计划估算，
+    返回值中的 count_strategy 为实际使用的方式。
     """
 
-    def __init__(self, page: int = 1, limit: int = 10, v_order_field: str = None, v_order: str = None):
+    def __init__(self, page: int = 1, limit: int = 10, v_order_field: str = None, v_order: str = None,
+                 v_cursor: str = Query(None, description="游标分页，第一页传空字符串，之后传上一页的 next_cursor"),
+                 v_count: Literal["exact", "cached", "estimate"] = Query("exact", description="总数获取方式")):
         super().__init__()
         self.page = page
         self.limit = limit
         self.offset = (self.page - 1) * self.limit
         self.v_order = v_order
         self.v_order_field = v_order_field
+        self.v_cursor = v_cursor
+        self.v_count = v_count
 
 
 class IdList:
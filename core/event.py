@@ -11,18 +11,21 @@ from redis import asyncio as aioredis
 from redis.exceptions import AuthenticationError, TimeoutError, RedisError
 from contextlib import asynccontextmanager
 
+from core import cache
 from core.log import logger
-from core.module import import_modules_async
+from core.resources import manager
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-
-    await import_modules_async(settings.EVENTS, "全局事件", app=app, status=True)
+    """
+    全局事件按顺序启动、逆序关闭，见 core.resources
+    """
+    await manager.startup(app, settings.EVENTS)
 
     yield
 
-    await import_modules_async(settings.EVENTS, "全局事件", app=app, status=False)
+    await manager.shutdown(app)
 
 
 async def connect_redis(app: FastAPI, status: bool):
@@ -63,6 +66,7 @@ async def connect_redis(app: FastAPI, status: bool):
     if status:
         rd = aioredis.from_url(settings.CACHE_DB_URL, decode_responses=True, health_check_interval=1)
         app.state.redis = rd
+        cache.set_current_redis(rd)
         try:
             response = await rd.ping()
             if response:
@@ -77,5 +81,6 @@ async def connect_redis(app: FastAPI, status: bool):
             raise RedisError(f"Redis 连接失败: {e}")
     else:
         logger.info("Redis connect closed")
+        cache.set_current_redis(None)
         await app.state.redis.close()
 
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/9
+# @File           : metrics.py
+# @desc           : runtime metrics registry
+from typing import Callable, Any, Iterable
+
+from core.log import logger
+
+_collectors: dict[str, Callable[[], dict[str, Any]]] = {}
+
+
+def register_collector(name: str, collector: Callable[[], dict[str, Any]]) -> None:
+    """
+    Register a metrics collector
+    :param name: metrics group name
+    :param collector: callable returning a dict snapshot
+    :return: None
+    """
+    _collectors[name] = collector
+
+
+def collect(names: list[str] = None) -> dict[str, Any]:
+    """
+    Snapshot registered metrics
+    :param names: groups to collect, None collects all
+    :return: metrics grouped by name
+    """
+    result = {}
+    for name, collector in _collectors.items():
+        if names and name not in names:
+            continue
+        try:
+            result[name] = collector()
+        except Exception as e:
+            logger.error(f"Collect metrics {name} failed: {e}")
+            result[name] = None
+    return result
+
+
+def latency_summary(samples: Iterable[float]) -> dict[str, float]:
+    """
+    Summarize latency samples
+    :param samples: durations in seconds
+    :return: avg, p50, p95, p99 and max in milliseconds
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {"avg": 0, "p50": 0, "p95": 0, "p99": 0, "max": 0}
+
+    def percentile(p: float) -> float:
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 2)
+
+    return {
+        "avg": round(sum(samples) / len(samples) * 1000, 2),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "max": round(samples[-1] * 1000, 2),
+    }
@@ -13,6 +13,7 @@ from fastapi import Request, Response
 from starlette.middleware.cors import CORSMiddleware
 
 from config import settings
+from core import query_tracker
 from core.log import logger
 from fastapi import FastAPI
 
@@ -23,6 +24,9 @@ def write_request_log(request: Request, response: Response):
     process_time = response.headers["X-Process-Time"]
     content = f"http.log_message: '{request.method} {request.url} {http_version}' {response.status_code}" \
               f" {response.charset} {content_length} {process_time}"
+    tracker = getattr(request.state, "query_tracker", None)
+    if tracker is not None:
+        content += f" queries={tracker.count} db_time={tracker.duration * 1000:.2f}ms"
     logger.info(content)
 
 
@@ -43,6 +47,24 @@ def register_request_log_middleware(app: FastAPI):
         return response
 
 
+def register_query_tracker_middleware(app: FastAPI):
+    """
+    请求级 SQL 统计中间件，需要排在请求日志中间件之后注册
+    :param app:
+    :return:
+    """
+
+    @app.middleware("http")
+    async def query_tracker_middleware(request: Request, call_next):
+        tracker = query_tracker.QueryTracker(request.scope)
+        request.state.query_tracker = tracker
+        token = query_tracker.activate(tracker)
+        try:
+            return await call_next(request)
+        finally:
+            query_tracker.finish(tracker, token)
+
+
 def register_jwt_refresh_middleware(app: FastAPI):
     """
     JWT刷新中间件
@@ -55,6 +77,9 @@ def register_jwt_refresh_middleware(app: FastAPI):
         response = await call_next(request)
         refresh = request.scope.get('if-refresh', 0)
         response.headers["if-refresh"] = str(refresh)
+        if refresh:
+            # 令牌即将过期, 由 services.auth.get_current_user 签发的新令牌
+            response.headers["access-token"] = request.scope["access-token"]
         return response
 
 
@@ -64,5 +89,6 @@ def http_request_cors_middleware(app: FastAPI):
         allow_origins=settings.ALLOW_ORIGINS,
         allow_credentials=settings.ALLOW_CREDENTIALS,
         allow_methods=settings.ALLOW_METHODS,
-        allow_headers=settings.ALLOW_HEADERS
+        allow_headers=settings.ALLOW_HEADERS,
+        expose_headers=["if-refresh", "access-token"]
     )
\ No newline at end of file
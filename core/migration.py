@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/20
+# @File           : migration.py
+# @desc           : 数据库迁移
+"""
+迁移脚本放在 migrations 包中，文件名为 v<四位版本号>_<说明>.py，模块内定义 upgrade(conn)，
+conn 为主库的同步连接。已执行的版本记录在 schema_version 表中，python main.py upgrade 按版本顺序执行未执行的脚本。
+
+MySQL 的 DDL 会隐式提交，脚本中途失败时已执行的语句不会回滚，所以脚本要能重复执行：
+建表、加列、加索引使用本模块的辅助函数，已存在时跳过。
+
+脚本在自己的 MetaData 中固定表结构，不引用 models 中的模型：模型总是代码的最新结构，
+引用模型的旧脚本在新数据库上会建出之后版本的表，后续的改名、删列、改类型脚本会失败或重复执行。
+
+应用启动时只用一条查询读取数据库的当前版本与代码中的最新版本比较，不再在每个 worker 启动时执行 create_all。
+"""
+import importlib
+import pkgutil
+import re
+from datetime import datetime
+from types import ModuleType
+from typing import Optional
+
+from fastapi import FastAPI
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, Connection, Index, inspect, select, func, \
+    insert, text
+from sqlalchemy.schema import CreateColumn
+
+from config import settings
+from core.database import engine, async_engine
+from core.log import logger
+
+MIGRATIONS_PACKAGE = "migrations"
+LOCK_NAME = "schema_migration"
+_VERSION_FILE = re.compile(r"^v(\d{4})_\w+$")
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False, comment="Migration version"),
+    Column("description", String(255), comment="Migration description"),
+    Column("applied_at", DateTime, comment="Applied at"),
+    comment="Applied schema migrations"
+)
+
+
+def discover() -> list[tuple[int, ModuleType]]:
+    """
+    按版本号排序的迁移脚本
+    """
+    package = importlib.import_module(MIGRATIONS_PACKAGE)
+    migrations = []
+    for item in pkgutil.iter_modules(package.__path__):
+        match = _VERSION_FILE.match(item.name)
+        if match:
+            migrations.append((int(match.group(1)), importlib.import_module(f"{MIGRATIONS_PACKAGE}.{item.name}")))
+    migrations.sort(key=lambda migration: migration[0])
+    versions = [version for version, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions: {versions}")
+    return migrations
+
+
+def head_version() -> int:
+    """
+    代码中的最新版本
+    """
+    migrations = discover()
+    return migrations[-1][0] if migrations else 0
+
+
+def current_version(conn: Connection) -> int:
+    """
+    数据库的当前版本，没有 schema_version 表时为 0
+    """
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.scalar(select(func.max(schema_version.c.version))) or 0
+
+
+def _describe(module: ModuleType) -> str:
+    return (module.__doc__ or module.__name__).strip().splitlines()[0][:255]
+
+
+def upgrade(target: Optional[int] = None) -> list[int]:
+    """
+    执行未执行的迁移脚本，每个脚本一个事务
+    MySQL 上用 GET_LOCK 保证同一时间只有一个进程在迁移
+    :param target: 目标版本，None 为最新版本
+    :return: 本次执行的版本
+    """
+    applied = []
+    with engine.connect() as lock_conn:
+        locked = engine.dialect.name == "mysql"
+        if locked and not lock_conn.scalar(text("SELECT GET_LOCK(:name, 60)"), {"name": LOCK_NAME}):
+            raise RuntimeError("Another process is running migrations")
+        try:
+            with engine.begin() as conn:
+                schema_version.create(conn, checkfirst=True)
+            with engine.connect() as conn:
+                version = current_version(conn)
+            for number, module in discover():
+                if number <= version or (target is not None and number > target):
+                    continue
+                logger.info(f"Apply migration v{number:04d}: {_describe(module)}")
+                with engine.begin() as conn:
+                    module.upgrade(conn)
+                    conn.execute(insert(schema_version).values(
+                        version=number,
+                        description=_describe(module),
+                        applied_at=datetime.now()
+                    ))
+                applied.append(number)
+        finally:
+            if locked:
+                lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+    return applied
+
+
+def has_column(conn: Connection, table_name: str, column_name: str) -> bool:
+    return any(column["name"] == column_name for column in inspect(conn).get_columns(table_name))
+
+
+def has_index(conn: Connection, table_name: str, index_name: str) -> bool:
+    return any(index["name"] == index_name for index in inspect(conn).get_indexes(table_name))
+
+
+def create_tables(conn: Connection, *tables: Table) -> None:
+    """
+    按脚本中固定的表定义建表，已存在的表跳过
+    """
+    for table in tables:
+        table.create(conn, checkfirst=True)
+
+
+def add_column(conn: Connection, column: Column) -> None:
+    """
+    按脚本中固定的列定义加列，已存在时跳过
+    """
+    table_name = column.table.name
+    if has_column(conn, table_name, column.name):
+        return
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.exec_driver_sql(f"ALTER TABLE {conn.dialect.identifier_preparer.quote(table_name)} ADD COLUMN {ddl}")
+
+
+def create_index(conn: Connection, index: Index) -> None:
+    """
+    按脚本中固定的索引定义建索引，已存在时跳过
+    """
+    if has_index(conn, index.table.name, index.name):
+        return
+    index.create(conn)
+
+
+async def check_schema_version(app: FastAPI, status: bool):
+    """
+    启动时检查数据库版本，数据库版本低于代码时 SCHEMA_CHECK_STRICT 下拒绝启动
+    :param app: 应用对象
+    :param status: True 启动，False 关闭
+    :return: None
+    """
+    if not status:
+        return
+    head = head_version()
+    # 只有 schema_version 表不存在时视为未初始化，连接失败等错误直接抛出
+    async with async_engine.connect() as conn:
+        version = await conn.run_sync(current_version)
+    if version < head:
+        message = f"Database schema is at v{version:04d}, code expects v{head:04d}, run `python main.py upgrade`"
+        if settings.SCHEMA_CHECK_STRICT:
+            raise RuntimeError(message)
+        logger.error(message)
+    elif version > head:
+        logger.warning(f"Database schema v{version:04d} is newer than the code v{head:04d}")
+    else:
+        logger.info(f"Database schema v{version:04d}")
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/14
+# @File           : pool.py
+# @desc           : 连接池监控
+"""
+官方文档——连接池事件：https://docs.sqlalchemy.org/en/20/core/events.html#connection-pool-events
+
+连接池本身没有"等待连接"的事件，等待时间在 _do_get 外层计时：连接池满时 _do_get 会阻塞到有连接归还、
+创建溢出连接或 pool_timeout 超时。其余指标来自连接池事件。
+"""
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import event, Engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+from core import metrics
+
+
+class PoolStats:
+    """
+    单个连接池的统计
+    """
+
+    def __init__(self, name: str, sample_size: int = 1000):
+        self.name = name
+        self.engine: Optional[Engine] = None
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=sample_size)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.peak_checked_out = 0
+        self.peak_overflow = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.recycles = 0
+
+    def attach(self, engine: Engine) -> None:
+        """
+        监听引擎连接池事件，连接池 dispose 后重建也继续生效
+        """
+        self.engine = engine
+        engine.pool.stats = self
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "invalidate", self._on_invalidate)
+        event.listen(engine, "soft_invalidate", self._on_soft_invalidate)
+        event.listen(engine, "close", self._on_close)
+
+    def record_checkout(self, pool: QueuePool, wait: float, ok: bool) -> None:
+        with self._lock:
+            self._waits.append(wait)
+            if not ok:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.peak_checked_out = max(self.peak_checked_out, pool.checkedout())
+            self.peak_overflow = max(self.peak_overflow, pool.overflow())
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        with self._lock:
+            self.invalidations += 1
+
+    def _on_soft_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        with self._lock:
+            self.soft_invalidations += 1
+
+    def _on_close(self, dbapi_connection, connection_record) -> None:
+        # 超过 pool_recycle 的连接在检出时被关闭重连
+        recycle = self.engine.pool._recycle
+        if -1 < recycle < time.time() - connection_record.starttime:
+            with self._lock:
+                self.recycles += 1
+
+    def reset(self) -> None:
+        """
+        清零累计值，当前占用情况不受影响
+        """
+        with self._lock:
+            self._waits.clear()
+            self.checkouts = self.timeouts = self.connects = 0
+            self.invalidations = self.soft_invalidations = self.recycles = 0
+            self.peak_checked_out = self.peak_overflow = 0
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool
+        with self._lock:
+            waits = list(self._waits)
+            result = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "peak_checked_out": self.peak_checked_out,
+                "peak_overflow": self.peak_overflow,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+                "recycles": self.recycles,
+            }
+        if isinstance(pool, QueuePool):
+            result.update({
+                "pool_size": pool.size(),
+                "max_overflow": pool._max_overflow,
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+            })
+        result["checkout_wait_ms"] = metrics.latency_summary(waits)
+        return {"url": self.engine.url.render_as_string(hide_password=True), **result}
+
+
+class InstrumentedPoolMixin:
+    """
+    记录连接检出等待时间
+    """
+    stats: Optional[PoolStats] = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        ok = False
+        try:
+            connection = super()._do_get()
+            ok = True
+            return connection
+        finally:
+            if self.stats is not None:
+                self.stats.record_checkout(self, time.perf_counter() - start, ok)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+_pools: dict[str, PoolStats] = {}
+
+
+def instrument(name: str, engine: Engine) -> PoolStats:
+    """
+    开启连接池监控
+    :param name: 连接池名称
+    :param engine: 同步引擎，异步引擎传 async_engine.sync_engine
+    :return: 统计对象
+    """
+    stats = PoolStats(name)
+    stats.attach(engine)
+    _pools[name] = stats
+    return stats
+
+
+def pool_stats() -> dict[str, dict]:
+    """
+    所有已监控连接池的统计快照
+    """
+    return {name: stats.snapshot() for name, stats in _pools.items()}
+
+
+def reset_pool_stats() -> None:
+    for stats in _pools.values():
+        stats.reset()
+
+
+metrics.register_collector("database_pools", pool_stats)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/15
+# @File           : query_tracker.py
+# @desc           : 请求级 SQL 统计
+"""
+官方文档——游标执行事件：https://docs.sqlalchemy.org/en/20/core/events.html#sqlalchemy.events.ConnectionEvents.before_cursor_execute
+
+每个请求一个 QueryTracker，保存在 contextvar 中，引擎的游标事件把语句数与耗时记到当前请求上。
+语句按指纹归并（字面量、IN 列表长度不同视为同一语句），同一指纹在一个请求内重复执行达到
+QUERY_REPEAT_THRESHOLD 次时记录疑似 N+1 的告警。
+
+异步引擎的事件在 SQLAlchemy 的 greenlet 中执行，同步接口在线程池中执行，两者都会继承请求的 contextvar。
+"""
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from functools import lru_cache
+from typing import Optional, Iterator
+
+from sqlalchemy import event, Engine
+
+from config import settings
+from core.log import logger
+
+_current: ContextVar[Optional["QueryTracker"]] = ContextVar("query_tracker", default=None)
+_observers: list[list["QueryTracker"]] = []
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\(\s*(?:(?:\?|%s|:\w+|\$\d+)\s*,\s*)+(?:\?|%s|:\w+|\$\d+)\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """
+    语句指纹，只有参数不同的语句指纹相同
+    :param statement: SQL 语句
+    :return: 指纹
+    """
+    statement = _LITERALS.sub("?", statement)
+    statement = _PLACEHOLDER_LISTS.sub("(?)", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+class QueryTracker:
+    """
+    一个请求内执行的 SQL 统计
+    """
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter[str] = Counter()
+
+    @property
+    def route(self) -> Optional[str]:
+        """
+        请求的路由，路由匹配之前是请求路径
+        """
+        if self.scope is None:
+            return None
+        route = self.scope.get("route")
+        path = getattr(route, "path", None) or self.scope.get("path")
+        return f"{self.scope.get('method')} {path}"
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        self.statements[fingerprint(statement)] += 1
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """
+        重复执行次数达到阈值的语句
+        """
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= threshold]
+
+
+def get_tracker() -> Optional[QueryTracker]:
+    return _current.get()
+
+
+def activate(tracker: QueryTracker) -> Token:
+    return _current.set(tracker)
+
+
+def finish(tracker: QueryTracker, token: Token) -> None:
+    """
+    结束统计，记录疑似 N+1 的语句
+    """
+    _current.reset(token)
+    for statement, n in tracker.repeated(settings.QUERY_REPEAT_THRESHOLD):
+        logger.warning(f"Possible N+1 query on {tracker.route}, executed {n} times: {statement[:500]}")
+    for captured in _observers:
+        captured.append(tracker)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_start_time = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - context.query_start_time
+    tracker = _current.get()
+    if tracker is not None:
+        tracker.record(statement, duration)
+
+
+def track_engine(engine: Engine) -> None:
+    """
+    统计引擎执行的语句
+    :param engine: 同步引擎，异步引擎传 async_engine.sync_engine
+    :return: None
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(max_count: int, route: Optional[str] = None) -> Iterator[list[QueryTracker]]:
+    """
+    测试辅助：断言代码块内每个请求执行的语句数不超过 max_count
+    需要启用 QUERY_TRACK_ENABLE，代码块内直接执行的语句也会统计
+
+    with assert_max_queries(3):
+        client.get("/api/admin/system/role", headers=headers)
+
+    :param max_count: 允许的最大语句数
+    :param route: 只检查该路由，如 "GET /api/admin/system/role"，None 检查全部
+    :return: 代码块内结束的请求统计
+    """
+    captured: list[QueryTracker] = []
+    tracker = QueryTracker()
+    token = _current.set(tracker)
+    _observers.append(captured)
+    try:
+        yield captured
+    finally:
+        _observers.remove(captured)
+        _current.reset(token)
+    for item in captured + [tracker]:
+        if route is not None and item.route != route:
+            continue
+        if item.count > max_count:
+            statements = "\n".join(f"  {n} x {statement}" for statement, n in item.statements.most_common())
+            raise AssertionError(
+                f"{item.route or 'block'} executed {item.count} queries, expected at most {max_count}:\n{statements}"
+            )
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/21
+# @File           : resources.py
+# @desc           : 生命周期资源管理
+"""
+settings.EVENTS 中的资源按顺序启动、逆序关闭：
+启动时记录每个资源的就绪耗时，某个资源启动失败时先关闭已启动的资源再抛出异常；
+关闭时单个资源失败只记录日志，不影响其余资源释放。
+
+数据库连接池在启动时预先建立 DATABASE_POOL_WARMUP 个连接，避免发布后的第一批请求承担建连耗时；
+关闭时等待后台任务结束，关闭执行计划线程池并释放全部连接池。
+热点数据通过 register_warmup 注册预热函数，在 warm_caches 事件中依次执行。
+"""
+import asyncio
+import importlib
+import time
+from typing import Callable, Awaitable, Optional
+
+from fastapi import FastAPI
+from sqlalchemy import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from config import settings
+from core import metrics, count, database
+from core.log import logger
+from core.slow_query import slow_query_log
+
+
+class ResourceManager:
+    """
+    生命周期资源的启动、关闭与就绪耗时
+    """
+
+    def __init__(self):
+        self.readiness: dict[str, dict] = {}
+        self._started: list[tuple[str, Callable]] = []
+        self._warmers: list[tuple[str, Callable[[AsyncSession], Awaitable]]] = []
+
+    def record(self, name: str, seconds: float, ok: bool = True, error: Optional[str] = None) -> None:
+        """
+        记录资源就绪耗时
+        :param name: 资源名称
+        :param seconds: 耗时，秒
+        :param ok: 是否就绪
+        :param error: 失败原因
+        :return: None
+        """
+        self.readiness[name] = {"ready": ok, "ms": round(seconds * 1000, 2), "error": error}
+        if ok:
+            logger.info(f"Resource ready: {name} in {seconds * 1000:.2f}ms")
+        else:
+            logger.error(f"Resource failed: {name} after {seconds * 1000:.2f}ms: {error}")
+
+    @staticmethod
+    def _load(path: str) -> Optional[Callable]:
+        try:
+            module = importlib.import_module(path[0:path.rindex(".")])
+            return getattr(module, path[path.rindex(".") + 1:])
+        except ModuleNotFoundError:
+            logger.error(f"ModuleNotFoundError：导入全局事件失败，未找到该模块：{path}")
+        except AttributeError:
+            logger.error(f"AttributeError：导入全局事件失败，未找到该模块下的方法：{path}")
+        return None
+
+    async def startup(self, app: FastAPI, events: list[Optional[str]]) -> None:
+        """
+        按顺序启动资源
+        """
+        begin = time.perf_counter()
+        for path in events:
+            if not path:
+                continue
+            func = self._load(path)
+            if func is None:
+                continue
+            start = time.perf_counter()
+            try:
+                await func(app=app, status=True)
+            except Exception as e:
+                self.record(path, time.perf_counter() - start, False, str(e))
+                await self.shutdown(app)
+                raise
+            self._started.append((path, func))
+            self.record(path, time.perf_counter() - start)
+        logger.info(f"Application ready in {(time.perf_counter() - begin) * 1000:.2f}ms")
+
+    async def shutdown(self, app: FastAPI) -> None:
+        """
+        逆序关闭已启动的资源
+        """
+        while self._started:
+            path, func = self._started.pop()
+            start = time.perf_counter()
+            try:
+                await func(app=app, status=False)
+                logger.info(f"Resource closed: {path} in {(time.perf_counter() - start) * 1000:.2f}ms")
+            except Exception as e:
+                logger.error(f"Resource close failed: {path}: {e}")
+
+    def register_warmup(self, name: str, func: Callable[[AsyncSession], Awaitable]) -> None:
+        """
+        注册预热函数，启动时用一个独立的数据库会话执行
+        :param name: 名称
+        :param func: async def func(db)
+        :return: None
+        """
+        self._warmers.append((name, func))
+
+    async def warm(self) -> None:
+        for name, func in self._warmers:
+            start = time.perf_counter()
+            try:
+                async with database.session_factory() as db:
+                    await func(db)
+            except Exception as e:
+                # 预热失败不影响启动，数据在第一次请求时加载
+                self.record(f"warmup:{name}", time.perf_counter() - start, False, str(e))
+                continue
+            self.record(f"warmup:{name}", time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        return dict(self.readiness)
+
+
+manager = ResourceManager()
+metrics.register_collector("resources", manager.stats)
+
+
+def register_warmup(name: str, func: Callable[[AsyncSession], Awaitable]) -> None:
+    manager.register_warmup(name, func)
+
+
+def _async_pools() -> list[tuple[str, AsyncEngine]]:
+    return [("async:primary", database.async_engine)] + \
+        [(f"async:replica-{index}", item) for index, item in enumerate(database.async_replica_engines)]
+
+
+def _sync_pools() -> list[tuple[str, Engine]]:
+    return [("sync:primary", database.engine)] + \
+        [(f"sync:replica-{index}", item) for index, item in enumerate(database.replica_engines)]
+
+
+def _warmup_size() -> int:
+    return max(0, min(settings.DATABASE_POOL_WARMUP, settings.DATABASE_POOL_SIZE))
+
+
+async def _open_async(engine: AsyncEngine, size: int) -> None:
+    connections = await asyncio.gather(*(engine.connect().start() for _ in range(size)))
+    for connection in connections:
+        await connection.close()
+
+
+def _open_sync(engine: Engine, size: int) -> None:
+    connections = []
+    try:
+        for _ in range(size):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def _timed(name: str, opening: Awaitable) -> Optional[Exception]:
+    start = time.perf_counter()
+    try:
+        await opening
+    except Exception as e:
+        manager.record(name, time.perf_counter() - start, False, str(e))
+        return e
+    manager.record(name, time.perf_counter() - start)
+    return None
+
+
+async def database_pools(app: FastAPI, status: bool):
+    """
+    启动时预先建立连接，关闭时释放全部连接池
+    主库连接失败时拒绝启动，从库连接失败只记录日志，由读写分离路由剔除
+    :param app: 应用对象
+    :param status: True 启动，False 关闭
+    :return: None
+    """
+    if status:
+        size = _warmup_size()
+        if not size:
+            return
+        loop = asyncio.get_running_loop()
+        pools = [(name, _open_async(item, size)) for name, item in _async_pools()]
+        pools += [(name, loop.run_in_executor(None, _open_sync, item, size)) for name, item in _sync_pools()]
+        errors = await asyncio.gather(*(_timed(f"database:{name}", opening) for name, opening in pools))
+        for (name, _), error in zip(pools, errors):
+            if error is not None and name.endswith(":primary"):
+                raise error
+    else:
+        await count.drain()
+        slow_query_log.shutdown()
+        await database.dispose_async_engines()
+        for _, item in _sync_pools():
+            item.dispose()
+        logger.info("Database pools disposed")
+
+
+async def warm_caches(app: FastAPI, status: bool):
+    """
+    执行已注册的预热函数
+    :param app: 应用对象
+    :param status: True 启动，False 关闭
+    :return: None
+    """
+    if status:
+        await manager.warm()
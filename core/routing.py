@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/12
+# @File           : routing.py
+# @desc           : 路由类
+"""
+官方文档——自定义路由类：https://fastapi.tiangolo.com/how-to/custom-request-and-route/
+
+`async def` endpoints run on the event loop, a dependency doing blocking database work
+there stalls the whole worker. Dependencies registered with register_async_variant are
+replaced by their AsyncSession variant when the route is declared on an `async def` endpoint,
+`def` endpoints keep the sync variant and run in the threadpool as before.
+"""
+import asyncio
+import functools
+import inspect
+from typing import Callable, Any
+
+from fastapi import params, Depends
+from fastapi.routing import APIRoute
+
+_async_variants: dict[Callable, Callable] = {}
+
+
+def register_async_variant(dependency: Callable, async_dependency: Callable) -> None:
+    """
+    Register the AsyncSession variant of a dependency
+    :param dependency: dependency built on core.database.get_db
+    :param async_dependency: same dependency built on core.database.get_async_db
+    :return: None
+    """
+    _async_variants[dependency] = async_dependency
+
+
+def get_async_variant(dependency: Callable) -> Callable:
+    """
+    Get the AsyncSession variant of a dependency
+    :param dependency: registered dependency
+    :return: async variant, the dependency itself when none is registered
+    """
+    return _async_variants.get(dependency, dependency)
+
+
+def use_async_variants(endpoint: Callable) -> Callable:
+    """
+    Rewrite the signature of an endpoint so registered dependencies use their async variant
+    :param endpoint: `async def` endpoint
+    :return: endpoint, wrapped when a dependency was replaced
+    """
+    signature = inspect.signature(endpoint)
+    parameters = []
+    replaced = False
+    for parameter in signature.parameters.values():
+        default = parameter.default
+        if isinstance(default, params.Depends) and default.dependency in _async_variants:
+            default = Depends(_async_variants[default.dependency], use_cache=default.use_cache)
+            parameter = parameter.replace(default=default)
+            replaced = True
+        parameters.append(parameter)
+    if not replaced:
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs) -> Any:
+        return await endpoint(*args, **kwargs)
+
+    wrapper.__signature__ = signature.replace(parameters=parameters)
+    return wrapper
+
+
+class AutoAsyncRoute(APIRoute):
+    """
+    Picks the sync or async variant of registered dependencies from the endpoint kind
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        if asyncio.iscoroutinefunction(endpoint):
+            endpoint = use_async_variants(endpoint)
+        super().__init__(path, endpoint, **kwargs)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/19
+# @File           : search.py
+# @desc           : n-gram 搜索索引
+"""
+LIKE '%x%' 无法使用 B-tree 索引，每次搜索都是全表扫描。
+
+n-gram 索引把字段值切成长度为 n 的片段（小写）存到索引表 (field, gram, row_id)，包含 x 的行一定包含 x 的全部片段，
+先用索引表按片段求交集得到候选行，再用原来的 LIKE 条件复核，结果与直接 LIKE 一致。
+搜索词短于 n 时没有完整片段，退回普通 LIKE；搜索词含 % _ \ 时 LIKE 按通配符和转义符解释，
+片段与索引中的原文对不上，同样退回普通 LIKE。
+
+get_filter_where 遇到已注册字段的 like 条件自动走索引；endswith 条件在注册了反转列的字段上改为反转列的前缀匹配，
+前缀匹配可以使用 B-tree 索引。
+
+索引在 ORM 插入、更新、删除时通过 mapper 事件维护；绕过 ORM 的批量写入需要用 NgramIndex.rows 自行写入片段，
+历史数据用 rebuild 重建。这里没有使用 MySQL FULLTEXT ngram 解析器，索引表在各数据库上行为一致。
+"""
+from typing import Optional, Iterable
+
+from sqlalchemy import event, select, insert, delete, func, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.elements import ColumnElement
+
+# LIKE 的通配符与 MySQL 默认转义符
+LIKE_SPECIAL_CHARS = ("%", "_", "\\")
+
+
+class NgramIndex:
+    """
+    模型字段的 n-gram 索引
+    """
+
+    def __init__(self, model, gram_model, fields: dict[str, int]):
+        """
+        :param model: 被索引的模型
+        :param gram_model: 索引表模型，包含 row_id / field / gram 三列
+        :param fields: 字段名与片段长度，中文姓名适合 2，手机号等数字适合 3
+        """
+        self.model = model
+        self.gram_model = gram_model
+        self.fields = fields
+
+    def grams(self, field: str, value: Optional[str]) -> set[str]:
+        """
+        字段值的全部片段
+        """
+        if not value:
+            return set()
+        n = self.fields[field]
+        value = value.lower()
+        return {value[i:i + n] for i in range(len(value) - n + 1)}
+
+    def rows(self, row_id: int, values: dict) -> list[dict]:
+        """
+        一行数据对应的索引表记录
+        :param row_id: 主键
+        :param values: 字段值，未注册的字段被忽略
+        :return: 索引表记录
+        """
+        return [{"row_id": row_id, "field": field, "gram": gram}
+                for field in self.fields if field in values
+                for gram in sorted(self.grams(field, values[field]))]
+
+    def condition(self, field: str, value: str) -> Optional[ColumnElement]:
+        """
+        包含 value 的候选行条件，value 短于片段长度时返回 None
+        """
+        grams = self.grams(field, value)
+        if not grams:
+            return None
+        gram_model = self.gram_model
+        candidates = select(gram_model.row_id).where(
+            gram_model.field == field,
+            gram_model.gram.in_(sorted(grams))
+        ).group_by(gram_model.row_id).having(func.count(gram_model.gram.distinct()) == len(grams))
+        return self.model.id.in_(candidates)
+
+    def _after_insert(self, mapper, connection, target) -> None:
+        rows = self.rows(target.id, {field: getattr(target, field) for field in self.fields})
+        if rows:
+            connection.execute(insert(self.gram_model), rows)
+
+    def _after_update(self, mapper, connection, target) -> None:
+        state = inspect(target)
+        changed = [field for field in self.fields if state.attrs[field].history.has_changes()]
+        if not changed:
+            return
+        connection.execute(delete(self.gram_model).where(
+            self.gram_model.row_id == target.id,
+            self.gram_model.field.in_(changed)
+        ))
+        rows = self.rows(target.id, {field: getattr(target, field) for field in changed})
+        if rows:
+            connection.execute(insert(self.gram_model), rows)
+
+    def _after_delete(self, mapper, connection, target) -> None:
+        connection.execute(delete(self.gram_model).where(self.gram_model.row_id == target.id))
+
+    async def rebuild(self, db: AsyncSession, batch_size: int = 1000) -> int:
+        """
+        重建全部索引，用于历史数据或索引字段调整之后
+        :param db: 数据库会话，调用方负责提交
+        :param batch_size: 每次读取的行数
+        :return: 索引的行数
+        """
+        await db.execute(delete(self.gram_model))
+        columns = [self.model.id] + [getattr(self.model, field) for field in self.fields]
+        total = 0
+        last_id = None
+        while True:
+            # 每页完整读取后再写入，连接上不留未读完的结果集
+            sql = select(*columns).order_by(self.model.id).limit(batch_size)
+            if last_id is not None:
+                sql = sql.where(self.model.id > last_id)
+            page = (await db.execute(sql)).all()
+            if not page:
+                break
+            rows = [gram for row in page for gram in self.rows(row[0], dict(zip(self.fields, row[1:])))]
+            if rows:
+                await db.execute(insert(self.gram_model), rows)
+            total += len(page)
+            last_id = page[-1][0]
+        return total
+
+
+_ngram_indexes: dict[tuple[type, str], NgramIndex] = {}
+_reversed_columns: dict[tuple[type, str], str] = {}
+
+
+def register_ngram_index(model, gram_model, fields: dict[str, int]) -> NgramIndex:
+    """
+    注册 n-gram 索引并在 ORM 写入时维护
+    :param model: 被索引的模型
+    :param gram_model: 索引表模型
+    :param fields: 字段名与片段长度
+    :return: 索引
+    """
+    index = NgramIndex(model, gram_model, fields)
+    for field in fields:
+        _ngram_indexes[(model, field)] = index
+    event.listen(model, "after_insert", index._after_insert)
+    event.listen(model, "after_update", index._after_update)
+    event.listen(model, "after_delete", index._after_delete)
+    return index
+
+
+def register_reversed_column(model, field: str, reversed_field: str) -> None:
+    """
+    注册反转列，reversed_field 保存 field 的逆序值，后缀匹配改为反转列的前缀匹配
+    反转列的值由模型自己维护
+    """
+    _reversed_columns[(model, field)] = reversed_field
+
+
+def get_ngram_index(model, field: str) -> Optional[NgramIndex]:
+    return _ngram_indexes.get((model, field))
+
+
+def ngram_indexes() -> Iterable[NgramIndex]:
+    return {id(index): index for index in _ngram_indexes.values()}.values()
+
+
+def _has_like_special(value: str) -> bool:
+    return any(char in value for char in LIKE_SPECIAL_CHARS)
+
+
+def like_conditions(model, field: str, value: str) -> list[ColumnElement]:
+    """
+    包含匹配条件，注册了索引的字段先用索引缩小范围
+    """
+    attr = getattr(model, field)
+    conditions = [attr.like(f"%{value}%")]
+    index = get_ngram_index(model, field)
+    if index is not None and not _has_like_special(value):
+        candidates = index.condition(field, value)
+        if candidates is not None:
+            conditions.insert(0, candidates)
+    return conditions
+
+
+def endswith_condition(model, field: str, value: str) -> ColumnElement:
+    """
+    后缀匹配条件，注册了反转列的字段使用反转列的前缀匹配
+    """
+    reversed_field = _reversed_columns.get((model, field))
+    # 转义符反转后位置不对，含特殊字符时不用反转列
+    if reversed_field is None or _has_like_special(value):
+        return getattr(model, field).like(f"%{value}")
+    return getattr(model, reversed_field).like(f"{value[::-1]}%")
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/15
+# @File           : slow_query.py
+# @desc           : 慢查询日志
+"""
+超过 SLOW_QUERY_THRESHOLD_MS 的语句记录参数、耗时与来源路由，同一指纹在 SLOW_QUERY_LOG_INTERVAL 秒内
+只记录一次，期间被跳过的次数在下一条日志中给出。
+
+SELECT 语句的执行计划在后台线程中用同步引擎执行 EXPLAIN 获取，不占用请求的连接和事件循环，
+计划与慢查询日志用同一个 id 关联。
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from sqlalchemy import event, Engine
+
+from config import settings
+from core import metrics
+from core.log import logger
+from core.query_tracker import fingerprint, get_tracker
+
+EXPLAIN_PREFIX = {
+    "mysql": "EXPLAIN ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+}
+
+
+class SlowQueryLog:
+    """
+    慢查询记录，按指纹限流
+    """
+
+    def __init__(self, max_fingerprints: int = 500, max_pending_explains: int = 10):
+        self.max_fingerprints = max_fingerprints
+        self.max_pending_explains = max_pending_explains
+        self._lock = threading.Lock()
+        self._last_logged: dict[str, float] = {}
+        self._suppressed: dict[str, int] = {}
+        self._stats: dict[str, dict] = {}
+        self._pending_explains = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+        return self._executor
+
+    def record(self, statement: str, parameters, duration: float, explain_engine: Optional[Engine]) -> None:
+        """
+        记录一条慢查询
+        :param statement: 执行的语句
+        :param parameters: 绑定参数
+        :param duration: 耗时，秒
+        :param explain_engine: 用于执行 EXPLAIN 的同步引擎，None 不获取执行计划
+        :return: None
+        """
+        fp = fingerprint(statement)
+        tracker = get_tracker()
+        route = tracker.route if tracker is not None else None
+        now = time.monotonic()
+        with self._lock:
+            self._update_stats(fp, duration, route)
+            last = self._last_logged.get(fp)
+            if last is not None and now - last < settings.SLOW_QUERY_LOG_INTERVAL:
+                self._suppressed[fp] = self._suppressed.get(fp, 0) + 1
+                return
+            if len(self._last_logged) >= self.max_fingerprints:
+                self._prune(now)
+            self._last_logged[fp] = now
+            suppressed = self._suppressed.pop(fp, 0)
+            explain = explain_engine is not None and settings.SLOW_QUERY_EXPLAIN \
+                and statement.lstrip()[:6].upper() == "SELECT" \
+                and self._pending_explains < self.max_pending_explains
+            if explain:
+                self._pending_explains += 1
+
+        query_id = hashlib.md5(fp.encode()).hexdigest()[:8]
+        content = f"Slow query [{query_id}] {duration * 1000:.2f}ms route: {route} params: {str(parameters)[:1000]}" \
+                  f" sql: {statement}"
+        if suppressed:
+            content += f" ({suppressed} similar suppressed)"
+        logger.warning(content)
+        if explain:
+            self.executor.submit(self._explain, query_id, explain_engine, statement, parameters)
+
+    def _update_stats(self, fp: str, duration: float, route: Optional[str]) -> None:
+        item = self._stats.get(fp)
+        if item is None:
+            if len(self._stats) >= self.max_fingerprints:
+                return
+            item = self._stats[fp] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "route": route}
+        item["count"] += 1
+        item["total_ms"] += duration * 1000
+        item["max_ms"] = max(item["max_ms"], duration * 1000)
+        item["route"] = route or item["route"]
+
+    def _prune(self, now: float) -> None:
+        for fp, last in list(self._last_logged.items()):
+            if now - last >= settings.SLOW_QUERY_LOG_INTERVAL:
+                del self._last_logged[fp]
+                self._suppressed.pop(fp, None)
+
+    def _explain(self, query_id: str, engine: Engine, statement: str, parameters) -> None:
+        try:
+            prefix = EXPLAIN_PREFIX.get(engine.dialect.name)
+            if prefix is None:
+                return
+            with engine.connect() as conn:
+                conn = conn.execution_options(slow_query_log=False)
+                rows = conn.exec_driver_sql(prefix + statement, parameters).all()
+            plan = "\n".join(str(tuple(row)) for row in rows)
+            logger.warning(f"Slow query [{query_id}] plan:\n{plan}")
+        except Exception as e:
+            logger.error(f"Slow query [{query_id}] explain failed: {e}")
+        finally:
+            with self._lock:
+                self._pending_explains -= 1
+
+    def stats(self, top: int = 20) -> list[dict]:
+        """
+        累计耗时最高的慢查询
+        """
+        with self._lock:
+            items = [{"sql": fp, **item} for fp, item in self._stats.items()]
+        items.sort(key=lambda item: item["total_ms"], reverse=True)
+        for item in items:
+            item["total_ms"] = round(item["total_ms"], 2)
+            item["max_ms"] = round(item["max_ms"], 2)
+        return items[:top]
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+slow_query_log = SlowQueryLog()
+metrics.register_collector("slow_queries", slow_query_log.stats)
+
+
+def watch_engine(engine: Engine, explain_engine: Optional[Engine] = None) -> None:
+    """
+    记录引擎的慢查询
+    :param engine: 同步引擎，异步引擎传 async_engine.sync_engine
+    :param explain_engine: 执行 EXPLAIN 的同步引擎，异步引擎需要传连接同一数据库的同步引擎
+    :return: None
+    """
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context.slow_query_start_time = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context.slow_query_start_time
+        if duration * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS and context.execution_options.get("slow_query_log", True):
+            slow_query_log.record(statement, parameters, duration, None if executemany else explain_engine)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
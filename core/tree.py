@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/22
+# @File           : tree.py
+# @desc           : 树形结构
+"""
+菜单、部门等 parent_id 自关联的数据生成树形结构。
+
+一次遍历建立 父节点 -> 子节点 的索引，每个节点只访问一次，节点数为 n 时耗时为 O(n)。
+每一层都按排序字段排序，排序字段为空的节点视为 0；父节点不在数据中的节点不会出现在树中。
+
+序列化函数 serialize(item, children) 接收节点对象和已经生成的子节点列表，返回节点数据，
+自底向上生成，没有递归深度限制。
+
+数据量大时按需加载：children_statement 按 parent_id 索引查直接子节点和它们的子节点数，
+subtree_cte / path_cte 用递归 CTE 查限定层数的子树和到根节点的路径（MySQL 8.0 及以上）。
+维护了闭包表的模型可以改用 core.closure 的 descendants / ancestors。
+"""
+from typing import Callable, Iterable, Any, Optional
+
+from sqlalchemy import select, func, literal, CTE, Select
+from sqlalchemy.orm import aliased
+
+from core.serializer import compile_serializer
+
+# 递归 CTE 的最大层数，数据中存在环时也能结束
+MAX_DEPTH = 64
+
+Serializer = Callable[[Any, list], dict]
+
+
+def children_index(items: Iterable, parent: str = "parent_id") -> dict[Any, list]:
+    """
+    父节点 -> 子节点列表，根节点的父节点为 None
+    :param items: 全部节点
+    :param parent: 父节点字段
+    :return: 索引
+    """
+    index: dict[Any, list] = {}
+    for item in items:
+        index.setdefault(getattr(item, parent) or None, []).append(item)
+    return index
+
+
+def build_tree(
+        items: Iterable,
+        serialize: Serializer,
+        order: Optional[str] = "order",
+        key: str = "id",
+        parent: str = "parent_id",
+        root: Any = None
+) -> list[dict]:
+    """
+    生成树形结构
+    :param items: 全部节点
+    :param serialize: 节点序列化函数 serialize(item, children)
+    :param order: 排序字段，None 为不排序
+    :param key: 主键字段
+    :param parent: 父节点字段
+    :param root: 根节点的父节点，None 为 parent 为空的节点
+    :return: 树
+    """
+    index = children_index(items, parent)
+    if order:
+        for nodes in index.values():
+            nodes.sort(key=lambda item: getattr(item, order) or 0)
+
+    # 广度优先得到访问顺序，逆序生成时子节点总是先于父节点
+    visited = list(index.get(root, []))
+    for item in visited:
+        visited.extend(index.get(getattr(item, key), []))
+
+    built: dict[Any, dict] = {}
+    for item in reversed(visited):
+        item_id = getattr(item, key)
+        built[item_id] = serialize(item, [built[getattr(child, key)] for child in index.get(item_id, [])])
+    return [built[getattr(item, key)] for item in index.get(root, [])]
+
+
+def options_serializer(label: str = "name") -> Serializer:
+    """
+    下拉选项 {"value", "label", "order", "children"}
+    :param label: 显示字段
+    :return: 序列化函数
+    """
+    def serialize(item, children: list) -> dict:
+        return {"value": item.id, "label": getattr(item, label), "order": item.order, "children": children}
+
+    return serialize
+
+
+def schema_serializer(schema) -> Serializer:
+    """
+    按 pydantic 模型的字段序列化，子节点直接挂到结果上，不再随父节点重复导出
+    :param schema: pydantic 模型，包含 children 字段
+    :return: 序列化函数
+    """
+    row = compile_serializer(schema, exclude={"children"})
+
+    def serialize(item, children: list) -> dict:
+        data = row(item)
+        data["children"] = children
+        return data
+
+    return serialize
+
+
+def child_count(model, where: Optional[Callable[[Any], list]] = None, parent: str = "parent_id"):
+    """
+    子节点数的关联子查询，按 parent_id 索引计数
+    :param model: 树形模型
+    :param where: 子节点的过滤条件 where(表) -> 条件列表，例如 lambda t: [t.deleted_at.is_(None)]
+    :param parent: 父节点字段
+    :return: 标量子查询
+    """
+    child = aliased(model)
+    conditions = [getattr(child, parent) == model.id] + (where(child) if where else [])
+    return select(func.count()).select_from(child).where(*conditions).scalar_subquery().label("child_count")
+
+
+def children_statement(
+        model,
+        parent_id: Optional[int],
+        where: Optional[Callable[[Any], list]] = None,
+        parent: str = "parent_id"
+) -> Select:
+    """
+    直接子节点及其子节点数
+    :param model: 树形模型
+    :param parent_id: 父节点，None 为根节点
+    :param where: 过滤条件 where(表) -> 条件列表，同时用于子节点计数
+    :param parent: 父节点字段
+    :return: select(model, child_count)
+    """
+    column = getattr(model, parent)
+    condition = column.is_(None) if parent_id is None else column == parent_id
+    return select(model, child_count(model, where, parent)).where(condition, *(where(model) if where else []))
+
+
+def subtree_cte(model, root_id: Optional[int], max_depth: int, parent: str = "parent_id") -> CTE:
+    """
+    子树节点的递归 CTE
+    :param model: 树形模型
+    :param root_id: 子树的根节点，depth 为 0；None 时从全部根节点开始
+    :param max_depth: 最大层数
+    :param parent: 父节点字段
+    :return: CTE(id, depth)
+    """
+    column = getattr(model, parent)
+    base = select(model.id.label("id"), literal(0).label("depth"))
+    base = base.where(column.is_(None) if root_id is None else model.id == root_id)
+    cte = base.cte("subtree", recursive=True)
+    return cte.union_all(
+        select(model.id, cte.c.depth + 1).where(column == cte.c.id, cte.c.depth < min(max_depth, MAX_DEPTH))
+    )
+
+
+def path_cte(model, node_id: int, parent: str = "parent_id") -> CTE:
+    """
+    节点到根节点路径的递归 CTE
+    :param model: 树形模型
+    :param node_id: 节点，depth 为 0，父节点 depth 为 1，以此类推
+    :param parent: 父节点字段
+    :return: CTE(id, parent_id, depth)
+    """
+    column = getattr(model, parent)
+    base = select(model.id.label("id"), column.label("parent_id"), literal(0).label("depth")).where(model.id == node_id)
+    cte = base.cte("path", recursive=True)
+    return cte.union_all(
+        select(model.id, column, cte.c.depth + 1).where(model.id == cte.c.parent_id, cte.c.depth < MAX_DEPTH)
+    )
@@ -12,12 +12,13 @@ FastApi Github: https://github.com/tiangolo/fastapi
 Typer documentation: https://typer.tiangolo.com/
 """
 
+import asyncio
+
 import typer
 import uvicorn
 from fastapi.openapi.docs import get_swagger_ui_html
 
 from config import settings,routers
-from core.database import engine, Base
 from core.event import lifespan
 from core.exception import register_exception
 from fastapi import FastAPI
@@ -25,6 +26,7 @@ from fastapi.staticfiles import StaticFiles
 
 from core.module import import_modules
 
+from core import migration
 from scripts import scheduler, initialize
 
 shell_app = typer.Typer()
@@ -50,7 +52,6 @@ def create_app():
             swagger_favicon_url="/media/swagger-ui/favicon.png"  # Local favicon
         )
 
-    Base.metadata.create_all(bind=engine)
     import_modules(settings.MIDDLEWARES, "middleware", app=app)
 
     # Global exception handling
@@ -100,17 +101,37 @@ def crontab():
     """
     scheduler.crontab()
 
+@shell_app.command()
+def upgrade(target: int = typer.Option(default=None, help='Target schema version, defaults to the latest')):
+    """
+    Apply pending database schema migrations
+    """
+    applied = migration.upgrade(target)
+    if applied:
+        print(f"applied migrations: {', '.join(f'v{version:04d}' for version in applied)}")
+    else:
+        print("database schema is up to date")
+
 @shell_app.command()
 def migrate():
     """
-    Generate roles, admin, and menu information
+    Apply schema migrations, then generate roles, admin, and menu information
     """
     print("initialize database")
     if settings.DEBUG:
-        initialize.migrate()
+        migration.upgrade()
+        asyncio.run(initialize.migrate())
     else:
         print("Migration not allowed in production environment")
 
+
+@shell_app.command()
+def reindex():
+    """
+    Rebuild search indexes and department closure of existing data
+    """
+    asyncio.run(initialize.rebuild_search_index())
+
 if __name__ == '__main__':
     try:
         shell_app()
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/20
+# @File           : __init__.py
+# @desc           : 数据库迁移脚本
+"""
+文件名 v<四位版本号>_<说明>.py，模块文档字符串的第一行作为版本说明，模块内定义 upgrade(conn)。
+新增脚本使用下一个版本号，已发布的脚本不要修改。执行：python main.py upgrade
+"""
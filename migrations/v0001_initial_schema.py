@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/20
+# @File           : v0001_initial_schema.py
+# @desc           : 初始表结构
+"""
+Initial schema
+
+Databases created by create_all before the migration runner already have these tables, they are skipped.
+The tables are the models as they were before the first migration, only what the DDL needs is kept.
+"""
+from sqlalchemy import Connection, MetaData, Table, Column, Integer, String, Boolean, DateTime, ForeignKey
+
+from core.migration import create_tables
+
+metadata = MetaData()
+
+
+def _base_columns() -> list[Column]:
+    return [
+        Column("id", Integer, primary_key=True, comment="主键ID"),
+        Column("created_at", DateTime, nullable=False, comment="创建时间"),
+        Column("updated_at", DateTime, nullable=False, comment="更新时间"),
+        Column("deleted_at", DateTime, nullable=True, comment="删除时间"),
+    ]
+
+
+menus = Table(
+    "menus", metadata,
+    *_base_columns(),
+    Column("title", String(50), nullable=False, comment="Menu title"),
+    Column("name", String(50), nullable=False, comment="Menu name"),
+    Column("icon", String(50), nullable=True, comment="Menu icon"),
+    Column("redirect", String(100), nullable=True, comment="Redirect address"),
+    Column("component", String(255), nullable=True, comment="Frontend component path"),
+    Column("path", String(50), nullable=True, comment="Frontend route path"),
+    Column("disabled", Boolean, nullable=False, comment="Whether disabled"),
+    Column("hidden", Boolean, nullable=False, comment="Whether hidden"),
+    Column("menu_type", Integer, nullable=False, comment="Menu type: 0=directory, 1=menu, 2=button"),
+    Column("perms", String(50), nullable=True, index=True, comment="Permission identifier"),
+    Column("order", Integer, nullable=False, comment="Sort order"),
+    Column("no_cache", Boolean, nullable=False,
+           comment="If set to true, will not be cached by <keep-alive> (default false)"),
+    Column("affix", Boolean, nullable=False, comment="If set to true, will be fixed in tag items (default false)"),
+    Column("parent_id", Integer, ForeignKey("menus.id"), nullable=True, comment="parent id"),
+    comment="Menus table"
+)
+
+roles = Table(
+    "roles", metadata,
+    *_base_columns(),
+    Column("role_key", String(50), nullable=False, index=True, comment="Role key"),
+    Column("name", String(50), nullable=False, index=True, comment="Name"),
+    Column("is_admin", Boolean, nullable=False, comment="Whether super role"),
+    Column("disabled", Boolean, nullable=False, comment="Whether disabled"),
+    Column("data_range", Integer, nullable=False, comment="Data permission scope"),
+    Column("order", Integer, nullable=False, comment="Sort order"),
+    Column("desc", String(255), nullable=True, comment="Description"),
+    comment="Roles table"
+)
+
+departments = Table(
+    "departments", metadata,
+    *_base_columns(),
+    Column("name", String(50), nullable=False, index=True, comment="Department name"),
+    Column("dept_key", String(50), nullable=False, index=True, comment="Department key"),
+    Column("disabled", Boolean, nullable=False, comment="Whether disabled"),
+    Column("order", Integer, nullable=True, comment="Display order"),
+    Column("desc", String(255), nullable=True, comment="Description"),
+    Column("owner", String(255), nullable=True, comment="Manager"),
+    Column("phone", String(255), nullable=True, comment="Contact phone"),
+    Column("email", String(255), nullable=True, comment="Email"),
+    Column("parent_id", Integer, ForeignKey("departments.id"), nullable=True, comment="parent id"),
+    comment="Departments table"
+)
+
+users = Table(
+    "users", metadata,
+    *_base_columns(),
+    Column("telephone", String(11), nullable=False, index=True, unique=True, comment="Phone number"),
+    Column("password", String(128), nullable=False, comment="Password"),
+    Column("name", String(50), nullable=False, index=True, comment="Full name"),
+    Column("nickname", String(50), nullable=True, comment="Nickname"),
+    Column("gender", String(8), nullable=True, comment="Gender"),
+    Column("disabled", Boolean, nullable=False, comment="Whether disabled"),
+    Column("is_staff", Boolean, nullable=False, comment="Whether staff member"),
+    Column("last_ip", String(50), nullable=True, comment="Last login IP"),
+    Column("last_login_at", DateTime, nullable=True, comment="Last login time"),
+    comment="Users table"
+)
+
+user_roles = Table(
+    "user_roles", metadata,
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+    Column("role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE")),
+    comment="User can have multiple roles"
+)
+
+role_menus = Table(
+    "role_menus", metadata,
+    Column("role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE")),
+    Column("menu_id", Integer, ForeignKey("menus.id", ondelete="CASCADE")),
+    comment="role has many menus"
+)
+
+user_departments = Table(
+    "user_departments", metadata,
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+    Column("dept_id", Integer, ForeignKey("departments.id", ondelete="CASCADE")),
+)
+
+role_departments = Table(
+    "role_departments", metadata,
+    Column("role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE")),
+    Column("dept_id", Integer, ForeignKey("departments.id", ondelete="CASCADE")),
+)
+
+dict_type = Table(
+    "dict_type", metadata,
+    *_base_columns(),
+    Column("name", String(50), nullable=False, index=True, comment="Dictionary name"),
+    Column("tp", String(50), nullable=False, index=True, comment="Dictionary type"),
+    Column("disabled", Boolean, nullable=False, comment="Dictionary status, whether disabled"),
+    Column("remark", String(255), nullable=True, comment="Remark"),
+    comment="Dictionary type table"
+)
+
+dict_details = Table(
+    "dict_details", metadata,
+    *_base_columns(),
+    Column("label", String(50), nullable=False, index=True, comment="Dictionary label"),
+    Column("value", String(50), nullable=False, index=True, comment="Dictionary key value"),
+    Column("disabled", Boolean, nullable=False, comment="Dictionary status, whether disabled"),
+    Column("is_default", Boolean, nullable=False, comment="Whether default"),
+    Column("order", Integer, nullable=False, comment="Dictionary sort order"),
+    Column("dict_type_id", Integer, ForeignKey("dict_type.id", ondelete="CASCADE"), nullable=False,
+           comment="Associated dictionary type"),
+    Column("remark", String(255), nullable=True, comment="Remark"),
+    comment="Dictionary details table"
+)
+
+
+def upgrade(conn: Connection) -> None:
+    create_tables(
+        conn,
+        menus, roles, departments, users,
+        user_roles, role_menus, user_departments, role_departments,
+        dict_type, dict_details,
+    )
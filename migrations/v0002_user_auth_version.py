@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/20
+# @File           : v0002_user_auth_version.py
+# @desc           : 用户认证版本号
+"""
+Add users.auth_version for cached principal invalidation
+"""
+from sqlalchemy import Connection, MetaData, Table, Column, Integer
+
+from core.migration import add_column
+
+users = Table(
+    "users", MetaData(),
+    Column("auth_version", Integer, nullable=False, server_default="0",
+           comment="Auth version, bumped when status or roles change to expire cached principals"),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    add_column(conn, users.c.auth_version)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/20
+# @File           : v0003_user_search_index.py
+# @desc           : 用户搜索索引
+"""
+Add users.telephone_rev and the user_ngrams search index
+
+Existing rows are backfilled, updated_at is written back unchanged so the backfill does not touch it.
+"""
+from sqlalchemy import Connection, MetaData, Table, Column, Index, Integer, String, DateTime, ForeignKey, select, \
+    update, bindparam
+
+from core.migration import add_column, create_index, create_tables
+
+BATCH_SIZE = 1000
+# Gram length of each indexed field when the index was created
+GRAM_SIZES = {"name": 2, "telephone": 3}
+
+metadata = MetaData()
+
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("telephone", String(11)),
+    Column("name", String(50)),
+    Column("updated_at", DateTime),
+    Column("telephone_rev", String(11), nullable=True,
+           comment="Reversed phone number, suffix searches become prefix searches"),
+)
+ix_users_telephone_rev = Index("ix_users_telephone_rev", users.c.telephone_rev)
+
+user_ngrams = Table(
+    "user_ngrams", metadata,
+    Column("field", String(20), primary_key=True, comment="Indexed field"),
+    Column("gram", String(8), primary_key=True, comment="Lower-cased n-gram"),
+    Column("row_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, comment="User id"),
+    Index("ix_user_ngrams_row_id", "row_id"),
+    comment="n-gram search index of users, maintained by core.search"
+)
+
+
+def _gram_rows(row_id: int, values: dict) -> list[dict]:
+    rows = []
+    for field, n in GRAM_SIZES.items():
+        value = (values[field] or "").lower()
+        grams = {value[i:i + n] for i in range(len(value) - n + 1)}
+        rows.extend({"row_id": row_id, "field": field, "gram": gram} for gram in sorted(grams))
+    return rows
+
+
+def upgrade(conn: Connection) -> None:
+    add_column(conn, users.c.telephone_rev)
+    create_index(conn, ix_users_telephone_rev)
+    create_tables(conn, user_ngrams)
+
+    backfill = update(users).where(users.c.id == bindparam("_id")).values(
+        telephone_rev=bindparam("_rev"),
+        updated_at=users.c.updated_at
+    )
+    conn.execute(user_ngrams.delete())
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(users.c.id, users.c.name, users.c.telephone)
+            .where(users.c.id > last_id).order_by(users.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        conn.execute(backfill, [{"_id": row.id, "_rev": row.telephone[::-1]} for row in rows])
+        grams = [gram for row in rows for gram in _gram_rows(row.id, {"name": row.name, "telephone": row.telephone})]
+        if grams:
+            conn.execute(user_ngrams.insert(), grams)
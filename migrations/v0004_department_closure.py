@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/24
+# @File           : v0004_department_closure.py
+# @desc           : 部门闭包表
+"""
+Add the department_closure table for role data scopes
+
+The closure is rebuilt from departments.parent_id. Roles.data_range was reserved and had no effect,
+roles holding a value outside 1-5 get 1 (all) so existing users keep seeing every row.
+"""
+from sqlalchemy import Connection, MetaData, Table, Column, Index, Integer, DateTime, ForeignKey, select, update
+
+from core.closure import rows_from_parents
+from core.migration import create_tables
+
+metadata = MetaData()
+
+departments = Table(
+    "departments", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("parent_id", Integer),
+)
+
+roles = Table(
+    "roles", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("data_range", Integer),
+    Column("updated_at", DateTime),
+)
+
+department_closure = Table(
+    "department_closure", metadata,
+    Column("ancestor_id", Integer, ForeignKey("departments.id", ondelete="CASCADE"), primary_key=True,
+           comment="Ancestor department id"),
+    Column("descendant_id", Integer, ForeignKey("departments.id", ondelete="CASCADE"), primary_key=True,
+           comment="Descendant department id"),
+    Column("depth", Integer, nullable=False, comment="Levels between them, 0 for the department itself"),
+    Index("ix_department_closure_descendant_id", "descendant_id"),
+    comment="Ancestor / descendant pairs of departments, maintained by core.closure"
+)
+
+
+def upgrade(conn: Connection) -> None:
+    create_tables(conn, department_closure)
+
+    pairs = conn.execute(select(departments.c.id, departments.c.parent_id)).all()
+    conn.execute(department_closure.delete())
+    rows = rows_from_parents((row.id, row.parent_id) for row in pairs)
+    if rows:
+        conn.execute(department_closure.insert(), rows)
+
+    conn.execute(update(roles).where(
+        (roles.c.data_range.is_(None)) | (roles.c.data_range.notin_([1, 2, 3, 4, 5]))
+    ).values(data_range=1, updated_at=roles.c.updated_at))
@@ -7,14 +7,13 @@
 from datetime import datetime
 from typing import Union, Optional
 
-from sqlalchemy import String, Boolean, Column, Integer, ForeignKey, Table, DateTime
+from sqlalchemy import String, Boolean, Column, Integer, ForeignKey, Table, DateTime, Index, event
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from passlib.context import CryptContext
 
+from core import search, closure
 from core.base import BaseModel
 from core.database import Base
-
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+from services.password import pwd_context
 
 user_roles = Table(
     "user_roles",
@@ -81,21 +80,6 @@ class Menu(BaseModel):
         comment="parent id"
     )
 
-    @staticmethod
-    def menus_order(datas: list, order: str = "order", children: str = "children") -> list:
-        """
-        Sort menus
-        :param datas: menu data
-        :param order: sort field
-        :param children: children field
-        :return: sorted menu list
-        """
-        result = sorted(datas, key=lambda menu: menu[order])
-        for item in result:
-            if item[children]:
-                item[children] = sorted(item[children], key=lambda menu: menu[order])
-        return result
-
 
 class Role(BaseModel):
     __tablename__ = "roles"
@@ -104,7 +88,11 @@ class Role(BaseModel):
     name: Mapped[str] = mapped_column(String(50), index=True, comment="Name")
     is_admin: Mapped[bool] = mapped_column(Boolean, default=False, comment="Whether super role")
     disabled: Mapped[bool] = mapped_column(Boolean, default=False, comment="Whether disabled")
-    data_range: Mapped[int] = mapped_column(Integer, default=4, comment="Data permission scope")
+    data_range: Mapped[int] = mapped_column(
+        Integer,
+        default=4,
+        comment="Data scope: 1=all, 2=custom departments, 3=own department, 4=own department and children, 5=self"
+    )
     order: Mapped[int or None] = mapped_column(Integer, default=0, comment="Sort order")
     desc: Mapped[str or None] = mapped_column(String(255), nullable=True, comment="Description")
 
@@ -117,6 +105,13 @@ class User(BaseModel):
     __tablename__ = 'users'
     __table_args__ = ({'comment': 'Users table'})
     telephone: Mapped[str] = mapped_column(String(11), index=True, unique=True, comment="Phone number")
+    telephone_rev: Mapped[Optional[str]] = mapped_column(
+        String(11),
+        index=True,
+        nullable=True,
+        default=lambda context: _reverse(context.get_current_parameters().get("telephone")),
+        comment="Reversed phone number, suffix searches become prefix searches"
+    )
     password: Mapped[str] = mapped_column(String(128), comment="Password")
     name: Mapped[str] = mapped_column(String(50), index=True, nullable=False, comment="Full name")
     nickname: Mapped[str or None] = mapped_column(String(50), nullable=True, comment="Nickname")
@@ -125,6 +120,12 @@ class User(BaseModel):
     is_staff: Mapped[bool] = mapped_column(Boolean, default=False, comment="Whether staff member")
     last_ip: Mapped[str or None] = mapped_column(String(50), nullable=True, comment="Last login IP")
     last_login_at: Mapped[datetime or None] = mapped_column(DateTime, nullable=True, comment="Last login time")
+    auth_version: Mapped[int] = mapped_column(
+        Integer,
+        default=0,
+        server_default="0",
+        comment="Auth version, bumped when status or roles change to expire cached principals"
+    )
 
     roles: Mapped[set[Role]] = relationship(secondary=user_roles)
     departments: Mapped[set["Department"]] = relationship(secondary=user_departments)
@@ -157,6 +158,38 @@ class User(BaseModel):
         return any([i.is_admin for i in self.roles])
 
 
+def _reverse(value: Optional[str]) -> Optional[str]:
+    return value[::-1] if value else None
+
+
+def _sync_telephone_rev(mapper, connection, target: User) -> None:
+    target.telephone_rev = _reverse(target.telephone)
+
+
+event.listen(User, "before_update", _sync_telephone_rev)
+
+
+class UserNgram(Base):
+    __tablename__ = "user_ngrams"
+    __table_args__ = (
+        Index("ix_user_ngrams_row_id", "row_id"),
+        {'comment': 'n-gram search index of users, maintained by core.search'}
+    )
+
+    field: Mapped[str] = mapped_column(String(20), primary_key=True, comment="Indexed field")
+    gram: Mapped[str] = mapped_column(String(8), primary_key=True, comment="Lower-cased n-gram")
+    row_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+        comment="User id"
+    )
+
+
+user_search_index = search.register_ngram_index(User, UserNgram, {"name": 2, "telephone": 3})
+search.register_reversed_column(User, "telephone", "telephone_rev")
+
+
 class Department(BaseModel):
     __tablename__ = "departments"
     __table_args__ = ({'comment': 'Departments table'})
@@ -177,17 +210,27 @@ class Department(BaseModel):
         comment="parent id"
     )
 
-    @classmethod
-    def dept_order(cls, datas: list, order: str = "order", children: str = "children") -> list:
-        """
-        Sort departments
-        :param datas: department data
-        :param order: sort field
-        :param children: children field
-        :return: sorted department list
-        """
-        result = sorted(datas, key=lambda dept: dept[order])
-        for item in result:
-            if item[children]:
-                item[children] = sorted(item[children], key=lambda dept: dept[order])
-        return result
+
+class DepartmentClosure(Base):
+    __tablename__ = "department_closure"
+    __table_args__ = (
+        Index("ix_department_closure_descendant_id", "descendant_id"),
+        {'comment': 'Ancestor / descendant pairs of departments, maintained by core.closure'}
+    )
+
+    ancestor_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("departments.id", ondelete="CASCADE"),
+        primary_key=True,
+        comment="Ancestor department id"
+    )
+    descendant_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("departments.id", ondelete="CASCADE"),
+        primary_key=True,
+        comment="Descendant department id"
+    )
+    depth: Mapped[int] = mapped_column(Integer, default=0, comment="Levels between them, 0 for the department itself")
+
+
+department_closure = closure.register_closure_table(Department, DepartmentClosure)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/25
+# @File           : benchmark_serializers.py
+# @desc           : 序列化性能对比
+"""
+对比 pydantic model_validate().model_dump() 与 core.serializer 预编译序列化函数的耗时，并确认两者输出一致。
+使用内存中构造的 ORM 对象，不连接数据库。
+
+执行：python -m scripts.benchmark_serializers --nodes 20000 --rounds 5
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+from api.admin.logics import system
+from api.admin.schemas import system_schemas
+from core import tree
+from models.user import Department, Menu, User
+
+
+def _departments(count: int) -> list[Department]:
+    now = datetime.now()
+    items = []
+    for i in range(1, count + 1):
+        parent_id = random.randint(max(1, i - 50), i - 1) if i > 1 else None
+        items.append(Department(
+            id=i, name=f"Branch {i}", dept_key=f"b{i}", disabled=False, order=random.randint(0, 100),
+            desc=None, owner="owner", phone="13800000000", email=None, parent_id=parent_id,
+            created_at=now, updated_at=now
+        ))
+    return items
+
+
+def _menus(count: int) -> list[Menu]:
+    items = []
+    for i in range(1, count + 1):
+        parent_id = random.randint(max(1, i - 20), i - 1) if i > 1 else None
+        items.append(Menu(
+            id=i, title=f"Menu {i}", name=f"Menu{i}", icon="icon", redirect=None, component="views/index",
+            path=f"/menu/{i}", disabled=False, hidden=False, order=random.randint(0, 100), menu_type=1,
+            perms=f"menu.{i}", parent_id=parent_id, no_cache=False, affix=False
+        ))
+    return items
+
+
+def _users(count: int) -> list[User]:
+    return [User(id=i, telephone=f"138{i:08d}", name=f"User {i}", nickname="nickname", disabled=False,
+                 gender="0", is_staff=True) for i in range(1, count + 1)]
+
+
+def _pydantic_node(schema):
+    def serialize(item, children):
+        data = schema.model_validate(item).model_dump(exclude={"children"})
+        data["children"] = children
+        return data
+
+    return serialize
+
+
+def _pydantic_router(item, children):
+    router = system_schemas.RouterOut.model_validate(item)
+    router.name = item.name
+    router.index = item.order
+    router.meta = system_schemas.Meta(
+        title=item.title, icon=item.icon, hideInMenu=item.hidden, affixTab=item.affix, order=item.order,
+        keepAlive=item.no_cache
+    )
+    data = router.model_dump(exclude={"children"})
+    data["children"] = children
+    return data
+
+
+def _measure(func, rounds: int) -> tuple[float, object]:
+    best, result = None, None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, result
+
+
+def run(nodes: int, rounds: int) -> None:
+    departments, menus, users = _departments(nodes), _menus(nodes), _users(nodes)
+    cases = [
+        ("department tree", lambda: tree.build_tree(departments, _pydantic_node(system_schemas.DeptTreeListOut)),
+         lambda: tree.build_tree(departments, system.department_tree_node)),
+        ("menu tree", lambda: tree.build_tree(menus, _pydantic_node(system_schemas.MenuTreeResponse)),
+         lambda: tree.build_tree(menus, system.menu_tree_node)),
+        ("router tree", lambda: tree.build_tree(menus, _pydantic_router),
+         lambda: tree.build_tree(menus, system._router_node)),
+        ("user rows", lambda: [system_schemas.UserResponse.model_validate(item).model_dump() for item in users],
+         lambda: [system._user_row(item) for item in users]),
+    ]
+    print(f"{nodes} rows, best of {rounds} rounds")
+    print(f"{'case':<18}{'pydantic ms':>14}{'compiled ms':>14}{'speedup':>10}")
+    for name, before, after in cases:
+        before_ms, expected = _measure(before, rounds)
+        after_ms, actual = _measure(after, rounds)
+        if actual != expected:
+            raise AssertionError(f"{name}: compiled output differs from pydantic")
+        print(f"{name:<18}{before_ms:>14.1f}{after_ms:>14.1f}{before_ms / after_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serializer benchmark")
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    run(args.nodes, args.rounds)
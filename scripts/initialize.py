@@ -5,46 +5,72 @@
 # @File           : initialize.py
 # @desc           : 数据初始化
 
+from sqlalchemy import update, func
+
 from api.admin.logics import system
 from api.admin.schemas import system_schemas
-from core import database
-
-db = database.session_local()
-
-
-def migrate():
-    print("create system menus")
-    create_system_menus()
-    print("create system departments")
-    create_system_department()
-    print("create system roles")
-    create_super_role()
-    print("create super user")
-    create_super_admin()
-
-
-def create_system_department():
+from core import database, search, closure
+from models.user import User
+
+
+async def migrate():
+    async with database.session_factory() as db:
+        database.use_primary(db)
+        print("create system menus")
+        await create_system_menus(db)
+        print("create system departments")
+        await create_system_department(db)
+        print("create system roles")
+        await create_super_role(db)
+        print("create super user")
+        await create_super_admin(db)
+    await database.dispose_async_engines()
+
+
+async def rebuild_search_index():
+    """
+    回填手机号反转列并重建 n-gram 搜索索引和闭包表，用于已有数据
+    """
+    async with database.session_factory() as db:
+        database.use_primary(db)
+        async with db.begin():
+            if database.async_engine.dialect.name == "mysql":
+                print("backfill reversed telephone")
+                await db.execute(update(User).where(User.telephone_rev.is_(None)).values(
+                    telephone_rev=func.reverse(User.telephone),
+                    updated_at=User.updated_at
+                ))
+            for index in search.ngram_indexes():
+                total = await index.rebuild(db)
+                print(f"rebuild {index.gram_model.__tablename__}: {total} rows")
+            for table in closure.closure_tables():
+                total = await table.rebuild(db)
+                print(f"rebuild {table.closure_model.__tablename__}: {total} rows")
+    await database.dispose_async_engines()
+
+
+async def create_system_department(db):
     department = {"name": "Headquarters", "dept_key": "head", "disabled": False, "order": 0,
                   "desc": "Headquarters department"}
     form_data = system_schemas.Department(**department)
-    system.create_department(db, None, form_data)
+    await system.create_department(db, None, form_data)
 
 
-def create_super_role():
+async def create_super_role(db):
     role = {"role_key": "admin", "name": "super admin", "disabled": False, "order": 0, "is_admin": 1,
             "desc": "super admin role", "dept_ids": [1]}
     form_data = system_schemas.RoleRequest(**role)
-    system.create_role(db, None, form_data)
+    await system.create_role(db, None, form_data)
 
 
-def create_super_admin():
+async def create_super_admin(db):
     user = {"telephone": '13800000000', 'name': 'super admin', 'nickname': "super admin", 'is_staff': True,
             'role_ids': [1], 'dept_ids': [1]}
     form_data = system_schemas.UserRequest(**user)
-    system.create_user(db, form_data)
+    await system.create_user(db, form_data)
 
 
-def create_system_menus():
+async def create_system_menus(db):
     # 系统管理
     system_menu = {
         "title": "system manage",
@@ -58,7 +84,7 @@ def create_system_menus():
         "parent_id": None
     }
     system_form = system_schemas.Menu(**system_menu)
-    system.create_menu(db, None, system_form)
+    await system.create_menu(db, None, system_form)
 
     # 菜单管理
     menu_menu = {
@@ -73,7 +99,7 @@ def create_system_menus():
         "parent_id": 1
     }
     menu_form = system_schemas.Menu(**menu_menu)
-    system.create_menu(db, None, menu_form)
+    await system.create_menu(db, None, menu_form)
 
     # 角色管理
     role_menu = {
@@ -88,7 +114,7 @@ def create_system_menus():
         "parent_id": 1
     }
     role_form = system_schemas.Menu(**role_menu)
-    system.create_menu(db, None, role_form)
+    await system.create_menu(db, None, role_form)
 
     # 用户管理
     user_menu = {
@@ -103,7 +129,7 @@ def create_system_menus():
         "parent_id": 1
     }
     user_form = system_schemas.Menu(**user_menu)
-    system.create_menu(db, None, user_form)
+    await system.create_menu(db, None, user_form)
 
     # 部门管理
     dept_menu = {
@@ -118,7 +144,7 @@ def create_system_menus():
         "parent_id": 1
     }
     user_form = system_schemas.Menu(**dept_menu)
-    system.create_menu(db, None, user_form)
+    await system.create_menu(db, None, user_form)
 
     # 字典管理
     dict_menu = {
@@ -133,4 +159,4 @@ def create_system_menus():
         "parent_id": 1
     }
     user_form = system_schemas.Menu(**dict_menu)
-    system.create_menu(db, None, user_form)
+    await system.create_menu(db, None, user_form)
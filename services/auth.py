@@ -4,42 +4,131 @@
 # @Create Time    : 2025/2/12
 # @File           : auth.py
 # @desc           : Authorization management
+import asyncio
+import json
+import uuid
+from calendar import timegm
+from dataclasses import dataclass, field, asdict
 from datetime import timedelta, datetime
 from typing import Optional, List, Union
 
 import jwt
-from fastapi import status, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import status, Depends, HTTPException, FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from redis.exceptions import RedisError
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 
 from config import settings
 from config.settings import oauth2_scheme
-from core.database import get_db
+from core.cache import LocalCache, get_redis, get_sync_redis, get_current_redis
+from core.database import get_db, get_async_db, use_primary
 from core.exception import CustomException
+from core.log import logger
 from core.response import SuccessResponse, ErrorResponse
-from models.user import User
-from utils import helpers
-
-
-def check_user_login(db, data):
+from core.routing import register_async_variant
+from models.user import User, Role, Menu, role_menus
+from services import password, login_guard
+from services.permission import registry, has_permission, ALL_PERMISSIONS
+
+PERMISSION_CACHE_PREFIX = "auth:perms:"
+PRINCIPAL_CACHE_PREFIX = "auth:principal:"
+AUTH_INVALIDATE_CHANNEL = "auth:invalidate"
+REFRESH_TOKEN_PREFIX = "auth:refresh:"
+REFRESH_REVOKED_PREFIX = "auth:refresh_revoked:"
+REFRESH_FAMILIES_PREFIX = "auth:refresh_families:"
+
+local_permission_cache = LocalCache(
+    maxsize=settings.PERMISSION_CACHE_LOCAL_SIZE,
+    expire=settings.PERMISSION_CACHE_LOCAL_EXPIRE
+)
+
+local_principal_cache = LocalCache(
+    maxsize=settings.PRINCIPAL_CACHE_LOCAL_SIZE,
+    expire=settings.PRINCIPAL_CACHE_LOCAL_EXPIRE
+)
+
+
+@dataclass
+class Principal:
+    """
+    Compact identity of an authenticated user, cached instead of the ORM object
+    """
+    id: int
+    telephone: str
+    disabled: bool
+    is_staff: bool
+    is_admin: bool
+    role_ids: list[int] = field(default_factory=list)
+    data_ranges: list[int] = field(default_factory=list)
+    version: int = 0
+    perm_mask: int = 0
+    perm_layout: str = ""
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            telephone=user.telephone,
+            disabled=user.disabled,
+            is_staff=user.is_staff,
+            is_admin=user.is_admin,
+            role_ids=[role.id for role in user.roles],
+            data_ranges=sorted({role.data_range for role in user.roles if role.data_range}),
+            version=user.auth_version or 0,
+        )
+
+    def dumps(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def loads(cls, data: str) -> "Principal":
+        return cls(**json.loads(data))
+
+
+async def check_user_login(db, request, data):
     """
     FastAPI authorization login
     :param db: database session
+    :param request: request object
     :param data: login data
     :return: token
     """
-    user = get_user_by_telephone(db, data.username)
+    rd = get_redis(request.app)
+    ip = login_guard.client_ip(request)
+    lock_ttl = await login_guard.get_login_lock_ttl(rd, data.username, ip)
+    if lock_ttl:
+        raise CustomException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            code=status.HTTP_429_TOO_MANY_REQUESTS,
+            msg=f"Too many failed attempts, try again in {lock_ttl} seconds"
+        )
+
+    user = await run_in_threadpool(get_user_by_telephone, db, data.username)
     error_code = status.HTTP_401_UNAUTHORIZED
     if not user:
+        await login_guard.record_login_failure(rd, data.username, ip)
         raise CustomException(status_code=error_code, code=error_code, msg="Phone number does not exist")
 
-    result = User.verify_password(data.password, user.password)
+    result = await password.verify_password(data.password, user.password)
     if not result:
+        await login_guard.record_login_failure(rd, data.username, ip)
         raise CustomException(status_code=error_code, code=error_code, msg="Incorrect phone number or password")
+    await login_guard.reset_login_failures(rd, data.username)
     if user.disabled:
         raise CustomException(status_code=error_code, code=error_code, msg="This phone number has been frozen")
-    data = {"id": user.id, "telephone": user.telephone}
     expire = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    return create_token(data, expire)
+    return create_token(get_token_payload(user), expire)
+
+
+def get_token_payload(user: User) -> dict:
+    """
+    Token claims of a user, ver lets stale cached principals be detected
+    :param user: user object
+    :return: claims
+    """
+    return {"id": user.id, "telephone": user.telephone, "ver": user.auth_version or 0}
 
 
 def create_token(payload: dict, expires: timedelta = None):
@@ -60,10 +149,149 @@ def create_token(payload: dict, expires: timedelta = None):
     return encoded_jwt
 
 
+def get_token_remaining(payload: dict) -> int:
+    """
+    Seconds until a decoded token expires, measured the same way create_token sets exp
+    :param payload: decoded token claims
+    :return: remaining seconds
+    """
+    return payload.get("exp", 0) - timegm(datetime.now().utctimetuple())
+
+
+async def create_refresh_token(rd, uid: int, version: int, family: str = None) -> str:
+    """
+    Issue a refresh token and register its jti as the live token of its family
+    The family is recorded under the user as well, revoke_refresh_tokens ends every session of a user.
+    :param rd: redis handler
+    :param uid: user id
+    :param version: auth version of the user
+    :param family: rotation family, a new family starts on login
+    :return: refresh token
+    """
+    jti = uuid.uuid4().hex
+    family = family or uuid.uuid4().hex
+    expire = settings.REFRESH_TOKEN_EXPIRE_MINUTES * 60
+    pipe = rd.pipeline(transaction=False)
+    pipe.set(f"{REFRESH_TOKEN_PREFIX}{jti}", family, ex=expire)
+    pipe.sadd(f"{REFRESH_FAMILIES_PREFIX}{uid}", family)
+    pipe.expire(f"{REFRESH_FAMILIES_PREFIX}{uid}", expire)
+    await pipe.execute()
+    payload = {"id": uid, "ver": version, "typ": "refresh", "jti": jti, "fam": family}
+    return create_token(payload, timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES))
+
+
+async def refresh_access_token(db: Session, request: Request, refresh_token: str) -> dict:
+    """
+    Rotate a refresh token into a new access and refresh token pair
+
+    Every refresh token can be used once. Presenting a token that was already rotated means
+    it leaked, the whole family is revoked and both holders have to login again.
+    :param db: database session
+    :param request: request object
+    :param refresh_token: refresh token
+    :return: new tokens
+    """
+    error_code = status.HTTP_401_UNAUTHORIZED
+    rd = get_redis(request.app)
+    if rd is None:
+        raise CustomException("Token refresh requires redis", desc="请启用 application/settings.py: CACHE_DB_ENABLE")
+    try:
+        payload = jwt.decode(refresh_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except jwt.InvalidTokenError:
+        raise CustomException(status_code=error_code, code=error_code, msg="Invalid refresh token")
+    if payload.get("typ") != "refresh":
+        raise CustomException(status_code=error_code, code=error_code, msg="Invalid refresh token")
+
+    family = payload["fam"]
+    try:
+        pipe = rd.pipeline(transaction=True)
+        pipe.exists(f"{REFRESH_REVOKED_PREFIX}{family}")
+        pipe.getdel(f"{REFRESH_TOKEN_PREFIX}{payload['jti']}")
+        revoked, live = await pipe.execute()
+        if live is None and not revoked:
+            expire = settings.REFRESH_TOKEN_EXPIRE_MINUTES * 60
+            await rd.set(f"{REFRESH_REVOKED_PREFIX}{family}", 1, ex=expire)
+            logger.warning(f"Refresh token reuse detected, family {family} of user {payload['id']} revoked")
+    except RedisError as e:
+        raise _refresh_unavailable(e)
+    if revoked or live is None:
+        raise CustomException(status_code=error_code, code=error_code, msg="Refresh token has been revoked")
+
+    user = await get_principal(request.app, db, int(payload["id"]), payload.get("ver", 0))
+    if user is None or user.disabled:
+        raise CustomException(status_code=error_code, code=error_code, msg="Phone number has been frozen")
+
+    access_payload = {"id": user.id, "telephone": user.telephone, "ver": user.version}
+    try:
+        new_refresh_token = await create_refresh_token(rd, user.id, user.version, family)
+    except RedisError as e:
+        # The presented token is already consumed, the client has to login again
+        raise _refresh_unavailable(e)
+    return {
+        "access_token": create_token(access_payload),
+        "refresh_token": new_refresh_token,
+        "token_type": "bearer",
+    }
+
+
+async def revoke_refresh_tokens(user_ids: List[int]) -> None:
+    """
+    Revoke every refresh token family of the users, call it after a password change
+    Access tokens already issued stay valid until they expire.
+    :param user_ids: user ids
+    :return: None
+    """
+    rd = get_current_redis()
+    if rd is None or not user_ids:
+        return
+    expire = settings.REFRESH_TOKEN_EXPIRE_MINUTES * 60
+    try:
+        pipe = rd.pipeline(transaction=False)
+        for uid in user_ids:
+            pipe.smembers(f"{REFRESH_FAMILIES_PREFIX}{uid}")
+        families = set().union(*await pipe.execute())
+        pipe = rd.pipeline(transaction=False)
+        for family in families:
+            pipe.set(f"{REFRESH_REVOKED_PREFIX}{family}", 1, ex=expire)
+        pipe.delete(*[f"{REFRESH_FAMILIES_PREFIX}{uid}" for uid in user_ids])
+        await pipe.execute()
+    except RedisError as e:
+        logger.error(f"Revoke refresh tokens of users {user_ids} failed: {e}")
+
+
+def _refresh_unavailable(e: RedisError) -> CustomException:
+    logger.error(f"Token refresh failed, redis unavailable: {e}")
+    error_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return CustomException(status_code=error_code, code=error_code, msg="Token refresh is temporarily unavailable")
+
+
 async def get_current_user(
+        request: Request,
         token: str = Depends(oauth2_scheme),
         db: Session = Depends(get_db)
-):
+) -> Principal:
+    return await authenticate(request, token, db)
+
+
+async def get_current_user_async(
+        request: Request,
+        token: str = Depends(oauth2_scheme),
+        db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    return await authenticate(request, token, db)
+
+
+register_async_variant(get_current_user, get_current_user_async)
+
+
+async def authenticate(request: Request, token: str, db: Union[Session, AsyncSession]) -> Principal:
+    """
+    Resolve the principal of a bearer token
+    :param request: request object
+    :param token: access token
+    :param db: database session, sync or async, only used on a cache miss
+    :return: principal
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -72,71 +300,370 @@ async def get_current_user(
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         uid: str = payload.get("id")
-        if uid is None:
+        if uid is None or payload.get("typ") == "refresh":
             raise credentials_exception
     except jwt.InvalidTokenError:
         raise credentials_exception
 
-    user = db.query(User).get(uid)
+    user = await get_principal(request.app, db, int(uid), payload.get("ver", 0))
 
-    if user is None:
+    if user is None or user.disabled:
         raise credentials_exception
+
+    # Sliding renewal, register_jwt_refresh_middleware hands the new token to the client
+    if get_token_remaining(payload) < settings.ACCESS_TOKEN_CACHE_MINUTES * 60:
+        request.scope["if-refresh"] = 1
+        request.scope["access-token"] = create_token(
+            {"id": user.id, "telephone": user.telephone, "ver": user.version}
+        )
     return user
 
 
+async def get_principal(
+        app: FastAPI,
+        db: Union[Session, AsyncSession],
+        uid: int,
+        version: int = 0
+) -> Optional[Principal]:
+    """
+    Get the principal of a user, worker LRU first, then redis, then the database
+
+    A cached principal older than the version carried by the token is treated as a miss.
+    :param app: application object
+    :param db: database session
+    :param uid: user id
+    :param version: auth version carried by the token
+    :return: principal, None when the user does not exist
+    """
+    key = f"{PRINCIPAL_CACHE_PREFIX}{uid}"
+    principal = local_principal_cache.get(key)
+    if principal is not None and principal.version >= version:
+        return principal
+
+    rd = get_redis(app)
+    if rd is not None:
+        try:
+            data = await rd.get(key)
+            if data is not None:
+                principal = Principal.loads(data)
+                if principal.version >= version:
+                    local_principal_cache.set(key, principal)
+                    return principal
+        except RedisError as e:
+            logger.warning(f"Principal cache unavailable, fall back to database: {e}")
+            rd = None
+
+    loaded = await load_principal(db, uid)
+    if loaded is None:
+        return None
+    principal, permissions = loaded
+    local_principal_cache.set(key, principal)
+    if rd is not None:
+        try:
+            pipe = rd.pipeline(transaction=False)
+            pipe.set(key, principal.dumps(), ex=settings.PRINCIPAL_CACHE_EXPIRE)
+            pipe.set(
+                f"{PERMISSION_CACHE_PREFIX}{uid}",
+                json.dumps(list(permissions)),
+                ex=settings.PERMISSION_CACHE_EXPIRE
+            )
+            await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Principal cache write failed: {e}")
+    else:
+        local_permission_cache.set(f"{PERMISSION_CACHE_PREFIX}{uid}", permissions)
+    return principal
+
+
+def _principal_statement(uid: int):
+    # Roles and their menus in one query, the permission set is built from the same rows
+    return select(User).options(joinedload(User.roles).joinedload(Role.menus)).where(User.id == uid)
+
+
+def _build_principal(user: User) -> tuple[Principal, set]:
+    principal = Principal.from_user(user)
+    if principal.is_admin:
+        permissions = {ALL_PERMISSIONS}
+    else:
+        permissions = {
+            menu.perms for role in user.roles for menu in role.menus if menu.perms and not menu.disabled
+        }
+    principal.perm_mask = registry.mask(permissions)
+    principal.perm_layout = registry.layout
+    return principal, permissions
+
+
+def _load_principal_sync(db: Session, uid: int) -> Optional[tuple[Principal, set]]:
+    user = db.execute(_principal_statement(uid)).unique().scalar_one_or_none()
+    return _build_principal(user) if user else None
+
+
+async def load_principal(db: Union[Session, AsyncSession], uid: int) -> Optional[tuple[Principal, set]]:
+    """
+    Load a principal and its permission set from the database
+    A sync session is used from the threadpool, never on the event loop.
+    :param db: database session, sync or async
+    :param uid: user id
+    :return: principal and permissions, None when the user does not exist
+    """
+    # The principal is cached until the next write, a lagging replica would cache the state before it
+    use_primary(db)
+    if isinstance(db, AsyncSession):
+        user = (await db.execute(_principal_statement(uid))).unique().scalar_one_or_none()
+        return _build_principal(user) if user else None
+    return await run_in_threadpool(_load_principal_sync, db, uid)
+
+
+async def bump_user_versions(db: AsyncSession, user_ids: List[int]) -> None:
+    """
+    Increase the auth version of users so cached principals and issued tokens become stale
+    The caller commits the session.
+    :param db: database session
+    :param user_ids: user ids
+    :return: None
+    """
+    if user_ids:
+        sql = update(User).where(User.id.in_(user_ids)).values(auth_version=User.auth_version + 1)
+        await db.execute(sql.execution_options(synchronize_session=False))
+
+
+async def auth_invalidation_listener(app: FastAPI, status: bool):
+    """
+    Keep the worker LRU in line with principal invalidations published by other workers
+    :param app: application object
+    :param status: True on startup, False on shutdown
+    :return: None
+    """
+    if status:
+        app.state.auth_listener = asyncio.create_task(_listen_auth_invalidation(app))
+    elif getattr(app.state, "auth_listener", None):
+        app.state.auth_listener.cancel()
+
+
+async def _listen_auth_invalidation(app: FastAPI):
+    while True:
+        rd = get_redis(app)
+        if rd is None:
+            return
+        pubsub = rd.pubsub()
+        try:
+            await pubsub.subscribe(AUTH_INVALIDATE_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                user_ids = json.loads(message["data"])
+                if user_ids is None:
+                    local_principal_cache.clear()
+                else:
+                    local_principal_cache.delete(*[f"{PRINCIPAL_CACHE_PREFIX}{i}" for i in user_ids])
+        except RedisError as e:
+            logger.warning(f"Auth invalidation channel lost, resubscribe: {e}")
+            # Entries written while unsubscribed cannot be trusted
+            local_principal_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+
+_permission_dependencies = {}
+
+
 def get_current_permission_user(required_perms: Optional[List[str]] = None):
     """
     Get current user and verify permissions dependency function
+
+    The permissions are declared here, when the route is declared, and compiled into a mask on the
+    first request. Routes requiring the same permissions share one dependency function.
     :param required_perms: list of permissions to verify
     :return: dependency function
     """
+    cache_key = frozenset(required_perms or [])
+    if cache_key in _permission_dependencies:
+        return _permission_dependencies[cache_key]
+
+    required_perms = sorted(cache_key)
+    registry.declare(required_perms)
 
     async def current_user_with_perms(
-            user: User = Depends(get_current_user)
-    ) -> User:
-        check_user_permissions(required_perms, user)
+            request: Request,
+            user: Principal = Depends(get_current_user),
+            db: Session = Depends(get_db)
+    ) -> Principal:
+        if required_perms:
+            user_mask = await get_user_permission_mask(request.app, db, user)
+            check_user_permissions(registry.compile(required_perms), user_mask)
+        return user
+
+    async def current_user_with_perms_async(
+            request: Request,
+            user: Principal = Depends(get_current_user_async),
+            db: AsyncSession = Depends(get_async_db)
+    ) -> Principal:
+        if required_perms:
+            user_mask = await get_user_permission_mask(request.app, db, user)
+            check_user_permissions(registry.compile(required_perms), user_mask)
         return user
 
+    register_async_variant(current_user_with_perms, current_user_with_perms_async)
+    _permission_dependencies[cache_key] = current_user_with_perms
     return current_user_with_perms
 
 
-def check_user_permissions(perms: Optional[List[str]], user: User):
+def check_user_permissions(required_mask: int, user_mask: int):
     """
     Verify if the interface has permission
-    :param perms: permissions
-    :param user: user object
+    :param required_mask: compiled permissions of the interface
+    :param user_mask: compiled permissions of the user
     :return: None
     """
-    check_perms = set(perms) if perms else None
-    user_perms = get_user_permissions(user)
-    ALL_PERMISSIONS = {'*.*.*'}
-    # When there are permissions to check and the user does not have full permissions, perform permission verification
-    if check_perms and ALL_PERMISSIONS.isdisjoint(user_perms):
-        # Using isdisjoint method is more efficient than set intersection
-        if user_perms.isdisjoint(check_perms):
-            raise CustomException(
-                msg="No permission to operate",
-                code=status.HTTP_403_FORBIDDEN
-            )
+    if not has_permission(user_mask, required_mask):
+        raise CustomException(
+            msg="No permission to operate",
+            code=status.HTTP_403_FORBIDDEN
+        )
+
 
+async def get_user_permission_mask(app: FastAPI, db: Union[Session, AsyncSession], user: Principal) -> int:
+    """
+    Get the compiled permissions of a user
 
-def get_user_permissions(user: User):
+    The mask travels with the cached principal, it is rebuilt from the permission cache only
+    when the principal was compiled under another registry layout.
+    :param app: application object
+    :param db: database session
+    :param user: principal object
+    :return: permissions mask
+    """
+    if user.perm_layout == registry.layout:
+        return user.perm_mask
+
+    perms = await get_cached_user_permissions(app, db, user)
+    user.perm_mask = registry.mask(perms)
+    user.perm_layout = registry.layout
+    key = f"{PRINCIPAL_CACHE_PREFIX}{user.id}"
+    local_principal_cache.set(key, user)
+    rd = get_redis(app)
+    if rd is not None:
+        try:
+            await rd.set(key, user.dumps(), ex=settings.PRINCIPAL_CACHE_EXPIRE)
+        except RedisError as e:
+            logger.warning(f"Principal cache write failed: {e}")
+    return user.perm_mask
+
+
+def get_user_permissions(db: Session, user: Principal):
     """
     Get user permissions
-    :param user: user object
+    :param db: database session
+    :param user: principal object
     :return: permissions set
     """
     if user.is_admin:
-        return {'*.*.*'}
+        return {ALL_PERMISSIONS}
+    if not user.role_ids:
+        return set()
+
+    return {perms for perms in db.scalars(_permissions_statement(user)).all() if perms}
 
-    permissions = set()
-    for role_obj in user.roles:
-        for menu in role_obj.menus:
-            if menu.perms and not menu.disabled:
-                permissions.add(menu.perms)
+
+def _permissions_statement(user: Principal):
+    return select(Menu.perms).join(role_menus, role_menus.c.menu_id == Menu.id).where(
+        role_menus.c.role_id.in_(user.role_ids),
+        Menu.perms.isnot(None),
+        Menu.disabled == 0
+    ).distinct()
+
+
+async def load_user_permissions(db: Union[Session, AsyncSession], user: Principal) -> set:
+    """
+    Get user permissions from the database without blocking the event loop
+    :param db: database session, sync or async
+    :param user: principal object
+    :return: permissions set
+    """
+    if user.is_admin:
+        return {ALL_PERMISSIONS}
+    if not user.role_ids:
+        return set()
+    if isinstance(db, AsyncSession):
+        return {perms for perms in (await db.scalars(_permissions_statement(user))).all() if perms}
+    return await run_in_threadpool(get_user_permissions, db, user)
+
+
+async def get_cached_user_permissions(app: FastAPI, db: Union[Session, AsyncSession], user: Principal) -> set:
+    """
+    Get user permissions through the permission cache
+
+    Redis holds the compiled set for every worker, the in-process cache is only used
+    when redis is disabled or unreachable. A warm lookup never touches the database.
+    :param app: application object
+    :param db: database session
+    :param user: principal object
+    :return: permissions set
+    """
+    key = f"{PERMISSION_CACHE_PREFIX}{user.id}"
+    rd = get_redis(app)
+    if rd is not None:
+        try:
+            data = await rd.get(key)
+            if data is not None:
+                return set(json.loads(data))
+            permissions = await load_user_permissions(db, user)
+            await rd.set(key, json.dumps(list(permissions)), ex=settings.PERMISSION_CACHE_EXPIRE)
+            return permissions
+        except RedisError as e:
+            logger.warning(f"Permission cache unavailable, fall back to local cache: {e}")
+
+    permissions = local_permission_cache.get(key)
+    if permissions is None:
+        permissions = await load_user_permissions(db, user)
+        local_permission_cache.set(key, permissions)
     return permissions
 
 
+def clear_user_auth_cache(user_ids: Optional[List[int]] = None) -> None:
+    """
+    Invalidate cached principals and permission sets, call it after user/role/menu associations change
+    Other workers drop their LRU entries through the redis invalidation channel.
+    :param user_ids: affected user ids, None invalidates every user
+    :return: None
+    """
+    if user_ids is not None and not user_ids:
+        return
+    prefixes = (PERMISSION_CACHE_PREFIX, PRINCIPAL_CACHE_PREFIX)
+    if user_ids is None:
+        local_permission_cache.delete_prefix(PERMISSION_CACHE_PREFIX)
+        local_principal_cache.delete_prefix(PRINCIPAL_CACHE_PREFIX)
+    else:
+        local_permission_cache.delete(*[f"{PERMISSION_CACHE_PREFIX}{i}" for i in user_ids])
+        local_principal_cache.delete(*[f"{PRINCIPAL_CACHE_PREFIX}{i}" for i in user_ids])
+
+    rd = get_sync_redis()
+    if rd is None:
+        return
+    try:
+        if user_ids is None:
+            keys = [key for prefix in prefixes for key in rd.scan_iter(match=f"{prefix}*", count=500)]
+        else:
+            keys = [f"{prefix}{i}" for prefix in prefixes for i in user_ids]
+        pipe = rd.pipeline(transaction=False)
+        if keys:
+            pipe.delete(*keys)
+        pipe.publish(AUTH_INVALIDATE_CHANNEL, json.dumps(user_ids))
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Clear auth cache failed: {e}")
+
+
+async def clear_user_auth_cache_async(user_ids: Optional[List[int]] = None) -> None:
+    """
+    clear_user_auth_cache for async callers, the redis round-trips run in the threadpool
+    :param user_ids: affected user ids, None invalidates every user
+    :return: None
+    """
+    await run_in_threadpool(clear_user_auth_cache, user_ids)
+
+
 async def check_telephone_login(db, request, form_data):
     """
     Phone number login
@@ -145,17 +672,29 @@ async def check_telephone_login(db, request, form_data):
     :param form_data: form data
     :return: response
     """
-    user = get_user_by_telephone(db, form_data.username)
+    rd = get_redis(request.app)
+    ip = login_guard.client_ip(request)
+    lock_ttl = await login_guard.get_login_lock_ttl(rd, form_data.username, ip)
+    if lock_ttl:
+        return ErrorResponse(
+            f"Too many failed attempts, try again in {lock_ttl} seconds",
+            code=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+
     try:
         # Phone number and password login
         if form_data.platform not in ["0", "1"]:
             raise ValueError("Other platforms are not supported yet")
         if form_data.method != '0':
             raise ValueError("Other login methods are not supported yet")
+        user = await run_in_threadpool(get_user_by_telephone, db, form_data.username)
         if not user:
+            await login_guard.record_login_failure(rd, form_data.username, ip)
             raise ValueError("User with this phone number does not exist")
-        if not User.verify_password(form_data.password, user.password):
+        if not await password.verify_password(form_data.password, user.password):
+            await login_guard.record_login_failure(rd, form_data.username, ip)
             raise ValueError("Incorrect password")
+        await login_guard.reset_login_failures(rd, form_data.username)
         if form_data.platform == '0' and not user.is_staff:
             raise ValueError("Must be a platform employee to login to admin backend")
 
@@ -182,18 +721,26 @@ async def check_normal_user_login(db, user, request):
         return ErrorResponse(str(e))
 
         # 登录成功创建 token
-    data = {"id": user.id, "telephone": user.telephone}
-    access_token = create_token(data)
+    access_token = create_token(get_token_payload(user))
+    rd = get_redis(request.app)
+    refresh_token = None
+    if rd is not None:
+        try:
+            refresh_token = await create_refresh_token(rd, user.id, user.auth_version or 0)
+        except RedisError as e:
+            # Login still succeeds, the client logs in again when the access token expires
+            logger.warning(f"Refresh token not issued, redis unavailable: {e}")
 
     result = {
         "id": user.id,
         "access_token": access_token,
+        "refresh_token": refresh_token,
         "name": user.name,
         "telephone": user.telephone,
         "is_staff": user.is_staff,  # 是否为员工
         "is_admin": user.is_admin,  # 是否为管理员
     }
-    await update_login_info(db, user, request.client.host)
+    await update_login_info(db, user, login_guard.client_ip(request))
     return SuccessResponse(result, "Login successful")
 
 
@@ -207,26 +754,7 @@ async def update_login_info(db, user, last_ip: str) -> None:
     """
     user.last_ip = last_ip
     user.last_login_at = datetime.now()
-    db.flush()
-
-
-async def reset_user_current_password(db, u, form_data):
-    """
-    Reset current user password
-    :param db: database session
-    :param u: user object
-    :param form_data: form data
-    :return: None
-    """
-    if form_data.password != form_data.password_two:
-        raise CustomException(msg="Passwords do not match", code=400)
-
-    result = helpers.valid_password(form_data.password)
-    if isinstance(result, str):
-        raise CustomException(result)
-
-    u.password = User.get_password_hash(form_data.password)
-    db.flush(u)
+    await run_in_threadpool(db.flush)
 
 
 def get_user_by_telephone(db: Session, telephone: str) -> Union[User, None]:
@@ -234,21 +762,21 @@ def get_user_by_telephone(db: Session, telephone: str) -> Union[User, None]:
     return db.query(User).filter(User.telephone == telephone).first()
 
 
-def check_user_register(db: Session, form_data):
+async def check_user_register(db: Session, form_data):
     # 验证密码一致性
     if form_data.password != form_data.confirm_password:
         raise HTTPException(status_code=400, detail="password and confirm_password do not match")
 
     # 检查用户是否存在
 
-    if get_user_by_telephone(db, form_data.telephone):
+    if await run_in_threadpool(get_user_by_telephone, db, form_data.telephone):
         raise HTTPException(status_code=400, detail="telephone already exists")
 
     data = form_data.model_dump(exclude={"confirm_password"})
-    data['password'] = User.get_password_hash(form_data.password)
+    data['password'] = await password.hash_password(form_data.password)
     data['disabled'] = False
     data['name'] = form_data.name
     data['nickname'] = data['name']
     user = User(**data)
     db.add(user)
-    db.commit()
\ No newline at end of file
+    await run_in_threadpool(db.commit)
\ No newline at end of file
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/24
+# @File           : data_scope.py
+# @desc           : Role data scopes
+"""
+Role.data_range limits the rows a user sees in department owned lists:
+
+1  all rows
+2  rows of the departments assigned to the role (role_departments)
+3  rows of the user's own departments
+4  rows of the user's own departments and every department below them
+5  only the user's own rows
+
+A user holding several roles sees the union of their scopes, a user without a scope only sees
+their own rows. Every scope is a subquery on indexed
+columns, "department and children" joins user_departments to department_closure, so a list query
+gets one extra condition and no extra round trip whatever the depth of the tree.
+"""
+from typing import Optional
+
+from sqlalchemy import select, union, or_, false
+from sqlalchemy.sql.elements import ColumnElement
+
+from models.user import User, DepartmentClosure, user_departments, role_departments
+from services.auth import Principal
+
+DATA_SCOPE_ALL = 1
+DATA_SCOPE_CUSTOM = 2
+DATA_SCOPE_DEPT = 3
+DATA_SCOPE_DEPT_AND_CHILDREN = 4
+DATA_SCOPE_SELF = 5
+
+
+def _unrestricted(principal: Principal) -> bool:
+    return principal.is_admin or DATA_SCOPE_ALL in principal.data_ranges
+
+
+def visible_departments(principal: Principal):
+    """
+    Subquery of the department ids a user may see
+    :param principal: current user
+    :return: select of department ids, None when every department is visible or none is
+    """
+    if _unrestricted(principal):
+        return None
+    ranges = set(principal.data_ranges)
+    parts = []
+    if DATA_SCOPE_CUSTOM in ranges:
+        parts.append(select(role_departments.c.dept_id).where(role_departments.c.role_id.in_(principal.role_ids)))
+    if DATA_SCOPE_DEPT in ranges:
+        parts.append(select(user_departments.c.dept_id).where(user_departments.c.user_id == principal.id))
+    if DATA_SCOPE_DEPT_AND_CHILDREN in ranges:
+        parts.append(
+            select(DepartmentClosure.descendant_id)
+            .join(user_departments, user_departments.c.dept_id == DepartmentClosure.ancestor_id)
+            .where(user_departments.c.user_id == principal.id)
+        )
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else union(*parts)
+
+
+def department_scope(principal: Principal, dept_column, owner_column=None) -> Optional[ColumnElement]:
+    """
+    Data scope condition of a model with a department column
+    :param principal: current user
+    :param dept_column: department id column of the rows
+    :param owner_column: user id column of the rows, used by the self scope
+    :return: condition, None when the user sees every row
+    """
+    if _unrestricted(principal):
+        return None
+    conditions = []
+    departments = visible_departments(principal)
+    if departments is not None:
+        conditions.append(dept_column.in_(departments))
+    if owner_column is not None and (DATA_SCOPE_SELF in principal.data_ranges or not conditions):
+        conditions.append(owner_column == principal.id)
+    return or_(*conditions) if conditions else false()
+
+
+def user_scope(principal: Principal) -> Optional[ColumnElement]:
+    """
+    Data scope condition of the user list, users belong to departments through user_departments
+    :param principal: current user
+    :return: condition, None when the user sees every user
+    """
+    if _unrestricted(principal):
+        return None
+    conditions = []
+    departments = visible_departments(principal)
+    if departments is not None:
+        conditions.append(User.id.in_(
+            select(user_departments.c.user_id).where(user_departments.c.dept_id.in_(departments))
+        ))
+    if DATA_SCOPE_SELF in principal.data_ranges or not conditions:
+        conditions.append(User.id == principal.id)
+    return or_(*conditions)
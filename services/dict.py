@@ -5,19 +5,32 @@
 # @Author  ：ben
 # @Date    ：2025/3/6 10:19 
 # @desc    : Data dictionary
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from core.cache import cached, invalidate_tags
+from core.curd import get_count
+from core.database import use_primary
 from core.exception import CustomException
+from core.resources import register_warmup
 from models.data_dict import DictType, DictDetails
 from utils import helpers
 
+# Dictionaries change rarely, every write drops every cached dictionary
+DICTS_TAG = "dicts"
+
 
-def get_dict_list(db, u):
+@cached(tags=(DICTS_TAG,), ignore=("db", "u"))
+async def get_dict_list(db: AsyncSession, u):
     """
     Get dictionary list
     :param db: database session
     :param u: user object
     :return: dictionary list
     """
-    dict_tp_list = db.query(DictType).all()
+    use_primary(db)
+    dict_tp_list = await db.scalars(select(DictType).options(selectinload(DictType.details)))
     result = []
     for dict_tp in dict_tp_list:
         tmp = {
@@ -33,8 +46,13 @@ def get_dict_list(db, u):
     return result
 
 
-def get_dict_details(db, tp):
-    dict_tp = db.query(DictType).filter(DictType.tp == tp).first()
+register_warmup("dictionaries", lambda db: get_dict_list(db, None))
+
+
+@cached(tags=(DICTS_TAG,), ignore=("db",))
+async def get_dict_details(db: AsyncSession, tp):
+    use_primary(db)
+    dict_tp = await db.scalar(select(DictType).where(DictType.tp == tp).options(selectinload(DictType.details)))
     result = []
     for item in dict_tp.details:
         result.append({"id": item.id,
@@ -49,16 +67,18 @@ def get_dict_details(db, tp):
     return sorted(result, key=lambda dt: dt['order'])
 
 
-def create_dict_type(db, u, form_data):
-    cnt = db.query(DictType).where(DictType.tp == form_data.tp).count()
+async def create_dict_type(db: AsyncSession, u, form_data):
+    cnt = await get_count(db, select(DictType).where(DictType.tp == form_data.tp))
     if cnt:
         raise CustomException("Identifier already exists, cannot create")
     dt = DictType(**form_data.model_dump())
     db.add(dt)
-    db.commit()
+    await db.commit()
+    await invalidate_tags(DICTS_TAG)
 
 
-def get_dict_single_default(db, tp, label):
+@cached(tags=(DICTS_TAG,), ignore=("db",))
+async def get_dict_single_default(db: AsyncSession, tp, label):
     """
     Get single dictionary detail
     :param db: database session
@@ -66,39 +86,42 @@ def get_dict_single_default(db, tp, label):
     :param label: dictionary label
     :return: dictionary value
     """
-    dict_tp = db.query(DictType).filter(DictType.tp == tp).first()
+    use_primary(db)
+    dict_tp = await db.scalar(select(DictType).where(DictType.tp == tp))
     if not dict_tp:
         return None
-    detail = db.query(DictDetails).filter(
+    detail = await db.scalar(select(DictDetails).where(
         DictDetails.dict_type_id == dict_tp.id,
-        DictDetails.label == label).first()
+        DictDetails.label == label).limit(1))
     return detail.value if detail else None
 
 
-def update_dict_type(db, u, data_id, form_data):
-    dt = db.query(DictType).get(data_id)
+async def update_dict_type(db: AsyncSession, u, data_id, form_data):
+    dt = await db.get(DictType, data_id)
     if not dt:
         raise CustomException("Dictionary type does not exist")
     dt.tp = form_data.tp
     dt.disabled = form_data.disabled
     dt.remark = form_data.remark
     dt.name = form_data.name
-    db.commit()
+    await db.commit()
+    await invalidate_tags(DICTS_TAG)
 
 
-def create_dict_detail(db, u, data_id, form_data):
-    dict_type = db.query(DictType).get(data_id)
+async def create_dict_detail(db: AsyncSession, u, data_id, form_data):
+    dict_type = await db.get(DictType, data_id)
     if not dict_type:
         raise CustomException("Dictionary type not found")
     data = form_data.model_dump()
     data['dict_type_id'] = data_id
     dt = DictDetails(**data)
     db.add(dt)
-    db.commit()
+    await db.commit()
+    await invalidate_tags(DICTS_TAG)
 
 
-def update_dict_detail(db, u, data_id, form_data):
-    de = db.query(DictDetails).get(data_id)
+async def update_dict_detail(db: AsyncSession, u, data_id, form_data):
+    de = await db.get(DictDetails, data_id)
     if not de:
         raise CustomException("Dictionary detail does not exist")
     de.value = form_data.value
@@ -106,18 +129,20 @@ def update_dict_detail(db, u, data_id, form_data):
     de.label = form_data.label
     de.is_default = form_data.is_default
     de.order = form_data.order
-    db.commit()
+    await db.commit()
+    await invalidate_tags(DICTS_TAG)
 
 
-def delete_dict_detail(db, u, detail_id):
+async def delete_dict_detail(db: AsyncSession, u, detail_id):
     """
     Delete dictionary detail
     :param db: database session
     :param u: user object
     :param detail_id: detail id to delete
     """
-    de = db.query(DictDetails).get(detail_id)
+    de = await db.get(DictDetails, detail_id)
     if not de:
         raise CustomException("Dictionary detail does not exist")
-    db.delete(de)
-    db.commit()
+    await db.delete(de)
+    await db.commit()
+    await invalidate_tags(DICTS_TAG)
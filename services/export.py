@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/18
+# @File           : export.py
+# @desc           : Streaming list export
+"""
+Rows are read in keyset pages of EXPORT_BATCH_SIZE and written to the response one page at a
+time, memory stays constant whatever the size of the export. Every page is a buffered query, so
+eager loads such as selectinload run after the page is fetched; a server-side cursor would be left
+open under them and MySQL drivers drop the rest of an unbuffered result.
+
+The request session is closed before a StreamingResponse body is sent, the export opens
+its own session that lives as long as the response body.
+"""
+import csv
+import io
+from typing import Callable, AsyncIterator
+
+import orjson
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+
+from config import settings
+from core.curd import keyset_paginate, keyset_next_cursor
+from core.database import session_factory
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+async def iter_rows(sql: Select, model, page: dict,
+                    serialize: Callable[[object], dict]) -> AsyncIterator[list[dict]]:
+    """
+    Read a select statement page by page in keyset order
+    :param sql: ORM select statement with filters applied, without order or limit
+    :param model: model of the statement, orders and seeks on page v_order_field and id
+    :param page: paging parameters QueryParams.dict(), only the order is used
+    :param serialize: converts one ORM object into a row
+    :return: pages of rows
+    """
+    page = {**page, "limit": settings.EXPORT_BATCH_SIZE, "v_cursor": None}
+    async with session_factory() as db:
+        while True:
+            records = (await db.scalars(keyset_paginate(sql, model, page))).all()
+            records, page["v_cursor"] = keyset_next_cursor(records, model, page)
+            if records:
+                yield [serialize(item) for item in records]
+            # Keep the identity map at one page
+            db.expunge_all()
+            if page["v_cursor"] is None:
+                break
+
+
+async def _csv_body(rows: AsyncIterator[list[dict]], fields: list[str]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    # BOM so Excel opens the file as UTF-8
+    buffer.write("\ufeff")
+    writer.writeheader()
+    async for partition in rows:
+        writer.writerows(partition)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def _ndjson_body(rows: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    async for partition in rows:
+        yield b"".join(orjson.dumps(row) + b"\n" for row in partition)
+
+
+def export_response(sql: Select, model, page: dict, fields: list[str], serialize: Callable[[object], dict],
+                    fmt: str, filename: str) -> StreamingResponse:
+    """
+    Stream the rows of a select statement as CSV or NDJSON
+    :param sql: ORM select statement with filters applied
+    :param model: model of the statement
+    :param page: paging parameters QueryParams.dict(), rows follow its order
+    :param fields: CSV columns in order
+    :param serialize: converts one ORM object into a row, values must be JSON serializable
+    :param fmt: csv or ndjson
+    :param filename: download name without extension
+    :return: streaming response
+    """
+    rows = iter_rows(sql, model, page, serialize)
+    body = _csv_body(rows, fields) if fmt == "csv" else _ndjson_body(rows)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'}
+    )
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/10
+# @File           : login_guard.py
+# @desc           : Login brute-force lockout
+"""
+Failed logins are counted per telephone and per client ip in redis sorted sets, scored by
+timestamp so that only the attempts inside the sliding window count. Crossing the limit
+locks the telephone or ip, every new lockout doubles the lock time.
+
+The lock check is one pipelined round-trip and runs before the user lookup and bcrypt,
+a locked-out guess costs neither database nor CPU time.
+
+The client ip is the socket peer unless LOGIN_CLIENT_IP_HEADER names the header a trusted reverse
+proxy sets, LOGIN_IP_ERROR_MAX_NUMBER = 0 turns the ip lock off.
+"""
+import time
+import uuid
+from typing import Optional
+
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from starlette.requests import Request
+
+from config import settings
+from core.log import logger
+
+FAIL_KEY = "auth:fail:{}:{}"
+LOCK_KEY = "auth:lock:{}:{}"
+LEVEL_KEY = "auth:lockn:{}:{}"
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """
+    Client ip of a request, read from LOGIN_CLIENT_IP_HEADER when it is configured
+    :param request: request object
+    :return: client ip, None when unknown
+    """
+    if settings.LOGIN_CLIENT_IP_HEADER:
+        forwarded = request.headers.get(settings.LOGIN_CLIENT_IP_HEADER)
+        if forwarded:
+            return forwarded.split(",")[-1].strip() or None
+    return request.client.host if request.client else None
+
+
+def _scopes(telephone: str, ip: Optional[str]) -> list[tuple[str, str, int]]:
+    scopes = [("tel", telephone, settings.DEFAULT_AUTH_ERROR_MAX_NUMBER)]
+    if ip and settings.LOGIN_IP_ERROR_MAX_NUMBER:
+        scopes.append(("ip", ip, settings.LOGIN_IP_ERROR_MAX_NUMBER))
+    return scopes
+
+
+async def get_login_lock_ttl(rd: Optional[aioredis.Redis], telephone: str, ip: Optional[str]) -> int:
+    """
+    Remaining lock time of a telephone or client ip
+    :param rd: redis handler, None disables the lockout
+    :param telephone: login telephone
+    :param ip: client ip
+    :return: seconds until the login is allowed again, 0 when not locked
+    """
+    if rd is None:
+        return 0
+    try:
+        pipe = rd.pipeline(transaction=False)
+        for scope, value, _ in _scopes(telephone, ip):
+            pipe.ttl(LOCK_KEY.format(scope, value))
+        ttls = await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Login lockout check skipped: {e}")
+        return 0
+    return max([0] + [ttl for ttl in ttls if ttl and ttl > 0])
+
+
+async def record_login_failure(rd: Optional[aioredis.Redis], telephone: str, ip: Optional[str]) -> int:
+    """
+    Count a failed login, lock the telephone or ip once the window limit is reached
+    :param rd: redis handler, None disables the lockout
+    :param telephone: login telephone
+    :param ip: client ip
+    :return: lock seconds applied, 0 when no lock was applied
+    """
+    if rd is None:
+        return 0
+    now = time.time()
+    window = settings.LOGIN_ERROR_WINDOW_SECONDS
+    scopes = _scopes(telephone, ip)
+    try:
+        pipe = rd.pipeline(transaction=True)
+        for scope, value, _ in scopes:
+            key = FAIL_KEY.format(scope, value)
+            pipe.zremrangebyscore(key, 0, now - window)
+            pipe.zadd(key, {uuid.uuid4().hex: now})
+            pipe.zcard(key)
+            pipe.expire(key, window)
+            pipe.get(LEVEL_KEY.format(scope, value))
+        result = await pipe.execute()
+
+        lock_seconds = 0
+        pipe = rd.pipeline(transaction=True)
+        for index, (scope, value, max_number) in enumerate(scopes):
+            count, level = result[index * 5 + 2], int(result[index * 5 + 4] or 0)
+            if count < max_number:
+                continue
+            seconds = min(settings.LOGIN_LOCK_SECONDS * 2 ** level, settings.LOGIN_LOCK_MAX_SECONDS)
+            lock_seconds = max(lock_seconds, seconds)
+            pipe.set(LOCK_KEY.format(scope, value), 1, ex=seconds)
+            pipe.incr(LEVEL_KEY.format(scope, value))
+            pipe.expire(LEVEL_KEY.format(scope, value), settings.LOGIN_LOCK_LEVEL_EXPIRE)
+            pipe.delete(FAIL_KEY.format(scope, value))
+        if lock_seconds:
+            await pipe.execute()
+            logger.warning(f"Login locked for {lock_seconds}s, telephone: {telephone}, ip: {ip}")
+        return lock_seconds
+    except RedisError as e:
+        logger.warning(f"Login failure not recorded: {e}")
+        return 0
+
+
+async def reset_login_failures(rd: Optional[aioredis.Redis], telephone: str) -> None:
+    """
+    Forget failed attempts of a telephone after a successful login
+    The ip counter is kept, a valid account must not reset the guesses made on others.
+    :param rd: redis handler, None disables the lockout
+    :param telephone: login telephone
+    :return: None
+    """
+    if rd is None:
+        return
+    try:
+        await rd.delete(FAIL_KEY.format("tel", telephone))
+    except RedisError as e:
+        logger.warning(f"Login failures not reset: {e}")
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/23
+# @File           : menu_cache.py
+# @desc           : Rendered menu tree cache
+"""
+Rendered menu trees are kept in redis as JSON, a warm request is a single GET.
+
+Router trees are cached per role-set fingerprint, every user holding the same roles shares one
+entry, the menu admin trees are cached per mode. Each entry is recorded in the set of every tag
+it depends on:
+
+menus       every tree, invalidated by menu writes
+menus:role:<id>   router trees of role sets containing the role, invalidated by role writes
+
+Entries live in the generic result cache of core.cache: concurrent misses of one tree render it once,
+MENU_CACHE_EXPIRE bounds how long an entry rendered just before a write can outlive it.
+"""
+import hashlib
+from typing import Awaitable, Callable, Iterable
+
+from config import settings
+from core import cache
+
+MENU_CACHE_PREFIX = "menu:tree:"
+MENUS_TAG = "menus"
+
+
+def role_tag(role_id: int) -> str:
+    return f"menus:role:{role_id}"
+
+
+def router_key(is_admin: bool, role_ids: Iterable[int]) -> str:
+    """
+    Cache key of a router tree, users with the same role set share it
+    :param is_admin: super admin sees every menu whatever the roles
+    :param role_ids: role ids of the user
+    :return: cache key
+    """
+    if is_admin:
+        return f"{MENU_CACHE_PREFIX}router:admin"
+    fingerprint = hashlib.md5(",".join(str(i) for i in sorted(set(role_ids))).encode()).hexdigest()
+    return f"{MENU_CACHE_PREFIX}router:{fingerprint}"
+
+
+def router_tags(is_admin: bool, role_ids: Iterable[int]) -> list[str]:
+    if is_admin:
+        return [MENUS_TAG]
+    return [MENUS_TAG] + [role_tag(i) for i in sorted(set(role_ids))]
+
+
+def list_key(mode: int) -> str:
+    return f"{MENU_CACHE_PREFIX}list:{mode}"
+
+
+async def get_or_load(key: str, tags: list[str], loader: Callable[[], Awaitable[list]]) -> list:
+    """
+    Read a rendered tree, render and store it on a miss
+    :param key: cache key
+    :param tags: tags the tree depends on
+    :param loader: renders the tree from the database
+    :return: tree
+    """
+    return await cache.get_or_set(key, loader, settings.MENU_CACHE_EXPIRE, tags)
+
+
+async def invalidate(*tags: str) -> None:
+    """
+    Drop the trees recorded under the tags, call it after the write is committed
+    :param tags: tags such as MENUS_TAG or role_tag(role_id)
+    :return: None
+    """
+    await cache.invalidate_tags(*tags)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/9
+# @File           : password.py
+# @desc           : Password hashing off the event loop
+"""
+bcrypt costs tens of milliseconds of CPU per call, run on the event loop it stalls every
+in-flight request of the worker. Hashing and verification are sent to a bounded process
+pool instead and callers await the result.
+
+concurrent.futures: https://docs.python.org/3/library/concurrent.futures.html
+"""
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Any
+
+from fastapi import FastAPI
+from passlib.context import CryptContext
+
+from config import settings
+from core import metrics
+from core.log import logger
+
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+def _ping() -> bool:
+    return True
+
+
+class PasswordHasher:
+    """
+    Bounded executor for password hashing with queue-depth and latency metrics
+    """
+
+    def __init__(self, workers: int, max_concurrency: int, sample_size: int = 1000):
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self._executor: Executor | None = None
+        self._executor_lock = threading.Lock()
+        self._async_slots: asyncio.Semaphore | None = None
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=sample_size)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    if self.workers > 0:
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context("spawn")
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.max_concurrency,
+                            thread_name_prefix="password"
+                        )
+        return self._executor
+
+    def _change(self, waiting: int = 0, running: int = 0) -> None:
+        with self._stats_lock:
+            self.waiting += waiting
+            self.running += running
+
+    def _done(self, start: float, ok: bool) -> None:
+        with self._stats_lock:
+            self.running -= 1
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self._latencies.append(time.perf_counter() - start)
+
+    async def run(self, func: Callable, *args) -> Any:
+        """
+        Run func in the pool from the event loop, waits for a free slot first
+        """
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        start = time.perf_counter()
+        self._change(waiting=1)
+        async with self._async_slots:
+            self._change(waiting=-1, running=1)
+            ok = False
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+                ok = True
+                return result
+            finally:
+                self._done(start, ok)
+
+    def warmup(self) -> None:
+        """
+        Start the pool processes so the first login does not pay the spawn cost
+        """
+        for future in [self.executor.submit(_ping) for _ in range(max(self.workers, 1))]:
+            future.result()
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            samples = list(self._latencies)
+            waiting, running, completed, failed = self.waiting, self.running, self.completed, self.failed
+        return {
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": waiting,
+            "running": running,
+            "completed": completed,
+            "failed": failed,
+            "latency_ms": metrics.latency_summary(samples)
+        }
+
+
+hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_CONCURRENCY)
+metrics.register_collector("password_hasher", hasher.stats)
+
+
+async def hash_password(password: str) -> str:
+    """
+    Generate hashed password without blocking the event loop
+    :param password: plain password
+    :return: hashed password
+    """
+    return await hasher.run(_hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    """
+    Verify plain password against hashed password without blocking the event loop
+    :param password: plain password
+    :param hashed_password: hashed password
+    :return: verification result
+    """
+    return await hasher.run(_verify, password, hashed_password)
+
+
+def default_password(telephone: str) -> str:
+    """
+    Password given to users created without one, DEFAULT_PASSWORD "0" means digits of the phone number
+    :param telephone: phone number
+    :return: plain password
+    """
+    if settings.DEFAULT_PASSWORD == "0":
+        return telephone[5:12]
+    return settings.DEFAULT_PASSWORD
+
+
+async def password_hasher(app: FastAPI, status: bool):
+    """
+    Start the hashing pool with the application and shut it down afterwards
+    :param app: application object
+    :param status: True on startup, False on shutdown
+    :return: None
+    """
+    if status:
+        await asyncio.get_running_loop().run_in_executor(None, hasher.warmup)
+        logger.info(f"Password hasher started with {hasher.workers} workers")
+    else:
+        hasher.shutdown()
+        logger.info("Password hasher closed")
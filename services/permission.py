@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/11
+# @File           : permission.py
+# @desc           : Bitmask permission engine
+"""
+Permission strings (Menu.perms, e.g. system.user.create) are interned into bit positions,
+the permissions a route requires are compiled into an integer mask and the permissions of a
+user are compiled into one integer, a permission check is a single AND.
+
+Bit 0 is reserved for the wildcard *.*.* which grants everything.
+Only permissions declared by routes get a bit, they are numbered in sorted order so every worker
+running the same code agrees on the layout whatever order the routers are imported in. Menu
+permissions no route requires can never grant access and are left out. The layout fingerprint
+tells a cached mask built under a different layout apart.
+"""
+import hashlib
+import threading
+from typing import Iterable, Optional
+
+ALL_PERMISSIONS = '*.*.*'
+ALL_PERMISSIONS_MASK = 1
+
+
+class PermissionRegistry:
+    """
+    Interns the permissions routes declare into bit positions
+    """
+
+    def __init__(self):
+        self._declared: set[str] = set()
+        self._bits: dict[str, int] = {ALL_PERMISSIONS: 0}
+        self._masks: dict[tuple[str, ...], int] = {}
+        self._lock = threading.Lock()
+        self._layout: Optional[str] = None
+
+    def declare(self, perms: Iterable[str]) -> None:
+        """
+        Register the permissions a route requires, the bits are renumbered when a new one shows up
+        """
+        with self._lock:
+            new = set(perms) - self._declared - {ALL_PERMISSIONS}
+            if not new:
+                return
+            self._declared |= new
+            bits = {ALL_PERMISSIONS: 0}
+            for perm in sorted(self._declared):
+                bits[perm] = len(bits)
+            self._bits = bits
+            self._masks = {}
+            self._layout = None
+
+    def compile(self, perms: Iterable[str]) -> int:
+        """
+        Compile route permissions into a mask, the result is kept until the layout changes
+        """
+        key = tuple(sorted(perms))
+        mask = self._masks.get(key)
+        if mask is None:
+            self.declare(key)
+            with self._lock:
+                mask = 0
+                for perm in key:
+                    mask |= 1 << self._bits[perm]
+                self._masks[key] = mask
+        return mask
+
+    def mask(self, perms: Iterable[str]) -> int:
+        """
+        Compile user permissions into a mask
+        Permissions no route requires have no bit and are left out.
+        """
+        bits = self._bits
+        mask = 0
+        for perm in perms:
+            bit = bits.get(perm)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    @property
+    def layout(self) -> str:
+        """
+        Fingerprint of the current bit layout
+        """
+        if self._layout is None:
+            ordered = sorted(self._bits.items(), key=lambda item: item[1])
+            self._layout = hashlib.md5("\n".join(perm for perm, _ in ordered).encode()).hexdigest()[:12]
+        return self._layout
+
+    def __len__(self) -> int:
+        return len(self._bits)
+
+
+registry = PermissionRegistry()
+
+
+def has_permission(user_mask: int, required_mask: int) -> bool:
+    """
+    Check a user mask against a route mask, any of the required permissions is enough
+    :param user_mask: compiled user permissions
+    :param required_mask: compiled route permissions, 0 requires nothing
+    :return: whether access is granted
+    """
+    return not required_mask or bool(user_mask & (required_mask | ALL_PERMISSIONS_MASK))
+
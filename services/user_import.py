@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/17
+# @File           : user_import.py
+# @desc           : Bulk user import
+"""
+The upload is decoded and parsed line by line as it arrives, it is never held in memory as a whole.
+
+CSV     first line is the header, columns are the UserRequest fields, role_ids and dept_ids are
+        separated by "|", empty cells take the default value, fields cannot contain line breaks
+NDJSON  one JSON object per line
+
+The read-only columns of the user export (id, roles, created_at) are ignored, an export can be
+imported into another environment as it is.
+
+Rows are processed in batches of USER_IMPORT_BATCH_SIZE:
+1. validation with UserRequest, a phone number repeated in the upload fails on its second row
+2. one IN query finds the phone numbers that already exist
+3. passwords are hashed in parallel on the password pool, each distinct password only once
+4. users are inserted with executemany, their ids are read back by phone number and the
+   user_roles / user_departments links and the search n-grams are inserted with executemany,
+   one transaction per batch
+
+The import runs on its own primary session, a failed batch does not undo the batches before it.
+"""
+import asyncio
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Optional
+
+from pydantic import ValidationError
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.admin.schemas.system_schemas import UserRequest
+from config import settings
+from core.database import session_factory, use_primary
+from core.exception import CustomException
+from models.user import User, Role, Department, UserNgram, user_roles, user_departments, user_search_index
+from services import password
+
+IMPORT_FORMATS = ("csv", "ndjson")
+LIST_FIELDS = ("role_ids", "dept_ids")
+# Columns of the user export that are not UserRequest fields
+READ_ONLY_FIELDS = ("id", "roles", "created_at")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Split a byte stream into lines
+    :param chunks: raw body chunks, such as Request.stream()
+    :return: lines without line endings
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    try:
+        async for chunk in chunks:
+            buffer += decoder.decode(chunk)
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                yield line.rstrip("\r")
+        buffer += decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise CustomException("The upload must be UTF-8 encoded")
+    if buffer.strip():
+        yield buffer.rstrip("\r")
+
+
+def _csv_record(header: list[str], line: str) -> tuple[Optional[dict], Optional[str]]:
+    values = next(csv.reader([line]))
+    if len(values) != len(header):
+        return None, f"Expected {len(header)} columns, got {len(values)}"
+    data = {}
+    for field, value in zip(header, values):
+        value = value.strip()
+        if value == "" or field in READ_ONLY_FIELDS:
+            continue
+        if field in LIST_FIELDS:
+            data[field] = [item.strip() for item in value.split("|") if item.strip()]
+        else:
+            data[field] = value
+    return data, None
+
+
+def _ndjson_record(line: str) -> tuple[Optional[dict], Optional[str]]:
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        return None, f"Invalid JSON: {e}"
+    if not isinstance(data, dict):
+        return None, "Each line must be a JSON object"
+    for field in READ_ONLY_FIELDS:
+        data.pop(field, None)
+    for field in LIST_FIELDS:
+        # The export writes list fields with the CSV separator
+        if isinstance(data.get(field), str):
+            data[field] = [item.strip() for item in data[field].split("|") if item.strip()]
+    return data, None
+
+
+async def iter_records(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Parse lines into records, blank lines are skipped
+    :param lines: lines of the upload
+    :param fmt: csv or ndjson
+    :return: row number, record, parse error
+    """
+    header = None
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        if fmt == "csv" and header is None:
+            header = [field.strip() for field in next(csv.reader([line]))]
+            unknown = set(header) - set(UserRequest.model_fields) - set(READ_ONLY_FIELDS)
+            if unknown:
+                raise CustomException(f"Unknown columns: {', '.join(sorted(unknown))}")
+            continue
+        row += 1
+        data, error = _csv_record(header, line) if fmt == "csv" else _ndjson_record(line)
+        yield row, data, error
+
+
+class ImportReport:
+    """
+    Outcome of an import, one entry per failed row
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.created = 0
+        self.errors: list[dict] = []
+
+    def fail(self, row: int, telephone: Optional[str], errors: list[str]) -> None:
+        self.errors.append({"row": row, "telephone": telephone, "errors": errors})
+
+    def dict(self) -> dict:
+        errors = sorted(self.errors, key=lambda item: item["row"])
+        return {"total": self.total, "created": self.created, "failed": len(errors), "errors": errors}
+
+
+def _validation_messages(e: ValidationError) -> list[str]:
+    messages = []
+    for error in e.errors():
+        loc = ".".join(str(item) for item in error["loc"])
+        messages.append(f"{loc}: {error['msg']}" if loc else error["msg"])
+    return messages
+
+
+async def _hash_passwords(plain_passwords: list[str]) -> dict[str, str]:
+    distinct = list(set(plain_passwords))
+    hashed = await asyncio.gather(*(password.hash_password(item) for item in distinct))
+    return dict(zip(distinct, hashed))
+
+
+async def _import_batch(db: AsyncSession, batch: list[tuple[int, UserRequest]], report: ImportReport) -> None:
+    telephones = [item.telephone for _, item in batch]
+    async with db.begin():
+        existing = set(await db.scalars(select(User.telephone).where(User.telephone.in_(telephones))))
+    rows = []
+    for row, item in batch:
+        if item.telephone in existing:
+            report.fail(row, item.telephone, ["Phone number already exists"])
+        else:
+            rows.append((row, item))
+    if not rows:
+        return
+
+    plain_passwords = {item.telephone: item.password or password.default_password(item.telephone) for _, item in rows}
+    hashed = await _hash_passwords(list(plain_passwords.values()))
+    values = []
+    for _, item in rows:
+        value = item.model_dump(exclude={"role_ids", "dept_ids"})
+        value["password"] = hashed[plain_passwords[item.telephone]]
+        values.append(value)
+
+    try:
+        async with db.begin():
+            await _insert_batch(db, rows, values)
+    except IntegrityError as e:
+        for row, item in rows:
+            report.fail(row, item.telephone, [f"Batch rejected by the database: {e.orig}"])
+        return
+    report.created += len(rows)
+
+
+async def _insert_batch(db: AsyncSession, rows: list[tuple[int, UserRequest]], values: list[dict]) -> None:
+    await db.execute(insert(User), values)
+    telephones = [item.telephone for _, item in rows]
+    ids = dict((await db.execute(select(User.telephone, User.id).where(User.telephone.in_(telephones)))).all())
+    role_links = [{"user_id": ids[item.telephone], "role_id": role_id}
+                  for _, item in rows for role_id in set(item.role_ids)]
+    dept_links = [{"user_id": ids[item.telephone], "dept_id": dept_id}
+                  for _, item in rows for dept_id in set(item.dept_ids)]
+    grams = [gram for _, item in rows
+             for gram in user_search_index.rows(ids[item.telephone], {"name": item.name, "telephone": item.telephone})]
+    await db.execute(insert(UserNgram), grams)
+    if role_links:
+        await db.execute(insert(user_roles), role_links)
+    if dept_links:
+        await db.execute(insert(user_departments), dept_links)
+
+
+async def import_users(lines: AsyncIterator[str], fmt: str) -> dict:
+    """
+    Import users from an upload
+    :param lines: lines of the upload
+    :param fmt: csv or ndjson
+    :return: import report
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise CustomException(f"Unsupported import format: {fmt}")
+    async with session_factory() as db:
+        use_primary(db)
+        async with db.begin():
+            role_ids = set(await db.scalars(select(Role.id)))
+            dept_ids = set(await db.scalars(select(Department.id)))
+        return await _import(db, lines, fmt, role_ids, dept_ids)
+
+
+async def _import(db: AsyncSession, lines: AsyncIterator[str], fmt: str, role_ids: set[int], dept_ids: set[int]) -> dict:
+    report = ImportReport()
+    seen: set[str] = set()
+    batch: list[tuple[int, UserRequest]] = []
+    async for row, data, error in iter_records(lines, fmt):
+        report.total += 1
+        if error:
+            report.fail(row, None, [error])
+            continue
+        try:
+            item = UserRequest.model_validate(data)
+        except ValidationError as e:
+            report.fail(row, str(data.get("telephone") or "") or None, _validation_messages(e))
+            continue
+        errors = []
+        if item.telephone in seen:
+            errors.append("Phone number repeated in the upload")
+        missing_roles = set(item.role_ids) - role_ids
+        if missing_roles:
+            errors.append(f"Roles do not exist: {sorted(missing_roles)}")
+        missing_depts = set(item.dept_ids) - dept_ids
+        if missing_depts:
+            errors.append(f"Departments do not exist: {sorted(missing_depts)}")
+        if errors:
+            report.fail(row, item.telephone, errors)
+            continue
+        seen.add(item.telephone)
+        batch.append((row, item))
+        if len(batch) >= settings.USER_IMPORT_BATCH_SIZE:
+            await _import_batch(db, batch, report)
+            batch = []
+    if batch:
+        await _import_batch(db, batch, report)
+    return report.dict()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/26
+# @File           : conftest.py
+# @desc           : Test application on sqlite and an in-memory redis
+"""
+The application runs against a temporary sqlite database and fakeredis, no MySQL or redis server
+is needed. The configuration is patched before any application module reads it, so this module
+must stay free of application imports at the top.
+
+Install the test dependencies with: pip install -r requirements-dev.txt
+"""
+import asyncio
+import itertools
+import os
+import tempfile
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+import redis
+import redis.asyncio
+
+os.environ["DEBUG"] = "false"
+_DB_PATH = os.path.join(tempfile.mkdtemp(prefix="apartment-test-"), "test.db")
+
+import config.production as _config  # noqa: E402
+
+_config.SQLALCHEMY_DATABASE_URL = f"sqlite:///{_DB_PATH}"
+_config.ASYNC_SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{_DB_PATH}"
+_config.SQLALCHEMY_REPLICA_URLS = []
+_config.ASYNC_SQLALCHEMY_REPLICA_URLS = []
+
+_redis_server = fakeredis.FakeServer()
+redis.asyncio.from_url = lambda *args, **kwargs: fakeredis.aioredis.FakeRedis(
+    server=_redis_server, decode_responses=True
+)
+redis.Redis.from_url = classmethod(lambda cls, *args, **kwargs: fakeredis.FakeRedis(
+    server=_redis_server, decode_responses=True
+))
+
+ADMIN_TELEPHONE = "13800000000"
+ADMIN_PASSWORD = "123456"
+
+
+@pytest.fixture(scope="session")
+def app():
+    from core import migration
+    from scripts import initialize
+    import main
+
+    migration.upgrade()
+    asyncio.run(initialize.migrate())
+    return main.create_app()
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    response = client.post("/api/user/login", json={"username": ADMIN_TELEPHONE, "password": ADMIN_PASSWORD})
+    return {"Authorization": f"Bearer {response.json()['data']['access_token']}"}
+
+
+@pytest.fixture(scope="session")
+def new_telephone():
+    numbers = itertools.count(13600000000)
+    return lambda: str(next(numbers))
+
+
+@pytest.fixture(scope="session")
+def login(client):
+    def login(telephone: str, password: str) -> dict:
+        response = client.post("/api/user/login", json={"username": telephone, "password": password})
+        assert response.json()["code"] == 200, response.json()
+        return response.json()["data"]
+
+    return login
+
+
+@pytest.fixture(scope="session")
+def create_user(client, admin_headers, new_telephone):
+    def create_user(role_ids=(), dept_ids=(), password="abc12345") -> str:
+        telephone = new_telephone()
+        response = client.post("/api/admin/system/user", headers=admin_headers, json={
+            "telephone": telephone, "name": f"user{telephone[-4:]}", "password": password, "is_staff": True,
+            "role_ids": list(role_ids), "dept_ids": list(dept_ids)
+        })
+        assert response.json()["code"] == 200, response.json()
+        return telephone
+
+    return create_user
+
+
+@pytest.fixture(scope="session")
+def create_role(client, admin_headers):
+    names = itertools.count()
+
+    def create_role(data_range: int, menu_ids=(), dept_ids=()) -> int:
+        role_key = f"role{next(names)}"
+        response = client.post("/api/admin/system/role", headers=admin_headers, json={
+            "role_key": role_key, "name": role_key, "data_range": data_range,
+            "menu_ids": list(menu_ids), "dept_ids": list(dept_ids)
+        })
+        assert response.json()["code"] == 200, response.json()
+        response = client.get(f"/api/admin/system/role?role_key={role_key}&limit=100", headers=admin_headers)
+        return next(role["id"] for role in response.json()["data"]["list"] if role["role_key"] == role_key)
+
+    return create_role
+
+
+@pytest.fixture(scope="session")
+def create_department(client, admin_headers):
+    from sqlalchemy import select, func
+    from core.database import engine
+    from models.user import Department
+
+    names = itertools.count()
+
+    def create_department(parent_id: int = None) -> int:
+        name = f"dept{next(names)}"
+        response = client.post("/api/admin/system/department", headers=admin_headers, json={
+            "name": name, "dept_key": name, "parent_id": parent_id
+        })
+        assert response.json()["code"] == 200, response.json()
+        with engine.connect() as conn:
+            return conn.scalar(select(func.max(Department.id)).where(Department.name == name))
+
+    return create_department
+
+
+@pytest.fixture(scope="session")
+def menu_ids(client, admin_headers):
+    def flatten(nodes):
+        return [item for node in nodes for item in [node["id"], *flatten(node["children"] or [])]]
+
+    return flatten(client.get("/api/admin/system/menu?mode=1", headers=admin_headers).json()["data"])
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/27
+# @File           : test_auth.py
+# @desc           : Login lockout, refresh token rotation and permission masks
+"""
+Every test works on users of its own, failed logins are sent from an ip of their own through
+LOGIN_CLIENT_IP_HEADER so the ip counters of the tests do not add up.
+"""
+import itertools
+
+import pytest
+
+from config import settings
+from services.permission import PermissionRegistry, has_permission, ALL_PERMISSIONS, ALL_PERMISSIONS_MASK
+
+_ips = itertools.count(1)
+
+
+@pytest.fixture
+def client_ip(monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_CLIENT_IP_HEADER", "X-Forwarded-For")
+    return lambda: f"10.0.0.{next(_ips)}"
+
+
+def _login(client, telephone, password, ip):
+    headers = {"X-Forwarded-For": f"203.0.113.7, {ip}"}
+    return client.post("/api/user/login", headers=headers, json={"username": telephone, "password": password}).json()
+
+
+def test_telephone_locked_after_failures(client, create_user, client_ip):
+    telephone = create_user()
+    for _ in range(settings.DEFAULT_AUTH_ERROR_MAX_NUMBER):
+        assert _login(client, telephone, "wrong-password", client_ip())["code"] != 200
+    # The right password is refused while locked, from any ip
+    assert _login(client, telephone, "abc12345", client_ip())["code"] == 429
+
+
+def test_successful_login_resets_failures(client, create_user, client_ip):
+    telephone = create_user()
+    ip = client_ip()
+    for _ in range(settings.DEFAULT_AUTH_ERROR_MAX_NUMBER - 1):
+        _login(client, telephone, "wrong-password", ip)
+    assert _login(client, telephone, "abc12345", ip)["code"] == 200
+    assert _login(client, telephone, "wrong-password", ip)["code"] != 429
+    assert _login(client, telephone, "abc12345", ip)["code"] == 200
+
+
+def test_ip_locked_across_telephones(client, new_telephone, create_user, client_ip, monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_IP_ERROR_MAX_NUMBER", 3)
+    telephone = create_user()
+    ip = client_ip()
+    for _ in range(3):
+        _login(client, new_telephone(), "wrong-password", ip)
+    assert _login(client, telephone, "abc12345", ip)["code"] == 429
+    # Only the address added by the proxy counts, other clients are not locked
+    assert _login(client, telephone, "abc12345", client_ip())["code"] == 200
+
+
+def test_ip_lock_disabled(client, new_telephone, create_user, client_ip, monkeypatch):
+    monkeypatch.setattr(settings, "LOGIN_IP_ERROR_MAX_NUMBER", 0)
+    telephone = create_user()
+    ip = client_ip()
+    for _ in range(3):
+        _login(client, new_telephone(), "wrong-password", ip)
+    assert _login(client, telephone, "abc12345", ip)["code"] == 200
+
+
+def _refresh(client, refresh_token):
+    return client.post("/api/user/refresh", json={"refresh_token": refresh_token}).json()
+
+
+def test_refresh_rotates_token(client, create_user, login):
+    tokens = login(create_user(), "abc12345")
+    response = _refresh(client, tokens["refresh_token"])
+    assert response["code"] == 200
+    assert response["data"]["refresh_token"] != tokens["refresh_token"]
+    assert _refresh(client, response["data"]["refresh_token"])["code"] == 200
+
+
+def test_refresh_reuse_revokes_family(client, create_user, login):
+    telephone = create_user()
+    tokens = login(telephone, "abc12345")
+    rotated = _refresh(client, tokens["refresh_token"])["data"]["refresh_token"]
+    other = login(telephone, "abc12345")["refresh_token"]
+
+    assert _refresh(client, tokens["refresh_token"])["code"] == 401
+    # The rotated token belongs to the leaked family, the session started by the other login is untouched
+    assert _refresh(client, rotated)["code"] == 401
+    assert _refresh(client, other)["code"] == 200
+
+
+def test_password_change_revokes_refresh_tokens(client, admin_headers, create_user, login):
+    telephone = create_user()
+    tokens = login(telephone, "abc12345")
+    response = client.put(f"/api/admin/system/user/{tokens['id']}", headers=admin_headers, json={
+        "telephone": telephone, "name": "renamed", "password": "def12345", "is_staff": True
+    })
+    assert response.json()["code"] == 200
+
+    assert _refresh(client, tokens["refresh_token"])["code"] == 401
+    assert _refresh(client, login(telephone, "def12345")["refresh_token"])["code"] == 200
+
+
+def test_registry_layout_ignores_declaration_order():
+    first, second = PermissionRegistry(), PermissionRegistry()
+    first.declare(["system.user.index", "system.role.list"])
+    first.declare(["system.menu.create"])
+    second.declare(["system.menu.create", "system.role.list"])
+    second.declare(["system.user.index"])
+    assert first.layout == second.layout
+    assert first.compile(["system.role.list"]) == second.compile(["system.role.list"])
+
+
+def test_registry_masks():
+    registry = PermissionRegistry()
+    required = registry.compile(["system.user.index"])
+    assert required == registry.mask(["system.user.index"])
+    # Permissions no route declares get no bit
+    assert registry.mask(["system.unknown"]) == 0
+    assert registry.mask([ALL_PERMISSIONS]) == ALL_PERMISSIONS_MASK
+
+    assert has_permission(registry.mask(["system.user.index", "system.unknown"]), required)
+    assert not has_permission(registry.mask(["system.unknown"]), required)
+    assert has_permission(ALL_PERMISSIONS_MASK, required)
+    assert has_permission(0, 0)
+
+
+def test_registry_recompiles_after_new_declaration():
+    registry = PermissionRegistry()
+    user_mask = registry.mask(["system.user.index"])
+    layout = registry.layout
+    registry.declare(["system.user.index"])
+    assert registry.layout != layout
+    assert not has_permission(user_mask, registry.compile(["system.user.index"]))
+    assert has_permission(registry.mask(["system.user.index"]), registry.compile(["system.user.index"]))
+
+
+def test_route_permissions(client, create_user, create_role, login, menu_ids):
+    without = login(create_user(), "abc12345")["access_token"]
+    role_id = create_role(1, menu_ids)
+    granted = login(create_user(role_ids=[role_id]), "abc12345")["access_token"]
+
+    response = client.get("/api/admin/system/user", headers={"Authorization": f"Bearer {without}"})
+    assert response.json()["code"] == 403
+    response = client.get("/api/admin/system/user", headers={"Authorization": f"Bearer {granted}"})
+    assert response.json()["code"] == 200
+    # No seeded menu grants system.role.list
+    response = client.get("/api/admin/system/role", headers={"Authorization": f"Bearer {granted}"})
+    assert response.json()["code"] == 403
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/27
+# @File           : test_cache.py
+# @desc           : Function result cache
+"""
+The cache runs on an in-memory redis of its own, a redis that raises on every command stands in
+for an unreachable server.
+"""
+import asyncio
+import uuid
+from unittest import mock
+
+import fakeredis.aioredis
+import orjson
+import pytest
+from redis.exceptions import ConnectionError
+
+from core import cache
+
+
+class UnreachableRedis:
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            raise ConnectionError("redis is unreachable")
+
+        return command
+
+
+@pytest.fixture
+def use_redis():
+    previous = cache.get_current_redis()
+
+    def use_redis(rd):
+        cache.set_current_redis(rd)
+
+    yield use_redis
+    cache.set_current_redis(previous)
+
+
+def _counted(result=None, delay: float = 0):
+    calls = []
+    namespace = uuid.uuid4().hex
+
+    @cache.cached(ttl=60, tags=("test:{tp}",), key=lambda tp: f"{namespace}:{tp}")
+    async def load(tp):
+        calls.append(tp)
+        await asyncio.sleep(delay)
+        return result if result is not None else {"tp": tp, "items": [1, 2]}
+
+    return load, calls
+
+
+def test_concurrent_misses_load_once(use_redis):
+    load, calls = _counted(delay=0.05)
+
+    async def main():
+        use_redis(fakeredis.aioredis.FakeRedis(decode_responses=True))
+        results = await asyncio.gather(*(load("a") for _ in range(20)))
+        results[0]["items"].append(3)
+        return results, await load("a")
+
+    results, again = asyncio.run(main())
+    assert calls == ["a"]
+    # Every caller gets a copy of its own
+    assert all(result == {"tp": "a", "items": [1, 2]} for result in results[1:])
+    assert again == {"tp": "a", "items": [1, 2]}
+
+
+def test_waits_for_lock_held_by_another_worker(use_redis):
+    load, calls = _counted()
+
+    async def main():
+        rd = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        use_redis(rd)
+        key = load.cache_key("b")
+        await rd.set(cache._lock_key(key), "other-worker", ex=10)
+
+        async def other_worker():
+            await asyncio.sleep(0.1)
+            await rd.set(key, orjson.dumps({"v": {"from": "other"}, "exp": 2 ** 40}))
+
+        result, _ = await asyncio.gather(load("b"), other_worker())
+        return result
+
+    assert asyncio.run(main()) == {"from": "other"}
+    assert calls == []
+
+
+def test_invalidate_tags(use_redis):
+    load, calls = _counted()
+
+    async def main():
+        use_redis(fakeredis.aioredis.FakeRedis(decode_responses=True))
+        await load("c")
+        await load("c")
+        await cache.invalidate_tags("test:c")
+        await load("c")
+
+    asyncio.run(main())
+    assert calls == ["c", "c"]
+
+
+def test_unreachable_redis_falls_back_to_local(use_redis):
+    load, calls = _counted()
+
+    async def main():
+        use_redis(UnreachableRedis())
+        first = await load("d")
+        first["items"].clear()
+        return await load("d")
+
+    assert asyncio.run(main()) == {"tp": "d", "items": [1, 2]}
+    assert calls == ["d"]
+
+
+def test_none_result_is_cached(use_redis):
+    calls = []
+    namespace = uuid.uuid4().hex
+
+    @cache.cached(ttl=60, key=lambda: namespace)
+    async def load():
+        calls.append(1)
+        return None
+
+    async def main():
+        use_redis(UnreachableRedis())
+        return [await load(), await load()]
+
+    assert asyncio.run(main()) == [None, None]
+    assert calls == [1]
+
+
+def test_sync_unreachable_redis_falls_back_to_local():
+    calls = []
+    namespace = uuid.uuid4().hex
+
+    @cache.cached(ttl=60, key=lambda tp: f"{namespace}:{tp}")
+    def load(tp):
+        calls.append(tp)
+        return {"tp": tp}
+
+    with mock.patch.object(cache, "get_sync_redis", return_value=UnreachableRedis()):
+        assert load("e") == {"tp": "e"}
+        assert load("e") == {"tp": "e"}
+    assert calls == ["e"]
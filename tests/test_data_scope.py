@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/27
+# @File           : test_data_scope.py
+# @desc           : Department closure maintenance and role data scopes
+"""
+The closure table is compared with the one computed from departments.parent_id after every change,
+data scopes are checked through the user list of users holding a single scope.
+"""
+import pytest
+from sqlalchemy import select
+
+from core.closure import rows_from_parents
+from core.database import engine
+from models.user import Department, DepartmentClosure
+from services import data_scope
+
+
+def _closure_matches_parents():
+    with engine.connect() as conn:
+        pairs = conn.execute(select(Department.id, Department.parent_id)).all()
+        closure = conn.execute(select(DepartmentClosure.ancestor_id, DepartmentClosure.descendant_id,
+                                      DepartmentClosure.depth)).all()
+    expected = {(row["ancestor_id"], row["descendant_id"], row["depth"]) for row in rows_from_parents(pairs)}
+    return set(map(tuple, closure)) == expected
+
+
+def _move(client, admin_headers, dept_id, parent_id):
+    return client.put(f"/api/admin/system/department/{dept_id}", headers=admin_headers, json={
+        "name": f"moved{dept_id}", "dept_key": f"moved{dept_id}", "parent_id": parent_id
+    }).json()
+
+
+def test_closure_follows_create_move_delete(client, admin_headers, create_department):
+    top = create_department()
+    child = create_department(top)
+    grandchild = create_department(child)
+    other = create_department()
+    assert _closure_matches_parents()
+
+    assert _move(client, admin_headers, child, other)["code"] == 200
+    assert _closure_matches_parents()
+    with engine.connect() as conn:
+        ancestors = conn.scalars(select(DepartmentClosure.ancestor_id)
+                                 .where(DepartmentClosure.descendant_id == grandchild)).all()
+    assert sorted(ancestors) == sorted([grandchild, child, other])
+
+    response = client.request("DELETE", "/api/admin/system/department", headers=admin_headers, json=[grandchild])
+    assert response.json()["code"] == 200
+    assert _closure_matches_parents()
+
+
+def test_move_under_own_subtree_refused(client, admin_headers, create_department):
+    top = create_department()
+    child = create_department(top)
+    assert _move(client, admin_headers, top, child)["code"] != 200
+    assert _move(client, admin_headers, top, top)["code"] != 200
+    assert _closure_matches_parents()
+
+
+@pytest.fixture
+def tree(create_department):
+    root = create_department()
+    child = create_department(root)
+    sibling = create_department()
+    return {"root": root, "child": child, "sibling": sibling}
+
+
+@pytest.fixture
+def members(create_user, tree):
+    return {name: create_user(dept_ids=[dept_id]) for name, dept_id in tree.items()}
+
+
+def _visible(client, login, create_user, create_role, menu_ids, data_range, dept_ids=(), role_dept_ids=()):
+    roles = [create_role(data_range, menu_ids, role_dept_ids)] if data_range else []
+    telephone = create_user(role_ids=roles, dept_ids=dept_ids)
+    token = login(telephone, "abc12345")["access_token"]
+    response = client.get("/api/admin/system/user?limit=1000", headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["code"] == 200, response.json()
+    return telephone, {item["telephone"] for item in response.json()["data"]["list"]}
+
+
+def test_scope_all(client, login, create_user, create_role, menu_ids, members):
+    _, visible = _visible(client, login, create_user, create_role, menu_ids, data_scope.DATA_SCOPE_ALL)
+    assert set(members.values()) <= visible
+
+
+def test_scope_custom_departments(client, login, create_user, create_role, menu_ids, tree, members):
+    _, visible = _visible(client, login, create_user, create_role, menu_ids, data_scope.DATA_SCOPE_CUSTOM,
+                          role_dept_ids=[tree["sibling"]])
+    assert visible == {members["sibling"]}
+
+
+def test_scope_own_department(client, login, create_user, create_role, menu_ids, tree, members):
+    me, visible = _visible(client, login, create_user, create_role, menu_ids, data_scope.DATA_SCOPE_DEPT,
+                           dept_ids=[tree["root"]])
+    assert visible == {me, members["root"]}
+
+
+def test_scope_department_and_children(client, login, create_user, create_role, menu_ids, tree, members):
+    me, visible = _visible(client, login, create_user, create_role, menu_ids,
+                           data_scope.DATA_SCOPE_DEPT_AND_CHILDREN, dept_ids=[tree["root"]])
+    assert visible == {me, members["root"], members["child"]}
+
+
+def test_scope_self(client, login, create_user, create_role, menu_ids, tree):
+    me, visible = _visible(client, login, create_user, create_role, menu_ids, data_scope.DATA_SCOPE_SELF,
+                           dept_ids=[tree["root"]])
+    assert visible == {me}
+
+
+def test_scope_follows_moved_department(client, admin_headers, login, create_user, create_role, create_department,
+                                        menu_ids):
+    root, other = create_department(), create_department()
+    member = create_user(dept_ids=[other])
+    role_id = create_role(data_scope.DATA_SCOPE_DEPT_AND_CHILDREN, menu_ids)
+    token = login(create_user(role_ids=[role_id], dept_ids=[root]), "abc12345")["access_token"]
+
+    def visible():
+        response = client.get("/api/admin/system/user?limit=1000", headers={"Authorization": f"Bearer {token}"})
+        return {item["telephone"] for item in response.json()["data"]["list"]}
+
+    assert member not in visible()
+    assert _move(client, admin_headers, other, root)["code"] == 200
+    assert member in visible()
+
+
+def test_principal_without_scope_sees_only_itself():
+    from services.auth import Principal
+
+    principal = Principal(id=42, telephone="13600000042", disabled=False, is_staff=True, is_admin=False)
+    condition = data_scope.user_scope(principal)
+    assert str(condition.compile(compile_kwargs={"literal_binds": True})) == "users.id = 42"
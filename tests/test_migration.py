@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/27
+# @File           : test_migration.py
+# @desc           : Schema migrations
+"""
+Migrations run against a database of their own, the schema they build must equal the models and
+data written under an old version must be carried over by the backfills.
+"""
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from core import migration
+from core.database import Base
+from models import data_dict  # noqa: F401, registers the dictionary tables on Base
+from models.user import user_search_index
+
+
+@pytest.fixture
+def migrate_engine(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    monkeypatch.setattr(migration, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def _schema(engine) -> dict:
+    inspector = inspect(engine)
+    schema = {}
+    for table in inspector.get_table_names():
+        if table == migration.schema_version.name:
+            continue
+        schema[table] = (
+            sorted((column["name"], str(column["type"]), column["nullable"])
+                   for column in inspector.get_columns(table)),
+            sorted((index["name"], tuple(index["column_names"]), bool(index["unique"]))
+                   for index in inspector.get_indexes(table)),
+            sorted((tuple(key["constrained_columns"]), key["referred_table"])
+                   for key in inspector.get_foreign_keys(table)),
+            inspector.get_pk_constraint(table)["constrained_columns"],
+        )
+    return schema
+
+
+def test_upgrade_builds_model_schema(migrate_engine, tmp_path):
+    assert migration.upgrade() == [version for version, _ in migration.discover()]
+    assert migration.upgrade() == []
+
+    models_engine = create_engine(f"sqlite:///{tmp_path / 'models.db'}")
+    Base.metadata.create_all(models_engine)
+    assert _schema(migrate_engine) == _schema(models_engine)
+    models_engine.dispose()
+
+
+def test_upgrade_backfills_existing_rows(migrate_engine):
+    assert migration.upgrade(1) == [1]
+    with migrate_engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO users (id, telephone, password, name, disabled, is_staff, created_at, updated_at) "
+            "VALUES (7, '13912345678', 'x', '王小明', 0, 0, '2024-01-01 00:00:00', '2024-02-02 00:00:00')"
+        ))
+        conn.execute(text(
+            "INSERT INTO departments (id, name, dept_key, disabled, parent_id, created_at, updated_at) VALUES "
+            "(1, 'top', 'top', 0, NULL, '2024-01-01', '2024-01-01'), "
+            "(2, 'child', 'child', 0, 1, '2024-01-01', '2024-01-01')"
+        ))
+        conn.execute(text(
+            "INSERT INTO roles (id, role_key, name, is_admin, disabled, data_range, \"order\", created_at, updated_at) "
+            "VALUES (1, 'old', 'old', 0, 0, 0, 0, '2024-01-01', '2024-01-01')"
+        ))
+
+    assert migration.upgrade() == [version for version, _ in migration.discover() if version > 1]
+    with migrate_engine.connect() as conn:
+        user = conn.execute(text("SELECT telephone_rev, auth_version, updated_at FROM users")).one()
+        grams = set(conn.execute(text("SELECT row_id, field, gram FROM user_ngrams")).all())
+        closure = set(conn.execute(text("SELECT ancestor_id, descendant_id, depth FROM department_closure")).all())
+        data_range = conn.scalar(text("SELECT data_range FROM roles"))
+    assert tuple(user) == ("87654321931", 0, "2024-02-02 00:00:00")
+    assert grams == {(row["row_id"], row["field"], row["gram"])
+                     for row in user_search_index.rows(7, {"name": "王小明", "telephone": "13912345678"})}
+    assert closure == {(1, 1, 0), (2, 2, 0), (1, 2, 1)}
+    assert data_range == 1
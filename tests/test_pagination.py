@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/27
+# @File           : test_pagination.py
+# @desc           : Keyset cursors and count strategies
+"""
+Walking the cursors must return the same rows in the same order as one query with the same sort,
+NULL sort values included: they sort first ascending and last descending, as on MySQL.
+"""
+from urllib.parse import urlencode
+
+import pytest
+
+GENDERS = [None, "1", None, "0", "1", None, "0"]
+
+
+@pytest.fixture(scope="module")
+def keyset_users(client, admin_headers, new_telephone):
+    users = []
+    for gender in GENDERS:
+        telephone = new_telephone()
+        response = client.post("/api/admin/system/user", headers=admin_headers, json={
+            "telephone": telephone, "name": "keyset", "gender": gender, "is_staff": True
+        })
+        assert response.json()["code"] == 200
+        users.append((telephone, gender))
+    response = client.get("/api/admin/system/user?name=keyset&limit=100", headers=admin_headers)
+    ids = {item["telephone"]: item["id"] for item in response.json()["data"]["list"]}
+    return [(ids[telephone], gender) for telephone, gender in users]
+
+
+def _walk(client, admin_headers, query):
+    rows, cursor = [], ""
+    while cursor is not None:
+        response = client.get(f"/api/admin/system/user?name=keyset&limit=2&{query}&{urlencode({'v_cursor': cursor})}",
+                              headers=admin_headers)
+        data = response.json()["data"]
+        assert len(data["list"]) <= 2
+        rows.extend(item["id"] for item in data["list"])
+        cursor = data["next_cursor"]
+    return rows
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_keyset_walk_with_nulls(client, admin_headers, keyset_users, order):
+    desc = order == "desc"
+    # NULL first ascending, last descending, ties broken by id in the same direction
+    expected = sorted(keyset_users, key=lambda row: (row[1] is not None, row[1] or "", row[0]), reverse=desc)
+    rows = _walk(client, admin_headers, f"v_order_field=gender&v_order={order}")
+    assert rows == [row[0] for row in expected]
+
+
+def test_keyset_walk_by_id(client, admin_headers, keyset_users):
+    assert _walk(client, admin_headers, "v_order=desc") == sorted((row[0] for row in keyset_users), reverse=True)
+
+
+def test_cursor_of_another_sort_refused(client, admin_headers, keyset_users):
+    response = client.get("/api/admin/system/user?name=keyset&limit=2&v_cursor=&v_order_field=gender",
+                          headers=admin_headers)
+    cursor = response.json()["data"]["next_cursor"]
+    response = client.get(f"/api/admin/system/user?name=keyset&limit=2&v_order_field=gender&v_order=desc"
+                          f"&{urlencode({'v_cursor': cursor})}", headers=admin_headers)
+    assert response.json()["code"] != 200
+
+
+def _total(client, admin_headers, strategy):
+    response = client.get(f"/api/admin/system/user?limit=1&v_count={strategy}", headers=admin_headers)
+    data = response.json()["data"]
+    return data["total"], data["count_strategy"]
+
+
+def test_cached_count_invalidated_by_writes(client, admin_headers, create_user):
+    total, strategy = _total(client, admin_headers, "cached")
+    assert strategy == "cached"
+    assert _total(client, admin_headers, "cached") == (total, "cached")
+    assert _total(client, admin_headers, "exact") == (total, "exact")
+
+    create_user()
+    assert _total(client, admin_headers, "cached") == (total + 1, "cached")
+
+
+def test_estimate_falls_back_to_exact(client, admin_headers):
+    # Only MySQL plans carry row estimates
+    total, strategy = _total(client, admin_headers, "estimate")
+    assert strategy == "exact"
+    assert _total(client, admin_headers, "exact") == (total, "exact")
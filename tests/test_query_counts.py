@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/26
+# @File           : test_query_counts.py
+# @desc           : Query count budgets of list endpoints
+"""
+Every list endpoint has a fixed statement budget whatever the number of rows, a lazy relationship
+loaded per row shows up as a failed budget. Rows are created first so an N+1 pattern would exceed it.
+"""
+import pytest
+
+from core.query_tracker import assert_max_queries
+
+ROWS = 6
+
+
+@pytest.fixture(scope="module")
+def seeded(client, admin_headers):
+    for i in range(ROWS):
+        response = client.post("/api/admin/system/role", headers=admin_headers, json={
+            "role_key": f"budget{i}", "name": f"budget{i}", "menu_ids": [1, 2, 3], "dept_ids": [1]
+        })
+        assert response.json()["code"] == 200
+        response = client.post("/api/admin/system/user", headers=admin_headers, json={
+            "telephone": f"1370000000{i}", "name": f"budget{i}", "role_ids": [1], "dept_ids": [1]
+        })
+        assert response.json()["code"] == 200
+
+
+@pytest.mark.parametrize("url, budget", [
+    # principal, count, roles, menus of the roles
+    ("/api/admin/system/role?limit=20", 3),
+    ("/api/admin/system/role?limit=20&v_cursor=", 3),
+    # principal, count, users, roles of the users
+    ("/api/admin/system/user?limit=20", 4),
+    ("/api/admin/system/user?limit=20&v_cursor=", 4),
+])
+def test_list_query_budget(client, admin_headers, seeded, url, budget):
+    route = f"GET {url.split('?')[0]}"
+    with assert_max_queries(budget, route=route) as captured:
+        response = client.get(url, headers=admin_headers)
+    assert response.status_code == 200
+    assert len(response.json()["data"]["list"]) > ROWS
+    assert [item.route for item in captured] == [route]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# @Project        : Apartment-partner-server
+# @version        : 1.0
+# @Create Time    : 2025/4/27
+# @File           : test_search.py
+# @desc           : n-gram search against plain LIKE
+"""
+The user list filters name and telephone through the n-gram index, it must return exactly the rows
+a plain LIKE returns, terms with LIKE wildcards and terms shorter than a gram included.
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select, insert, func, create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+from core.database import engine, Base
+from models.user import User, UserNgram, user_search_index
+
+NAMES = ["张三丰", "张三", "a_b王", "a%b李", "axb赵", "AXB钱", "c\\d孙", "c\\\\d周"]
+
+
+@pytest.fixture(scope="module")
+def searchable(client, admin_headers, new_telephone):
+    telephones = []
+    for name in NAMES:
+        telephone = new_telephone()
+        response = client.post("/api/admin/system/user", headers=admin_headers, json={
+            "telephone": telephone, "name": name, "is_staff": True
+        })
+        assert response.json()["code"] == 200, response.json()
+        telephones.append(telephone)
+    return telephones
+
+
+def _listed(client, admin_headers, query, telephones):
+    response = client.get("/api/admin/system/user", headers=admin_headers, params={**query, "limit": 1000})
+    return {item["telephone"] for item in response.json()["data"]["list"]} & set(telephones)
+
+
+def _like(column, pattern, telephones):
+    with engine.connect() as conn:
+        return set(conn.scalars(select(User.telephone).where(column.like(pattern), User.telephone.in_(telephones))))
+
+
+@pytest.mark.parametrize("term", ["张三", "三丰", "张", "a_b", "a%b", "xb", "axb", "c\\d", "c\\\\d", "b赵"])
+def test_name_search_matches_like(client, admin_headers, searchable, term):
+    expected = _like(func.lower(User.name), f"%{term.lower()}%", searchable)
+    assert _listed(client, admin_headers, {"name": term}, searchable) == expected
+
+
+def test_telephone_search_matches_like(client, admin_headers, searchable):
+    for term in [searchable[0][-5:], searchable[0][3:8], "36"]:
+        expected = _like(User.telephone, f"%{term}%", searchable)
+        assert _listed(client, admin_headers, {"telephone": term}, searchable) == expected
+    suffix = searchable[-1][-4:]
+    expected = _like(User.telephone, f"%{suffix}", searchable)
+    assert _listed(client, admin_headers, {"telephone_suffix": suffix}, searchable) == expected
+
+
+def test_index_maintained_on_update(client, admin_headers, searchable):
+    response = client.get("/api/admin/system/user", headers=admin_headers, params={"telephone": searchable[0]})
+    user_id = response.json()["data"]["list"][0]["id"]
+    response = client.put(f"/api/admin/system/user/{user_id}", headers=admin_headers, json={
+        "telephone": searchable[0], "name": "李四光", "is_staff": True
+    })
+    assert response.json()["code"] == 200
+    assert searchable[0] in _listed(client, admin_headers, {"name": "四光"}, searchable)
+    assert searchable[0] not in _listed(client, admin_headers, {"name": "三丰"}, searchable)
+
+
+def test_rebuild_in_batches(tmp_path):
+    url = f"sqlite:///{tmp_path / 'search.db'}"
+    Base.metadata.create_all(create_engine(url))
+    now = datetime.now()
+    users = [{"telephone": f"1390000000{i}", "name": name, "password": "x", "disabled": False, "is_staff": False,
+              "created_at": now, "updated_at": now} for i, name in enumerate(NAMES)]
+
+    async def rebuild():
+        async_engine = create_async_engine(url.replace("sqlite", "sqlite+aiosqlite"))
+        try:
+            async with AsyncSession(async_engine) as db:
+                # Core inserts bypass the ORM events, the index starts empty
+                await db.execute(insert(User), users)
+                total = await user_search_index.rebuild(db, batch_size=3)
+                await db.commit()
+                grams = set((await db.execute(select(UserNgram.row_id, UserNgram.field, UserNgram.gram))).all())
+                rows = (await db.execute(select(User.id, User.name, User.telephone))).all()
+            return total, grams, rows
+        finally:
+            await async_engine.dispose()
+
+    total, grams, rows = asyncio.run(rebuild())
+    assert total == len(NAMES)
+    expected = {(item["row_id"], item["field"], item["gram"]) for row in rows
+                for item in user_search_index.rows(row.id, {"name": row.name, "telephone": row.telephone})}
+    assert grams == expected